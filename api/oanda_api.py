@@ -1,22 +1,69 @@
 # In this script, the oanda api class is created to access the account endpoints
 # at instantiation, a session is made with the header updated with authorization and content-Type 
 
+import json
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import cridentials.crid as crid
+from api.rate_limiter import TokenBucket
+from api.retry import CircuitBreaker, RequestStats, backoff_delay, retry_after_seconds
+from infrastructure.instrumentation import instrumented, record_response, df_rows
+import numpy as np
 import pandas as pd
-from dateutil import parser
 from datetime import datetime as dt
 
+# orjson decodes the candle responses a lot faster than the standard json module, it is used when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+
+POOL_SIZE = 10 # keep-alive connections kept open to the broker
+RATE_LIMIT = 100 # requests per second, oanda allows 120 on the rest api
+MAX_RETRIES = 5 # retries of a throttled (429), failing (5xx) or broken (connection error, timeout) request
+RETRY_CODES = [429, 500, 502, 503, 504]
+
+# (connect, read) timeouts in seconds by the last part of the endpoint, the candle chunks are the slowest responses
+TIMEOUTS = {
+    'candles': (5, 30),
+}
+DEFAULT_TIMEOUT = (5, 10)
+
+def get_timeout(url):
+    return TIMEOUTS.get(url.rstrip('/').split('/')[-1], DEFAULT_TIMEOUT)
+
+def read_json(response):
+    try:
+        return json_loads(response.content)
+    except ValueError:
+        return {'errorMessage': response.text, 'status_code': response.status_code}
 
 class OandaApi:
 
-    def __init__(self):
+    def __init__(self, base_url=None, pool_size=POOL_SIZE, rate_limit=RATE_LIMIT, max_retries=MAX_RETRIES, breaker=None):
+        # base_url can point the api at a local stub server (see api/stub_server.py) instead of the broker.
+        # pool_size should be at least the number of threads sharing this object, rate_limit=None disables the token bucket.
+        # max_retries and the circuit breaker control how make_request deals with throttling and errors,
+        # stats counts the requests, retries and the time spent waiting.
+        self.base_url = crid.oanda_url if base_url is None else base_url
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
         self.session.headers.update({
             'Authorization': f'Bearer {crid.api_key}',
             'Content-Type': 'application/json'
         })
+        self.session.hooks['response'].append(record_response) # api latency and bytes, when the instrumentation is enabled
+        self.limiter = None if rate_limit is None else TokenBucket(rate_limit)
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker() if breaker is None else breaker
+        self.stats = RequestStats()
 
+    @instrumented('make_request')
     def make_request(self, url, verb='get', code=200, params=None, data=None, headers=None):
         '''make_request makes requests to the oanda base url with the following parameters:
         =========
@@ -30,23 +77,56 @@ class OandaApi:
         =========
         code: int.
         status code of the request 200 if the request is okay
+
+        throttled (429) and server error (5xx) responses, connection errors and timeouts are retried up to max_retries times,
+        waiting for the Retry-After header or an exponential backoff with jitter. the circuit breaker pauses every request
+        when the error rate of the recent ones spikes. other error responses are returned straight away.
         '''
         
-        full_url = f'{crid.oanda_url}/{url}'
-        try:
+        full_url = f'{self.base_url}/{url}'
+        timeout = get_timeout(url)
+        attempt = 0
+
+        while True:
+            self.stats.add('breaker_wait', self.breaker.wait()) # the request is held while the circuit breaker is open
+            if self.limiter is not None:
+                self.stats.add('rate_limit_wait', self.limiter.acquire())
+            self.stats.add('requests')
+
             response = None # responce is the variable I want to assign to the response that will be returned from the api
             # it is initialized to None when a request hasn't been made.
-            if verb == 'get': # a get request is made when the verb is get
-                response = self.session.get(full_url, params=params, data=data, headers=headers)
-            if response == None: # if there is a typo or a strange verb is provided then a successful request has not been made 
-                # which implies that the response is still None. The function returns false.
-                return False, {'error': 'verb not found'}
-            if response.status_code == code: # if the status code is 200, it means the request ran successfully
-                return True, response.json()# so we return the True and the json file from the api
-            else:
-                return False, response.json() # if the function returns false, the i want to know the reson for the error
-        except Exception as error:
-            return False, {'Exception': error}# here the error is returned to enable us fix the error
+            try:
+                if verb == 'get': # a get request is made when the verb is get
+                    response = self.session.get(full_url, params=params, data=data, headers=headers, timeout=timeout)
+                if response == None: # if there is a typo or a strange verb is provided then a successful request has not been made 
+                    # which implies that the response is still None. The function returns false.
+                    return False, {'error': 'verb not found'}
+                if response.status_code == code: # if the status code is 200, it means the request ran successfully
+                    self.breaker.record(True)
+                    return True, json_loads(response.content)# so we return the True and the json file from the api
+                if response.status_code not in RETRY_CODES:
+                    # the broker understood the request and refused it, asking again will not help
+                    self.breaker.record(True)
+                    return False, read_json(response) # if the function returns false, the i want to know the reson for the error
+                result = read_json(response)
+            except requests.exceptions.RequestException as error: # connection errors and timeouts are retried
+                result = {'Exception': error}
+            except Exception as error:
+                return False, {'Exception': error}# here the error is returned to enable us fix the error
+
+            self.breaker.record(False)
+            if attempt >= self.max_retries:
+                self.stats.add('failures')
+                return False, result
+
+            # the broker's Retry-After is used when it sends one, otherwise the delay grows exponentially with jitter
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt)
+            self.stats.add('retries')
+            self.stats.add('retry_wait', delay)
+            time.sleep(delay)
+            attempt += 1
         
     def get_account_ep(self, ep, data_key): # exploring other endpoint, other sub endpoints will be disocvered 
         # to access these end points, the base url is taken and the account id is attached before the particular sub endpoint
@@ -89,6 +169,7 @@ class OandaApi:
             print('ERROR get_account_ep()', params, data)# if the key is not available, this message is returned and the response is printed
             return None
         
+    @instrumented('get_candle_df', rows=lambda df, *args, **kwargs: df_rows(df))
     def get_candle_df(self, pair_name, **kwargs):
 
         data = self.fetch_candles(pair_name, **kwargs)
@@ -98,21 +179,34 @@ class OandaApi:
         if  len(data) == 0: # in case the returned data is empty, the function should return an empty dataframe should be etrurned.
             return pd.DataFrame()  
          
-        prices = ['mid', 'bid', 'ask'] # to flatten the prices, i will over them and 
-        ohlc = ['o', 'h', 'l', 'c'] # extract thr ohlc indivdiually
-        
-        final_data = [] # each of the candlesticks properties are appended in this list
-        
-        for item in data:
-            if item['complete'] == False:
-                continue
-            dict_obj = {}
-            dict_obj['time'] = parser.parse(item['time'])
-            dict_obj['volume'] = item['volume']
-            for price in prices:
-                if price in item:
-                    for _ in ohlc:
-                        dict_obj[f'{price}_{_}'] = float(item[f'{price}'][f'{_}'])
-            final_data.append(dict_obj)
-        return pd.DataFrame(final_data)
+        return candles_to_df(data)
+
+PRICES = ['mid', 'bid', 'ask']
+OHLC = ['o', 'h', 'l', 'c']
+
+def parse_times(times):
+    '''converts a list of RFC3339 times like 2016-01-04T02:00:00.000000000Z to a UTC datetime column in one go'''
+    values = np.array([t[:-1] if t.endswith('Z') else t for t in times], dtype='datetime64[ns]')
+    return pd.DatetimeIndex(values).tz_localize('UTC')
+
+def candles_to_df(data):
+    '''
+    candles_to_df flattens the candles returned by the candles endpoint into a dataframe with the columns
+    time, volume and mid/bid/ask_o/h/l/c. the incomplete candles are dropped.
+
+    instead of building a dict for every candle, each column is pulled out of the candles as a list and converted
+    to a numpy array at once, the prices are parsed from their strings by numpy and the times in bulk by parse_times.
+    every candle of a response has the same prices, so the ones present are taken from the first candle.
+    '''
+    candles = [item for item in data if item['complete'] != False]
+    if len(candles) == 0:
+        return pd.DataFrame()
 
+    columns = {}
+    columns['time'] = parse_times([item['time'] for item in candles])
+    columns['volume'] = np.array([item['volume'] for item in candles], dtype=np.int64)
+    for price in PRICES:
+        if price in candles[0]:
+            for _ in OHLC:
+                columns[f'{price}_{_}'] = np.array([item[price][_] for item in candles]).astype(np.float64)
+    return pd.DataFrame(columns)
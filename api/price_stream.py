@@ -0,0 +1,135 @@
+# in this script the asyncio client of the oanda pricing stream is created. the stream is one long http response of
+# line-delimited json: a PRICE message every time the price of one of the instruments changes and a HEARTBEAT every
+# 5 seconds. all the instruments come over one connection, so a single task can follow all the pairs.
+#
+# it is written on asyncio streams only (no aiohttp), the http request and the chunked transfer encoding of the response
+# are handled here. base_url can point it at the local replay server of api/stream_server.py instead of the broker.
+#
+#   async for msg in PriceStream().messages(['EUR_USD', 'USD_JPY']):
+#       print(msg['type'], msg.get('instrument'))
+
+import ssl
+import json
+import asyncio
+import numpy as np
+from urllib.parse import urlparse, urlencode
+import cridentials.crid as crid
+
+# orjson decodes the messages a lot faster than the standard json module, it is used when it is installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 20 # the broker sends a heartbeat every 5 seconds, a silent connection after this is dead
+HEARTBEAT = 'HEARTBEAT'
+PRICE = 'PRICE'
+
+def get_stream_url(rest_url):
+    '''the stream host of the broker next to its rest host, e.g. https://api-fxpractice.oanda.com/v3 -> https://stream-fxpractice.oanda.com/v3'''
+    return rest_url.replace('://api-', '://stream-')
+
+def parse_time(time):
+    '''RFC3339 time like 2016-01-04T02:00:00.000000000Z to int utc nanoseconds'''
+    return int(np.datetime64(time[:-1] if time.endswith('Z') else time, 'ns').astype(np.int64))
+
+def parse_price(msg):
+    '''a PRICE message to (pair, time in utc ns, best bid, best ask)'''
+    return msg['instrument'], parse_time(msg['time']), float(msg['bids'][0]['price']), float(msg['asks'][0]['price'])
+
+class StreamError(Exception):
+    pass
+
+class PriceStream:
+    def __init__(self, base_url=None, account_id=None, api_key=None, read_timeout=READ_TIMEOUT):
+        self.base_url = get_stream_url(crid.oanda_url) if base_url is None else base_url
+        self.account_id = crid.account_id if account_id is None else account_id
+        self.api_key = crid.api_key if api_key is None else api_key
+        self.read_timeout = read_timeout
+        self.bytes_read = 0
+
+    def get_request(self, url, instruments):
+        path = f'{url.path.rstrip("/")}/accounts/{self.account_id}/pricing/stream?' + urlencode({'instruments': ','.join(instruments)})
+        return (
+            f'GET {path} HTTP/1.1\r\n'
+            f'Host: {url.hostname}\r\n'
+            f'Authorization: Bearer {self.api_key}\r\n'
+            'Accept: application/octet-stream\r\n'
+            'Accept-Encoding: identity\r\n'
+            'Connection: keep-alive\r\n\r\n'
+        ).encode()
+
+    async def read(self, fn, *args):
+        data = await asyncio.wait_for(fn(*args), self.read_timeout)
+        self.bytes_read += len(data)
+        return data
+
+    async def open(self, instruments):
+        '''connects, sends the request and reads the response headers. returns (reader, writer, chunked)'''
+        url = urlparse(self.base_url)
+        secure = url.scheme == 'https'
+        port = url.port if url.port is not None else (443 if secure else 80)
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(url.hostname, port, ssl=ssl.create_default_context() if secure else None), CONNECT_TIMEOUT)
+        writer.write(self.get_request(url, instruments))
+        await writer.drain()
+
+        status = (await self.read(reader.readline)).decode().split(' ', 2)
+        headers = {}
+        while True:
+            line = (await self.read(reader.readline)).decode().strip()
+            if line == '':
+                break
+            k, _, v = line.partition(':')
+            headers[k.strip().lower()] = v.strip()
+        if len(status) < 2 or status[1] != '200':
+            body = await self.read(reader.read, 2000)
+            writer.close()
+            raise StreamError(f'stream refused: {" ".join(status).strip()} {body[:500]}')
+        return reader, writer, headers.get('transfer-encoding', '').lower() == 'chunked'
+
+    async def lines(self, reader, chunked):
+        '''
+        the lines of the response body, undoing the chunked transfer encoding. a connection cut in the middle of a chunk
+        raises StreamError, like the other ways the stream can break, so the caller reconnects.
+        '''
+        if chunked == False:
+            while True:
+                line = await self.read(reader.readline)
+                if line == b'':
+                    return
+                yield line
+        buffer = b''
+        while True:
+            line = await self.read(reader.readline)
+            try:
+                size = int(line.split(b';')[0].strip(), 16)
+            except ValueError:
+                raise StreamError(f'stream cut or garbled, bad chunk size line {line[:100]}')
+            if size == 0:
+                return
+            try:
+                buffer += await self.read(reader.readexactly, size + 2) # the chunk and its \r\n
+            except asyncio.IncompleteReadError as e:
+                raise StreamError(f'stream cut in the middle of a chunk, {len(e.partial)} of {size + 2} bytes read')
+            buffer = buffer[:-2]
+            *lines, buffer = buffer.split(b'\n')
+            for line in lines:
+                yield line
+
+    async def messages(self, instruments):
+        '''yields every message of the stream as a dict, until the connection is closed'''
+        reader, writer, chunked = await self.open(instruments)
+        try:
+            async for line in self.lines(reader, chunked):
+                line = line.strip()
+                if len(line) > 0:
+                    try:
+                        msg = json_loads(line)
+                    except ValueError: # a line cut short by a dropped connection
+                        raise StreamError(f'bad message {line[:100]}')
+                    yield msg
+        finally:
+            writer.close()
@@ -0,0 +1,31 @@
+# in this script the token bucket used to keep the requests to the oanda api under the broker's rate limit is created.
+# the bucket fills up with `rate` tokens per second up to `capacity`, every request takes one token and waits when it is empty.
+
+import time
+import threading
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity is not None else self.rate # by default a burst of one second of requests
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'TokenBucket(rate={self.rate}, capacity={self.capacity})'
+
+    def acquire(self):
+        '''takes one token, sleeping outside the lock until one is available. returns the seconds spent waiting'''
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
@@ -0,0 +1,107 @@
+# in this script the pieces OandaApi.make_request uses to survive throttling and outages are created:
+# the backoff delay between retries, the Retry-After header parsing, the circuit breaker that pauses every request
+# when too many of the recent ones failed, and the counters that show how much time went to waiting.
+
+import time
+import random
+import threading
+from collections import deque
+from email.utils import parsedate_to_datetime
+from datetime import datetime as dt, timezone
+
+BACKOFF_BASE = 0.5 # seconds before the first retry
+BACKOFF_MAX = 30.0 # the delay never grows above this
+RETRY_AFTER_MAX = 60.0 # a longer Retry-After from the server is cut to this, so a worker is never parked for hours
+
+def backoff_delay(attempt, base=BACKOFF_BASE, max_delay=BACKOFF_MAX):
+    '''exponential backoff with full jitter: a random delay between 0 and base * 2^attempt, capped at max_delay'''
+    return random.uniform(0, min(max_delay, base * pow(2, attempt)))
+
+def retry_after_seconds(response, max_delay=RETRY_AFTER_MAX):
+    '''
+    reads the Retry-After header of a response, given either in seconds or as an http date, and caps it at max_delay.
+    None when there is none.
+    '''
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - dt.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(0.0, seconds), max_delay)
+
+class CircuitBreaker:
+    '''
+    the circuit breaker keeps the outcome of the last `window` requests. once at least `min_calls` are recorded and
+    the share of failures reaches `threshold`, the breaker opens for `cooldown` seconds and wait() holds every request
+    until it closes again, so a throttled or failing broker is not hammered.
+    '''
+    def __init__(self, window=50, threshold=0.5, min_calls=10, cooldown=30.0):
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.outcomes = deque(maxlen=window)
+        self.open_until = 0.0
+        self.trips = 0
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return f'CircuitBreaker(trips={self.trips}, open={self.is_open()})'
+
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    def record(self, ok):
+        with self.lock:
+            self.outcomes.append(ok)
+            if len(self.outcomes) < self.min_calls:
+                return
+            error_rate = self.outcomes.count(False) / len(self.outcomes)
+            if error_rate >= self.threshold:
+                self.open_until = time.monotonic() + self.cooldown
+                self.trips += 1
+                self.outcomes.clear()
+                print(f'CircuitBreaker open for {self.cooldown}s, error rate {error_rate:.0%}')
+
+    def wait(self):
+        '''blocks while the breaker is open and returns the seconds spent waiting'''
+        waited = 0.0
+        while True:
+            remaining = self.open_until - time.monotonic()
+            if remaining <= 0:
+                return waited
+            time.sleep(remaining)
+            waited += remaining
+
+class RequestStats:
+    '''thread safe counters of the requests made by an OandaApi object'''
+    FIELDS = [
+        'requests', # every attempt sent to the api
+        'retries', # attempts that were repeated after a throttle, server error or connection error
+        'failures', # requests that gave up
+        'retry_wait', # seconds slept between retries
+        'rate_limit_wait', # seconds waited on the token bucket
+        'breaker_wait', # seconds held by the open circuit breaker
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {k: 0 for k in self.FIELDS}
+
+    def __repr__(self):
+        return str(self.as_dict())
+
+    def add(self, key, value=1):
+        with self.lock:
+            self.counters[key] += value
+
+    def as_dict(self):
+        with self.lock:
+            return dict(self.counters)
@@ -0,0 +1,182 @@
+# in this script a local replay server of the oanda pricing stream is created. it streams the candles saved in ./data as
+# ticks, in the line-delimited json of the broker's pricing/stream endpoint, so the live ingestion can be tested and
+# load tested without the real stream:
+#
+#   python -m api.stream_server 8081 --granularity M5 --from 2023-01-02 --to 2023-02-01 --speed 600
+#
+# and then PriceStream(base_url='http://127.0.0.1:8081/v3') reads from it. every candle becomes 4 ticks spread over its
+# period: the open, the low and high (high first on a down candle) and the close, on both the bid and the ask. the ticks
+# of all the requested pairs are sent in time order at speed x real time (speed=0 sends them as fast as the client reads).
+
+import time
+import asyncio
+import argparse
+import threading
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+
+from infrastructure.candle_store import to_time_values, load_candles
+from infrastructure.resample import MINUTES, NS_PER_MINUTE
+
+STREAM_PATH = '/pricing/stream'
+TICKS_PER_CANDLE = 4
+BATCH_SIZE = 500 # ticks per chunk written when the client is behind
+HEARTBEAT_SECONDS = 5.0
+LIQUIDITY = 10000000
+
+def candle_ticks(df, granularity):
+    '''the ticks of the candles of df as (times in utc ns, bids, asks), 4 per candle'''
+    n = df.shape[0]
+    times = to_time_values(df['time'])
+    step = MINUTES[granularity] * NS_PER_MINUTE // TICKS_PER_CANDLE
+    up = (df['mid_c'] >= df['mid_o']).to_numpy()
+
+    tick_times = (times[:, None] + np.arange(TICKS_PER_CANDLE) * step).reshape(-1)
+    prices = []
+    for side in ['bid', 'ask']:
+        o, h, l, c = [df[f'{side}_{x}'].to_numpy() for x in 'ohlc']
+        path = np.empty((n, TICKS_PER_CANDLE), dtype=np.float64)
+        path[:, 0] = o
+        path[:, 1] = np.where(up, l, h)
+        path[:, 2] = np.where(up, h, l)
+        path[:, 3] = c
+        prices.append(path.reshape(-1))
+    return tick_times, prices[0], prices[1]
+
+def format_times(values):
+    return [f'{t}Z' for t in np.datetime_as_string(values.astype('datetime64[ns]'), unit='ns')]
+
+def price_line(pair, time, bid, ask):
+    return (f'{{"type":"PRICE","time":"{time}","bids":[{{"price":"{bid}","liquidity":{LIQUIDITY}}}],'
+            f'"asks":[{{"price":"{ask}","liquidity":{LIQUIDITY}}}],"closeoutBid":"{bid}","closeoutAsk":"{ask}",'
+            f'"status":"tradeable","tradeable":true,"instrument":"{pair}"}}\n')
+
+def heartbeat_line(value):
+    return f'{{"type":"HEARTBEAT","time":"{format_times(np.array([value]))[0]}"}}\n'
+
+def chunk(data: bytes):
+    return f'{len(data):x}\r\n'.encode() + data + b'\r\n'
+
+class ReplayFeed:
+    '''the merged ticks of the pairs, loaded from the candle store on the first request for them'''
+    def __init__(self, data_path='./data', granularity='M5', date_f=None, date_t=None):
+        self.data_path = data_path
+        self.granularity = granularity
+        self.date_f = date_f
+        self.date_t = date_t
+        self.cache = {}
+
+    def get_ticks(self, pairs):
+        key = tuple(pairs)
+        if key not in self.cache:
+            parts = []
+            for i, pair in enumerate(pairs):
+                df = load_candles(pair, self.granularity, self.date_f, self.date_t, data_path=self.data_path)
+                times, bids, asks = candle_ticks(df, self.granularity)
+                parts.append((times, np.full(times.shape[0], i, dtype=np.int16), bids, asks))
+            times, pair_idx, bids, asks = [np.concatenate(x) for x in zip(*parts)]
+            order = np.argsort(times, kind='stable')
+            self.cache[key] = (times[order], pair_idx[order], bids[order], asks[order])
+        return self.cache[key]
+
+class StreamServer:
+    def __init__(self, feed: ReplayFeed, speed=0.0):
+        self.feed = feed
+        self.speed = speed # history seconds per wall second, 0 for as fast as possible
+        self.ticks_sent = 0
+        self.server = None
+
+    async def handle(self, reader, writer):
+        try:
+            request = (await reader.readline()).decode().split(' ')
+            while (await reader.readline()).strip() != b'':
+                pass
+            url = urlparse(request[1] if len(request) > 1 else '')
+            if not url.path.endswith(STREAM_PATH):
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            pairs = parse_qs(url.query).get('instruments', [''])[0].split(',')
+            try:
+                ticks = self.feed.get_ticks(pairs)
+            except (FileNotFoundError, KeyError) as error:
+                body = f'{{"errorMessage":"no candles for {pairs}: {error}"}}'.encode()
+                writer.write(f'HTTP/1.1 400 Bad Request\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+                return
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/octet-stream\r\nTransfer-Encoding: chunked\r\n\r\n')
+            await self.send_ticks(writer, pairs, *ticks)
+            writer.write(b'0\r\n\r\n')
+            await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def send_ticks(self, writer, pairs, times, pair_idx, bids, asks):
+        start_wall = time.perf_counter()
+        last_heartbeat = start_wall
+        i = 0
+        while i < times.shape[0]:
+            end = min(i + BATCH_SIZE, times.shape[0])
+            if self.speed > 0:
+                # the ticks due by now, waiting for the next one when none is
+                due = start_wall + (times[i:end] - times[0]) / 1e9 / self.speed
+                now = time.perf_counter()
+                if due[0] > now:
+                    await asyncio.sleep(min(due[0] - now, HEARTBEAT_SECONDS))
+                    now = time.perf_counter()
+                end = i + max(int(np.searchsorted(due, now, side='right')), 0)
+            lines = []
+            if time.perf_counter() - last_heartbeat >= HEARTBEAT_SECONDS:
+                # on the clock of the replay, the time of the last tick sent, so the client closes the candles it has to
+                lines.append(heartbeat_line(times[max(i - 1, 0)]))
+                last_heartbeat = time.perf_counter()
+            if end > i:
+                for t, p, b, a in zip(format_times(times[i:end]), pair_idx[i:end].tolist(), bids[i:end].tolist(), asks[i:end].tolist()):
+                    lines.append(price_line(pairs[p], t, b, a))
+                self.ticks_sent += end - i
+                i = end
+            if len(lines) > 0:
+                writer.write(chunk(''.join(lines).encode()))
+                await writer.drain()
+
+    async def start(self, host='127.0.0.1', port=0):
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self
+
+    @property
+    def base_url(self):
+        host, port = self.server.sockets[0].getsockname()[:2]
+        return f'http://{host}:{port}/v3'
+
+def start_stream_server(port=0, data_path='./data', granularity='M5', date_f=None, date_t=None, speed=0.0):
+    '''starts the replay server on an event loop of its own on a background thread and returns it, see server.base_url'''
+    server = StreamServer(ReplayFeed(data_path, granularity, date_f, date_t), speed)
+    started = threading.Event()
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start(port=port))
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, daemon=True).start()
+    started.wait()
+    return server
+
+async def serve_forever(port, feed, speed):
+    server = await StreamServer(feed, speed).start(port=port)
+    print(f'replay pricing stream on {server.base_url}')
+    await server.server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local replay of the oanda pricing stream from the stored candles')
+    parser.add_argument('port', type=int, nargs='?', default=8081)
+    parser.add_argument('--granularity', default='M5')
+    parser.add_argument('--from', dest='date_f')
+    parser.add_argument('--to', dest='date_t')
+    parser.add_argument('--speed', type=float, default=0.0, help='history seconds per second, 0 for as fast as possible')
+    parser.add_argument('--data', default='./data')
+    args = parser.parse_args()
+    asyncio.run(serve_forever(args.port, ReplayFeed(args.data, args.granularity, args.date_f, args.date_t), args.speed))
@@ -0,0 +1,134 @@
+# in this script a local stub of the oanda rest api is created. it answers the instruments/{pair}/candles endpoint
+# from the candles saved in ./data, in the same json format as the broker, so the collection can be run and timed
+# without touching the real api:
+#
+#   python -m api.stub_server 8080
+#
+# and then OandaApi(base_url='http://127.0.0.1:8080/v3') talks to it.
+
+import re
+import sys
+import json
+import time
+import random
+import threading
+import pandas as pd
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from infrastructure.candle_store import load_candles
+
+CANDLES_PATH = re.compile(r'^/v3/instruments/([A-Z]{3}_[A-Z]{3})/candles$')
+PRICES = {'M': 'mid', 'B': 'bid', 'A': 'ask'}
+MAX_COUNT = 5000
+
+def format_time(times):
+    return list(times.dt.strftime('%Y-%m-%dT%H:%M:%S.000000000Z'))
+
+def candles_to_json(df: pd.DataFrame, price='MBA'):
+    '''turns the rows of a candle dataframe into the list of candle objects the broker returns'''
+    times = format_time(df['time'])
+    volumes = df['volume'].tolist()
+    cols = {}
+    for p in price:
+        name = PRICES[p]
+        cols[name] = {x: [str(v) for v in df[f'{name}_{x}'].tolist()] for x in 'ohlc'}
+
+    candles = []
+    for i in range(df.shape[0]):
+        candle = dict(complete=True, volume=volumes[i], time=times[i])
+        for name, ohlc in cols.items():
+            candle[name] = {x: ohlc[x][i] for x in 'ohlc'}
+        candles.append(candle)
+    return candles
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the broker
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, code, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        m = CANDLES_PATH.match(url.path)
+        if m is None:
+            self.send_json(404, {'errorMessage': f'{url.path} not found'})
+            return
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.request_count += 1
+        if random.random() < self.server.error_rate:
+            self.send_json(429, {'errorMessage': 'Requests are being throttled'}, {'Retry-After': str(self.server.retry_after)})
+            return
+
+        pair = m.group(1)
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        granularity = params.get('granularity', 'H1')
+        price = params.get('price', 'M')
+        try:
+            df = self.server.get_candles(pair, granularity)
+        except FileNotFoundError:
+            self.send_json(400, {'errorMessage': f'no candles for {pair} {granularity}'})
+            return
+
+        if 'from' in params and 'to' in params:
+            times = df['time']
+            df = df[(times >= pd.Timestamp(params['from'])) & (times <= pd.Timestamp(params['to']))]
+            df = df.head(MAX_COUNT)
+        else:
+            df = df.tail(int(params.get('count', 500)))
+
+        self.send_json(200, dict(
+            instrument=pair,
+            granularity=granularity,
+            candles=candles_to_json(df, price)
+        ))
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data_path='./data', latency=0.0, error_rate=0.0, retry_after=1):
+        super().__init__(address, StubHandler)
+        self.data_path = data_path
+        self.latency = latency # seconds added to every candles request to mimic the round trip to the broker
+        self.error_rate = error_rate # share of the candles requests answered with a 429 and Retry-After, to mimic throttling
+        self.retry_after = retry_after
+        self.request_count = 0
+        self.lock = threading.Lock()
+        self.cache = {}
+
+    def get_candles(self, pair, granularity):
+        key = (pair, granularity)
+        if key not in self.cache:
+            self.cache[key] = load_candles(pair, granularity, data_path=self.data_path)
+        return self.cache[key]
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/v3'
+
+def start_stub_server(port=0, data_path='./data', latency=0.0, error_rate=0.0, retry_after=1):
+    '''starts the stub server on a background thread and returns it. port=0 picks a free port, see server.base_url'''
+    server = StubServer(('127.0.0.1', port), data_path, latency, error_rate, retry_after)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+    server = StubServer(('127.0.0.1', port))
+    print(f'stub oanda api on {server.base_url}')
+    server.serve_forever()
@@ -0,0 +1,66 @@
+# micro benchmark of the candle parsing in OandaApi.get_candle_df.
+# a candles response is built from synthetic EUR_USD H4 candles (benchmarks/synthetic.py) in the broker's json format and parsed with the old
+# dict-per-candle code (parse_rows) and with candles_to_df, checking that both give the same dataframe.
+#
+#   python -m benchmarks.bench_candle_parse
+
+import json
+import time
+import pandas as pd
+from dateutil import parser
+
+from api.oanda_api import candles_to_df, json_loads
+from api.stub_server import candles_to_json
+from benchmarks.synthetic import make_candles
+
+REPEAT = 5
+
+def parse_rows(data):
+    # the parsing get_candle_df did before candles_to_df
+    final_data = []
+    for item in data:
+        if item['complete'] == False:
+            continue
+        dict_obj = {}
+        dict_obj['time'] = parser.parse(item['time'])
+        dict_obj['volume'] = item['volume']
+        for price in ['mid', 'bid', 'ask']:
+            if price in item:
+                for _ in ['o', 'h', 'l', 'c']:
+                    dict_obj[f'{price}_{_}'] = float(item[f'{price}'][f'{_}'])
+        final_data.append(dict_obj)
+    return pd.DataFrame(final_data)
+
+def best_time(fn, *args):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def check_same(df_old, df_new):
+    # the old path gives a dateutil timezone and a unit that depends on the pandas version, so time is compared as UTC instants
+    assert (df_old['time'].dt.tz_convert('UTC').to_numpy() == df_new['time'].to_numpy()).all()
+    pd.testing.assert_frame_equal(df_old.drop(columns='time'), df_new.drop(columns='time'), check_column_type=False)
+
+def run(pair='EUR_USD', granularity='H4', count=4000):
+    df = make_candles(pair, granularity, years=4).head(count)
+    body = json.dumps(dict(candles=candles_to_json(df))).encode()
+    data = json.loads(body)['candles']
+
+    check_same(parse_rows(data), candles_to_df(data))
+
+    t_json = best_time(json.loads, body)
+    t_fast_json = best_time(json_loads, body)
+    t_rows = best_time(parse_rows, data)
+    t_cols = best_time(candles_to_df, data)
+
+    print(f'{len(data)} candles, {len(body) / 1e6:.1f} MB')
+    print(f'json decode     json: {t_json * 1000:8.1f} ms   {json_loads.__module__}: {t_fast_json * 1000:8.1f} ms')
+    print(f'parse     parse_rows: {t_rows * 1000:8.1f} ms   candles_to_df: {t_cols * 1000:8.1f} ms   x{t_rows / t_cols:.1f}')
+    print(f'total            old: {(t_json + t_rows) * 1000:8.1f} ms   new: {(t_fast_json + t_cols) * 1000:8.1f} ms   x{(t_json + t_rows) / (t_fast_json + t_cols):.1f}')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,74 @@
+# benchmark of the ma_excel report builder against the pandas to_excel version it replaced (mask per pair, list
+# comprehension to strip the timezone), on a synthetic sweep (make_sweep of benchmarks/synthetic.py) of 30 pairs x
+# 10 crosses x 2 granularities with more than 100k trades per granularity. the H1 and H4 workbooks are also written in parallel with create_ma_reports.
+#
+#   python -m benchmarks.bench_excel
+
+import os
+import time
+import tempfile
+import pandas as pd
+
+from simulation import ma_excel
+from simulation.results_store import new_run_id, write_results
+from simulation.ma_excel import create_excel, create_ma_reports
+from benchmarks.synthetic import make_sweep
+
+GRANULARITIES = ['H1', 'H4']
+
+# the report builder before the rewrite
+def old_add_pair_charts(df_ma_res, df_ma_trades, writer):
+    cols = ['Time', 'Gain_C']
+    df_temp = df_ma_res.drop_duplicates(subset='pair')
+    for _, row in df_temp.iterrows():
+        dft = df_ma_trades[(df_ma_trades['Cross'] == row['cross']) & (df_ma_trades['Pair'] == row['pair'])]
+        dft[cols].to_excel(writer, sheet_name=row['pair'], index=False, startrow=0, startcol=11)
+        worksheet = writer.sheets[row['pair']]
+        for k,v in ma_excel.WIDTHS.items():
+            worksheet.set_column(k,v)
+        chart = ma_excel.get_line_chart(writer.book, 1, dft.shape[0], 11, 12, f'Gain_C for {row["pair"]} {row["cross"]}', row['pair'])
+        chart.set_size({'x_scale' : 2.5, 'y_scale' : 2.5})
+        worksheet.insert_chart('O1', chart)
+
+def old_create_excel(df_ma_res, df_ma_trades, granularity, filename):
+    writer = pd.ExcelWriter(filename, engine='xlsxwriter')
+    df_ma_res = df_ma_res[df_ma_res['granularity'] == granularity].copy()
+    df_ma_trades = df_ma_trades[df_ma_trades['Granularity'] == granularity].copy()
+    df_ma_res.sort_values(by=['pair', 'total_gain'], ascending=[True, False], inplace=True)
+    df_ma_trades['Time'] = [x.replace(tzinfo=None) for x in df_ma_trades['time']]
+    for pair in df_ma_res['pair'].unique():
+        df_ma_res[df_ma_res['pair'] == pair].to_excel(writer, sheet_name=pair, index=False)
+    old_add_pair_charts(df_ma_res, df_ma_trades, writer)
+    writer.close()
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def run():
+    df_ma_res, df_ma_trades = make_sweep(granularities=GRANULARITIES)
+    print(f'{df_ma_res.shape[0]} results, {df_ma_trades.shape[0]} trades '
+          f'({df_ma_trades.shape[0] // len(GRANULARITIES)} per granularity)')
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t_old = timed(old_create_excel, df_ma_res, df_ma_trades, 'H1', os.path.join(tmp, 'old_H1.xlsx'))
+        t_new = timed(create_excel, df_ma_res, df_ma_trades, 'H1', os.path.join(tmp, 'new_H1.xlsx'))
+        print(f'{"create_excel H1":24} old: {t_old:7.2f} s   new: {t_new:7.2f} s   x{t_old / t_new:.1f}')
+
+        # both granularities from the results store, one after the other and then in parallel
+        run_id = new_run_id()
+        write_results(df_ma_res, 'ma_res', tmp, run_id, 'pair', 'granularity')
+        write_results(df_ma_trades, 'ma_trades', tmp, run_id, 'Pair', 'Granularity')
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            t_serial = timed(create_ma_reports, GRANULARITIES, run_id, tmp, 1)
+            t_parallel = timed(create_ma_reports, GRANULARITIES, run_id, tmp, len(GRANULARITIES))
+        finally:
+            os.chdir(cwd)
+        print(f'{"create_ma_reports H1+H4":24} serial: {t_serial:7.2f} s   parallel: {t_parallel:7.2f} s')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,76 @@
+# benchmark of the vectorized RSI and apply_candle_props against the list comprehension / row-wise versions they replaced,
+# on a synthetic multi-year M5 frame from benchmarks/synthetic.py. the frame is indexed by time, so the old RSI misaligns on it (all NaN) while
+# the new one keeps the index, the values are checked on a RangeIndex copy.
+#
+#   python -m benchmarks.bench_vectorized
+
+import time
+import pandas as pd
+
+from technicals.indicators import RSI
+from technicals.patterns import apply_candle_props
+from benchmarks.synthetic import make_candles
+
+YEARS = 8
+REPEAT = 3
+
+def make_m5_frame(years=YEARS, seed=0):
+    df = make_candles('EUR_USD', 'M5', years=years, seed=seed)
+    return df.set_index('time')[['mid_o', 'mid_h', 'mid_l', 'mid_c']]
+
+def old_rsi(df: pd.DataFrame, n=14):
+    df = df.copy()
+    alpha = 1.0 / n
+    gains = df['mid_c'].diff()
+    wins = pd.Series([ x if x >= 0 else 0.0 for x in gains], name='wins')
+    losses = pd.Series([ x * -1 if x < 0 else 0.0 for x in gains], name='losses')
+    wins_rma = wins.ewm(min_periods=n, alpha=alpha).mean()
+    losses_rma = losses.ewm(min_periods=n, alpha=alpha).mean()
+    rs = wins_rma / losses_rma
+    df[f'RSI_{n}'] = 100.0 - (100.0 / (1.0 + rs))
+    return df
+
+def old_candle_props(df: pd.DataFrame):
+    df_an = df.copy()
+    direction = df_an['mid_c'] - df_an['mid_o']
+    body_size = abs(direction)
+    direction = [1 if x >= 0 else -1 for x in direction]
+    full_range = df_an['mid_h'] - df_an['mid_l']
+    body_perc = (body_size / full_range) * 100
+    body_lower = df_an[['mid_c', 'mid_o']].min(axis=1)
+    body_upper = df_an[['mid_c', 'mid_o']].max(axis=1)
+    body_bottom_perc = ((body_lower - df_an['mid_l']) / full_range * 100)
+    body_top_perc = 100 - (((df_an['mid_h'] - body_upper) / full_range) * 100)
+    df_an['body_lower'] = body_lower
+    df_an['body_upper'] = body_upper
+    df_an['body_bottom_perc'] = body_bottom_perc
+    df_an['body_top_perc'] = body_top_perc
+    df_an['body_perc'] = body_perc
+    df_an['direction'] = direction
+    return df_an
+
+def best_time(fn, *args):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def run():
+    df = make_m5_frame()
+    df_range = df.reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(old_rsi(df_range), RSI(df_range))
+    pd.testing.assert_frame_equal(old_candle_props(df_range), apply_candle_props(df_range))
+    assert RSI(df)['RSI_14'].notna().sum() == df.shape[0] - 13 # index preserved on the time indexed frame
+
+    print(f'{df.shape[0]} M5 candles ({YEARS} years)')
+    for name, fn_old, fn_new in [('RSI', old_rsi, RSI), ('apply_candle_props', old_candle_props, apply_candle_props)]:
+        t_old = best_time(fn_old, df_range)
+        t_new = best_time(fn_new, df_range)
+        print(f'{name:20} old: {t_old * 1000:8.1f} ms   new: {t_new * 1000:8.1f} ms   x{t_old / t_new:.1f}')
+
+
+if __name__ == '__main__':
+    run()
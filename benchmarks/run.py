@@ -0,0 +1,223 @@
+# the benchmark suite: times the hot paths on synthetic candles (benchmarks/synthetic.py) and records the results to json,
+# so runs can be compared over time. every run is compared to a baseline, by default the last saved run with the same
+# settings, and a benchmark slower than the baseline by more than the threshold is flagged as a regression
+# (the exit code is then 1, for ci).
+#
+#   python -m benchmarks.run                               # all the benchmarks, saved to benchmarks/results
+#   python -m benchmarks.run --pairs 8 --years 4 --only ma_sweep indicators
+#   python -m benchmarks.run --baseline benchmarks/results/bench_20240101-120000.json --threshold 0.1
+#
+# benchmarks:
+#   parse_candles   json decode + candles_to_df of CANDLE_COUNT candle responses (collection parsing)
+#   save_file       save_file of the whole history of every pair into the candle store
+#   indicators      compute_indicators with the usual specs
+#   patterns        apply_patterns
+#   ma_sweep        assess_grid over a grid of ma crosses for every pair
+#   ma_report       create_excel of a sweep with more than 100k trades
+
+import io
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import tempfile
+import platform
+import subprocess
+import contextlib
+import datetime as dt
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic import get_pair_names, make_candles, make_instruments, make_sweep
+from api.oanda_api import candles_to_df, json_loads
+from api.stub_server import candles_to_json
+from infrastructure.collect_data import CANDLE_COUNT, save_file
+from technicals.pipeline import compute_indicators
+from technicals.patterns import apply_patterns
+from simulation.ma_cross import assess_grid, get_ma_col
+from simulation.ma_grid import get_crosses
+from simulation.ma_excel import create_excel
+
+RESULTS_PATH = './benchmarks/results'
+THRESHOLD = 0.2
+INDICATOR_SPECS = ['BollingerBands', 'ATR', 'KeltnerChannel', 'RSI', 'MACD']
+MA_LONG = [16, 32, 64, 128, 256]
+MA_SHORT = [4, 8, 16, 32]
+
+class BenchContext:
+    '''the synthetic data shared by the benchmarks, made on first use'''
+    def __init__(self, pairs, granularity, years, seed, tmp):
+        self.pairs = get_pair_names(pairs)
+        self.granularity = granularity
+        self.years = years
+        self.seed = seed
+        self.tmp = tmp
+        self._candles = None
+
+    @property
+    def candles(self):
+        if self._candles is None:
+            self._candles = {pair: make_candles(pair, self.granularity, self.years, self.seed) for pair in self.pairs}
+        return self._candles
+
+    def total_rows(self):
+        return sum([df.shape[0] for df in self.candles.values()])
+
+# every benchmark takes the context and returns (fn, rows): fn is the timed call and rows the number of rows it processes
+def bench_parse_candles(ctx: BenchContext):
+    df = next(iter(ctx.candles.values())).head(CANDLE_COUNT)
+    body = json.dumps(dict(candles=candles_to_json(df))).encode()
+    return lambda: candles_to_df(json_loads(body)['candles']), df.shape[0]
+
+def bench_save_file(ctx: BenchContext):
+    def fn():
+        with contextlib.redirect_stdout(io.StringIO()):
+            for pair, df in ctx.candles.items():
+                save_file(df.copy(), ctx.tmp, ctx.granularity, pair)
+    return fn, ctx.total_rows()
+
+def bench_indicators(ctx: BenchContext):
+    def fn():
+        for df in ctx.candles.values():
+            compute_indicators(df, INDICATOR_SPECS)
+    return fn, ctx.total_rows()
+
+def bench_patterns(ctx: BenchContext):
+    def fn():
+        for df in ctx.candles.values():
+            apply_patterns(df)
+    return fn, ctx.total_rows()
+
+def bench_ma_sweep(ctx: BenchContext):
+    ic = make_instruments(ctx.pairs)
+    crosses = get_crosses(MA_LONG, MA_SHORT)
+    price_data = {}
+    for pair, df in ctx.candles.items():
+        df = df[['time', 'mid_c']].copy()
+        for ma in set(MA_LONG + MA_SHORT):
+            df[get_ma_col(ma)] = df['mid_c'].rolling(window=ma).mean()
+        price_data[pair] = df.dropna().reset_index(drop=True)
+
+    def fn():
+        for pair, df in price_data.items():
+            assess_grid(df, crosses, ic.instruments_dict[pair], ctx.granularity)
+    return fn, ctx.total_rows() * len(crosses)
+
+def bench_ma_report(ctx: BenchContext):
+    df_ma_res, df_ma_trades = make_sweep(granularities=[ctx.granularity], seed=ctx.seed)
+    filename = os.path.join(ctx.tmp, 'ma_sim.xlsx')
+    return lambda: create_excel(df_ma_res, df_ma_trades, ctx.granularity, filename), df_ma_trades.shape[0]
+
+BENCHMARKS = {
+    'parse_candles': bench_parse_candles,
+    'save_file': bench_save_file,
+    'indicators': bench_indicators,
+    'patterns': bench_patterns,
+    'ma_sweep': bench_ma_sweep,
+    'ma_report': bench_ma_report,
+}
+
+def time_fn(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run_benchmarks(names, pairs, granularity, years, repeat, seed=0):
+    '''runs the benchmarks and returns the run as a dict, ready to be saved as json'''
+    run = dict(
+        created=dt.datetime.now().isoformat(timespec='seconds'),
+        commit=get_commit(),
+        python=platform.python_version(),
+        numpy=np.__version__,
+        pandas=pd.__version__,
+        machine=platform.machine(),
+        config=dict(pairs=pairs, granularity=granularity, years=years, repeat=repeat, seed=seed),
+        results={}
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = BenchContext(pairs, granularity, years, seed, tmp)
+        for name in names:
+            fn, rows = BENCHMARKS[name](ctx)
+            times = time_fn(fn, repeat)
+            best = min(times)
+            run['results'][name] = dict(seconds=best, mean=sum(times) / len(times), rows=rows, rows_per_s=rows / best)
+            print(f'{name:16} {best * 1000:10.1f} ms   {rows:>11,} rows   {rows / best:>14,.0f} rows/s')
+    return run
+
+def save_run(run, path=RESULTS_PATH):
+    os.makedirs(path, exist_ok=True)
+    filename = os.path.join(path, f'bench_{run["created"].replace(":", "").replace("-", "").replace("T", "-")}.json')
+    with open(filename, 'w') as f:
+        f.write(json.dumps(run, indent=2))
+    return filename
+
+def find_baseline(config, path=RESULTS_PATH):
+    '''the last saved run with the same config'''
+    for filename in sorted(glob.glob(os.path.join(path, 'bench_*.json')), reverse=True):
+        with open(filename, 'r') as f:
+            run = json.loads(f.read())
+        if run['config'] == config:
+            return filename, run
+    return None, None
+
+def compare_runs(run, baseline, threshold=THRESHOLD):
+    '''prints the change of every benchmark against the baseline and returns the names of the regressions'''
+    regressions = []
+    for name, result in run['results'].items():
+        if name not in baseline['results']:
+            continue
+        ratio = result['seconds'] / baseline['results'][name]['seconds']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = 'faster'
+        print(f'{name:16} {baseline["results"][name]["seconds"] * 1000:10.1f} ms -> {result["seconds"] * 1000:10.1f} ms   x{ratio:.2f}  {flag}')
+    return regressions
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='benchmarks of the hot paths on synthetic candles')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS.keys()), default=list(BENCHMARKS.keys()))
+    parser.add_argument('--pairs', type=int, default=4)
+    parser.add_argument('--granularity', default='M5')
+    parser.add_argument('--years', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help='json of the run to compare to, the last run with the same settings by default')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='slowdown flagged as a regression, 0.2 is 20%%')
+    parser.add_argument('--results', default=RESULTS_PATH, help='folder the runs are saved in')
+    parser.add_argument('--no-save', action='store_true')
+    args = parser.parse_args(args)
+
+    config = dict(pairs=args.pairs, granularity=args.granularity, years=args.years, repeat=args.repeat, seed=args.seed)
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as f:
+            baseline_file, baseline = args.baseline, json.loads(f.read())
+    else:
+        baseline_file, baseline = find_baseline(config, args.results)
+
+    run = run_benchmarks(args.only, args.pairs, args.granularity, args.years, args.repeat, args.seed)
+    if args.no_save == False:
+        print('saved', save_run(run, args.results))
+
+    if baseline is None:
+        return 0
+    print(f'compared to {baseline_file} ({baseline["commit"]}, {baseline["created"]})')
+    regressions = compare_runs(run, baseline, args.threshold)
+    return 1 if len(regressions) > 0 else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# deterministic synthetic data for the benchmarks, so they do not depend on the checked-in pickles or on the broker.
+# the candles have the columns of get_candle_df (time, volume, mid/bid/ask ohlc) and follow the forex week: from
+# sunday 22:00 to friday 22:00 utc. the same (pair, granularity, years, seed) always gives the same candles.
+#
+#   df = make_candles('EUR_USD', 'M5', years=2)
+#   candles = make_pairs(num_pairs=8, granularity='H1', years=4)   # pair -> dataframe
+#   write_dataset('/tmp/data', num_pairs=8, granularities=['H1', 'H4'], years=4)   # candle store + instruments.json
+
+import os
+import zlib
+import numpy as np
+import pandas as pd
+
+from models.instruments import Instrument
+from infrastructure.instrument_collection import InstrumentCollection
+from infrastructure.candle_store import STORE_DIR, write_candles
+
+# the currencies in market priority order, the base of a pair is the one that comes first (EUR_USD, GBP_JPY, AUD_CAD ...)
+CURRENCIES = ['EUR', 'GBP', 'AUD', 'NZD', 'USD', 'CAD', 'CHF', 'JPY']
+MINUTES = {
+    'M1': 1,
+    'M5': 5,
+    'M15': 15,
+    'M30': 30,
+    'H1': 60,
+    'H4': 240,
+    'D': 1440,
+}
+START = '2016-01-03 22:00'
+ANNUAL_VOL = 0.08
+TRADING_MINUTES_PER_YEAR = 260 * 24 * 60
+
+def get_pair_names(num_pairs=None):
+    '''the 28 pairs of CURRENCIES, or the first num_pairs of them'''
+    pairs = [f'{b}_{q}' for i, b in enumerate(CURRENCIES) for q in CURRENCIES[i + 1:]]
+    return pairs if num_pairs is None else pairs[:num_pairs]
+
+def get_pip_location(pair):
+    return -2 if pair.endswith('_JPY') else -4
+
+def get_rng(pair, granularity, seed):
+    return np.random.default_rng([seed, zlib.crc32(f'{pair}_{granularity}'.encode())])
+
+def get_times(granularity, years, start=START):
+    '''the candle open times of the forex week (sunday 22:00 -> friday 22:00 utc) over the years'''
+    times = pd.date_range(start, pd.Timestamp(start) + pd.DateOffset(years=years), freq=f'{MINUTES[granularity]}min', tz='UTC', inclusive='left')
+    week_minute = (times.dayofweek.to_numpy() * 24 + times.hour.to_numpy()) * 60 + times.minute.to_numpy()
+    open_from, open_to = (6 * 24 + 22) * 60, (4 * 24 + 22) * 60 # sunday 22:00 and friday 22:00, monday is day 0
+    return times[(week_minute >= open_from) | (week_minute < open_to)]
+
+def make_candles(pair='EUR_USD', granularity='H1', years=1, seed=0, start=START):
+    '''
+    a random walk of the mid price with highs and lows around the bodies and a varying bid/ask spread around the mid,
+    rounded like the broker's prices. the volume is poisson.
+    '''
+    rng = get_rng(pair, granularity, seed)
+    times = get_times(granularity, years, start)
+    n = times.shape[0]
+    pip = 10 ** get_pip_location(pair)
+    decimals = -get_pip_location(pair) + 1
+
+    sigma = ANNUAL_VOL * np.sqrt(MINUTES[granularity] / TRADING_MINUTES_PER_YEAR)
+    first = rng.uniform(80, 150) if pair.endswith('_JPY') else rng.uniform(0.6, 1.9)
+    close = first * np.exp(np.cumsum(rng.normal(0, sigma, n)))
+    open_ = np.concatenate(([first], close[:-1]))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, sigma / 2, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, sigma / 2, n)))
+    half_spread = pip * (0.4 + rng.exponential(0.4, n))
+
+    df = pd.DataFrame(dict(time=times, volume=rng.poisson(MINUTES[granularity] * 20, n)))
+    for name, values in [('o', open_), ('h', high), ('l', low), ('c', close)]:
+        df[f'mid_{name}'] = values.round(decimals)
+        df[f'bid_{name}'] = (values - half_spread).round(decimals)
+        df[f'ask_{name}'] = (values + half_spread).round(decimals)
+    return df[['time', 'volume'] + [f'{p}_{c}' for p in ['mid', 'bid', 'ask'] for c in 'ohlc']]
+
+def make_pairs(num_pairs=4, granularity='H1', years=1, seed=0):
+    '''pair -> candles for the first num_pairs pairs'''
+    return {pair: make_candles(pair, granularity, years, seed) for pair in get_pair_names(num_pairs)}
+
+def get_instrument_data(pairs):
+    '''the instruments of the pairs in the format of the broker's instruments endpoint'''
+    return [dict(
+        name=pair,
+        type='CURRENCY',
+        displayName=pair.replace('_', '/'),
+        pipLocation=get_pip_location(pair),
+        displayPrecision=-get_pip_location(pair) + 1,
+        tradeUnitsPrecision=0,
+        marginRate='0.05' if pair.endswith('_JPY') else '0.03'
+    ) for pair in pairs]
+
+def make_instruments(pairs):
+    '''an InstrumentCollection holding the pairs'''
+    ic = InstrumentCollection()
+    ic.instruments_dict = {ob['name']: Instrument.FromApiObject(ob) for ob in get_instrument_data(pairs)}
+    ic.build_index()
+    return ic
+
+def write_dataset(path, num_pairs=4, granularities=['H1'], years=1, seed=0):
+    '''writes instruments.json and the candles of the pairs and granularities in the candle store under path'''
+    os.makedirs(path, exist_ok=True)
+    pairs = get_pair_names(num_pairs)
+    InstrumentCollection().CreateFile(get_instrument_data(pairs), path)
+    for granularity in granularities:
+        for pair in pairs:
+            write_candles(make_candles(pair, granularity, years, seed), pair, granularity, os.path.join(path, STORE_DIR))
+    return pairs
+
+def make_sweep(num_pairs=30, ma_list=[8, 16, 32, 64, 128], trades_per_cross=400, granularities=['H1', 'H4'], seed=0):
+    '''ma_res and ma_trades frames shaped like the ones of run_ma_sim, for the report benchmarks'''
+    rng = np.random.default_rng(seed)
+    pairs = [f'{p1}_{p2}' for p1 in CURRENCIES for p2 in CURRENCIES if p1 != p2][:num_pairs]
+    crosses = [(f'MA_{ma_l}', f'MA_{ma_s}') for ma_l in ma_list for ma_s in ma_list if ma_l > ma_s]
+    res, trades = [], []
+    for g in granularities:
+        times = pd.date_range(START, periods=trades_per_cross * 20, freq=f'{MINUTES[g]}min', tz='UTC')[::20]
+        for pair in pairs:
+            for ma_l, ma_s in crosses:
+                gain = rng.normal(0, 30, trades_per_cross).round(1)
+                trades.append(pd.DataFrame(dict(
+                    time=times, Gain=gain, Granularity=g, Pair=pair, Gain_C=gain.cumsum(),
+                    ma_l=ma_l, ma_s=ma_s, Cross=f'{ma_s}_{ma_l}'
+                )))
+                res.append(dict(
+                    pair=pair, num_trades=trades_per_cross, total_gain=int(gain.sum()), min_gain=int(gain.min()),
+                    average_gain=int(gain.mean()), max_gain=int(gain.max()), ma_l=ma_l, ma_s=ma_s,
+                    cross=f'{ma_s}_{ma_l}', granularity=g
+                ))
+    return pd.DataFrame(res), pd.concat(trades).reset_index(drop=True)
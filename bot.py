@@ -8,12 +8,16 @@ from infrastructure.instrument_collection import instrumentCollection
 from simulation.ma_cross import run_ma_sim
 from dateutil import parser
 from infrastructure.collect_data import run_collection
+from infrastructure.live_stream import run_live
 
 
 if __name__ == '__main__':
-     api = OandaApi()    
-     instrumentCollection.LoadInstruments('./data')
-     run_collection(instrumentCollection, api)
+     if len(sys.argv) > 1 and sys.argv[1] == 'live': # python bot.py live: candles, indicators and signals from the price stream
+          run_live()
+     else:
+          api = OandaApi()    
+          instrumentCollection.LoadInstruments('./data')
+          run_collection(instrumentCollection, api)
      
      
 
@@ -0,0 +1,307 @@
+# in this script the candle store is created. instead of one pickle holding the whole history of a pair and granularity,
+# the candles are saved column by column as raw numpy arrays, partitioned by pair, granularity and year:
+#
+#   ./data/candles/EUR_USD/H4/schema.json
+#   ./data/candles/EUR_USD/H4/2016/time.bin
+#   ./data/candles/EUR_USD/H4/2016/mid_c.bin
+#   ...
+#
+# the column files are memory mapped when read, so a reader only touches the years and the columns it asks for.
+
+import os
+import re
+import sys
+import json
+import shutil
+import numpy as np
+import pandas as pd
+
+STORE_DIR = 'candles'
+STORE_PATH = f'./data/{STORE_DIR}'
+SCHEMA_FILE = 'schema.json'
+TIME_COL = 'time' # saved as int64 nanoseconds since the epoch in UTC
+
+PICKLE_PATTERN = re.compile(r'^([A-Z]{3}_[A-Z]{3})_([A-Z]\d+)\.pkl$')
+
+def get_series_dir(path, pair, granularity):
+    return os.path.join(path, pair, granularity)
+
+def get_col_file(year_dir, col):
+    return os.path.join(year_dir, f'{col}.bin')
+
+def load_schema(path, pair, granularity):
+    '''returns the dict of column name to numpy dtype for the pair and granularity or None when nothing is stored'''
+    filename = os.path.join(get_series_dir(path, pair, granularity), SCHEMA_FILE)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'r') as f:
+        return json.loads(f.read())
+
+def has_candles(pair, granularity, path=STORE_PATH):
+    return load_schema(path, pair, granularity) is not None
+
+def list_years(path, pair, granularity):
+    series_dir = get_series_dir(path, pair, granularity)
+    if not os.path.isdir(series_dir):
+        return []
+    return sorted([int(x) for x in os.listdir(series_dir) if x.isdigit()])
+
+def get_schema(df: pd.DataFrame):
+    '''the schema holds every column of the dataframe with its dtype, the time column is always int64'''
+    schema = {}
+    for col in df.columns:
+        schema[col] = 'int64' if col == TIME_COL else str(df[col].dtype)
+    return schema
+
+def to_time_values(times):
+    '''converts a time column or a single date (str or datetime) to int64 nanoseconds in UTC'''
+    if isinstance(times, pd.Series):
+        return pd.DatetimeIndex(pd.to_datetime(times, utc=True)).as_unit('ns').asi8
+    ts = pd.Timestamp(times)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize('UTC')
+    return ts.as_unit('ns').value
+
+def from_time_values(values):
+    return pd.to_datetime(np.asarray(values, dtype='int64'), utc=True)
+
+def read_column(year_dir, col, dtype, length):
+    '''memory maps one column file of a year partition'''
+    if length == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(get_col_file(year_dir, col), dtype=dtype, mode='r', shape=(length,))
+
+def partition_length(year_dir):
+    # time is the last column written to a partition, so its length is the number of complete rows
+    filename = get_col_file(year_dir, TIME_COL)
+    if not os.path.isfile(filename):
+        return 0
+    return os.path.getsize(filename) // np.dtype('int64').itemsize
+
+def truncate_partition(year_dir, schema):
+    '''
+    an append stopped part way (a crash) can leave rows in the column files written before time.bin, and part of a row at
+    the end of time.bin. they are cut back to the complete rows, so the next append lines up the columns with the times.
+    '''
+    length = partition_length(year_dir)
+    for col, dtype in schema.items():
+        filename = get_col_file(year_dir, col)
+        size = length * np.dtype(dtype).itemsize
+        if os.path.isfile(filename) and os.path.getsize(filename) > size:
+            os.truncate(filename, size)
+
+def write_partition(year_dir, df: pd.DataFrame, schema):
+    '''writes the rows of one year to a temporary folder which then replaces the partition'''
+    tmp_dir = f'{year_dir}.tmp'
+    if os.path.isdir(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    for col, dtype in schema.items():
+        if col == TIME_COL:
+            continue
+        df[col].to_numpy(dtype=dtype).tofile(get_col_file(tmp_dir, col))
+    to_time_values(df[TIME_COL]).tofile(get_col_file(tmp_dir, TIME_COL))
+
+    if os.path.isdir(year_dir):
+        shutil.rmtree(year_dir)
+    os.replace(tmp_dir, year_dir)
+
+def write_candles(df: pd.DataFrame, pair, granularity, path=STORE_PATH):
+    '''
+    write_candles saves the whole history of a pair and granularity, replacing anything stored for them before.
+    the rows are sorted and deduplicated on time and split into one partition per year.
+    '''
+    df = df.drop_duplicates(subset=[TIME_COL]).sort_values(by=TIME_COL)
+    series_dir = get_series_dir(path, pair, granularity)
+    if os.path.isdir(series_dir):
+        shutil.rmtree(series_dir)
+    os.makedirs(series_dir)
+
+    schema = get_schema(df)
+    years = pd.to_datetime(df[TIME_COL], utc=True).dt.year
+    for year, df_year in df.groupby(years.to_numpy()):
+        write_partition(os.path.join(series_dir, str(year)), df_year, schema)
+
+    with open(os.path.join(series_dir, SCHEMA_FILE), 'w') as f:
+        f.write(json.dumps(schema, indent=2))
+
+def delete_candles(pair, granularity, path=STORE_PATH):
+    '''removes everything stored for the pair and granularity'''
+    series_dir = get_series_dir(path, pair, granularity)
+    if os.path.isdir(series_dir):
+        shutil.rmtree(series_dir)
+
+def replace_candles(pair, granularity, staged, path=STORE_PATH):
+    '''
+    replace_candles swaps the series stored under the granularity name staged (e.g. 'M5.partial', a download written next
+    to the history it replaces) in for the granularity. the old history is moved aside first and removed once the staged
+    series is in place, so a crash leaves either of them complete. nothing happens when there is no staged series, it was
+    either swapped in already or nothing was written to it.
+    '''
+    series_dir = get_series_dir(path, pair, granularity)
+    staged_dir = get_series_dir(path, pair, staged)
+    old_dir = f'{series_dir}.old'
+    if os.path.isdir(staged_dir):
+        if os.path.isdir(old_dir):
+            shutil.rmtree(old_dir)
+        if os.path.isdir(series_dir):
+            os.replace(series_dir, old_dir)
+        os.replace(staged_dir, series_dir)
+    if os.path.isdir(old_dir):
+        shutil.rmtree(old_dir)
+
+def last_time(pair, granularity, path=STORE_PATH):
+    '''returns the time of the last stored candle as a pd.Timestamp or None when nothing is stored'''
+    for year in reversed(list_years(path, pair, granularity)):
+        year_dir = os.path.join(get_series_dir(path, pair, granularity), str(year))
+        length = partition_length(year_dir)
+        if length > 0:
+            return from_time_values(read_column(year_dir, TIME_COL, 'int64', length)[-1:])[0]
+    return None
+
+def append_candles(df: pd.DataFrame, pair, granularity, path=STORE_PATH):
+    '''
+    append_candles adds new candles to the end of the stored history without rewriting it.
+    the new rows are sorted and deduplicated on time, and the ones that are not newer than the last stored candle are dropped,
+    so the only place duplicates are checked against stored data is the seam. the rest is appended to the column files
+    of the year partitions, after cutting off what an earlier append that did not finish left in them (truncate_partition).
+    the number of appended rows is returned.
+    '''
+    schema = load_schema(path, pair, granularity)
+    if schema is None:
+        write_candles(df, pair, granularity, path)
+        return df.drop_duplicates(subset=[TIME_COL]).shape[0]
+    if set(df.columns) != set(schema.keys()):
+        raise ValueError(f'{pair} {granularity} columns {list(df.columns)} do not match the store {list(schema.keys())}')
+
+    df = df.drop_duplicates(subset=[TIME_COL]).sort_values(by=TIME_COL)
+    times = to_time_values(df[TIME_COL])
+    last = last_time(pair, granularity, path)
+    if last is not None:
+        keep = times > last.value
+        df = df[keep]
+        times = times[keep]
+    if df.shape[0] == 0:
+        return 0
+
+    years = from_time_values(times).year.to_numpy()
+    series_dir = get_series_dir(path, pair, granularity)
+    for year in np.unique(years):
+        in_year = years == year
+        year_dir = os.path.join(series_dir, str(year))
+        os.makedirs(year_dir, exist_ok=True)
+        truncate_partition(year_dir, schema)
+        for col, dtype in schema.items():
+            if col == TIME_COL:
+                continue
+            with open(get_col_file(year_dir, col), 'ab') as f:
+                df[col].to_numpy(dtype=dtype)[in_year].tofile(f)
+        with open(get_col_file(year_dir, TIME_COL), 'ab') as f:
+            times[in_year].tofile(f)
+    return df.shape[0]
+
+def read_candles(pair, granularity, date_f=None, date_t=None, columns=None, path=STORE_PATH):
+    '''
+    read_candles loads the candles of a pair and granularity from the store:
+    date_f, date_t: optional str or datetime limits, the rows with date_f <= time < date_t are returned.
+    columns: optional list of the columns to load, e.g. ['time', 'mid_c']. all the columns are loaded when it is None.
+
+    only the year partitions inside the date range are opened and only the requested columns are read from them.
+    None is returned when the pair and granularity are not in the store.
+    '''
+    schema = load_schema(path, pair, granularity)
+    if schema is None:
+        return None
+    if columns is None:
+        columns = list(schema.keys())
+    missing = [c for c in columns if c not in schema]
+    if len(missing) > 0:
+        raise KeyError(f'{pair} {granularity} has no columns {missing}')
+
+    t_from = None if date_f is None else to_time_values(date_f)
+    t_to = None if date_t is None else to_time_values(date_t)
+    y_from = None if date_f is None else from_time_values([t_from]).year[0]
+    y_to = None if date_t is None else from_time_values([t_to]).year[0]
+
+    data = {col: [] for col in columns}
+    for year in list_years(path, pair, granularity):
+        if (y_from is not None and year < y_from) or (y_to is not None and year > y_to):
+            continue
+        year_dir = os.path.join(get_series_dir(path, pair, granularity), str(year))
+        length = partition_length(year_dir)
+        times = read_column(year_dir, TIME_COL, 'int64', length)
+        start = 0 if t_from is None else np.searchsorted(times, t_from, side='left')
+        end = length if t_to is None else np.searchsorted(times, t_to, side='left')
+        if end <= start:
+            continue
+        for col in columns:
+            data[col].append(np.array(read_column(year_dir, col, schema[col], length)[start:end]))
+
+    df = pd.DataFrame({
+        col: np.concatenate(v) if len(v) > 0 else np.empty(0, dtype=schema[col])
+        for col, v in data.items()
+    })
+    if TIME_COL in df.columns:
+        df[TIME_COL] = from_time_values(df[TIME_COL])
+    return df
+
+def load_candles(pair, granularity, date_f=None, date_t=None, columns=None, data_path='./data'):
+    '''
+    load_candles is what the simulators use to get price data. it reads from the candle store in data_path
+    and falls back to the old whole-history pickle when the pair has not been migrated yet.
+    '''
+    df = read_candles(pair, granularity, date_f, date_t, columns, path=os.path.join(data_path, STORE_DIR))
+    if df is not None:
+        return df
+
+    df = pd.read_pickle(os.path.join(data_path, f'{pair}_{granularity}.pkl'))
+    if date_f is not None:
+        df = df[df[TIME_COL] >= pd.Timestamp(to_time_values(date_f), tz='UTC')]
+    if date_t is not None:
+        df = df[df[TIME_COL] < pd.Timestamp(to_time_values(date_t), tz='UTC')]
+    if columns is not None:
+        df = df[columns]
+    return df.reset_index(drop=True)
+
+def has_data(pair, granularity, data_path='./data'):
+    '''True when load_candles finds the pair and granularity, in the candle store or as an old pickle'''
+    return (has_candles(pair, granularity, os.path.join(data_path, STORE_DIR))
+            or os.path.isfile(os.path.join(data_path, f'{pair}_{granularity}.pkl')))
+
+def stored_bytes(pair, granularity, columns=None, data_path='./data'):
+    '''
+    the bytes on disk load_candles reads for the columns (all of them when None) of the whole history of the pair and
+    granularity: the complete rows of the column files, or the size of the old pickle when the pair is not in the store.
+    '''
+    path = os.path.join(data_path, STORE_DIR)
+    schema = load_schema(path, pair, granularity)
+    if schema is None:
+        filename = os.path.join(data_path, f'{pair}_{granularity}.pkl')
+        return os.path.getsize(filename) if os.path.isfile(filename) else 0
+    row_bytes = sum([np.dtype(schema[col]).itemsize for col in (schema.keys() if columns is None else columns)])
+    total = 0
+    for year in list_years(path, pair, granularity):
+        total += partition_length(os.path.join(get_series_dir(path, pair, granularity), str(year))) * row_bytes
+    return total
+
+def migrate_pickles(data_path='./data', path=None):
+    '''migrate_pickles moves every {pair}_{granularity}.pkl in data_path into the candle store. the pickles are not deleted.'''
+    if path is None:
+        path = os.path.join(data_path, STORE_DIR)
+    for filename in sorted(os.listdir(data_path)):
+        m = PICKLE_PATTERN.match(filename)
+        if m is None:
+            continue
+        pair, granularity = m.groups()
+        df = pd.read_pickle(os.path.join(data_path, filename))
+        write_candles(df, pair, granularity, path)
+        print(f'*** {filename} --> {path}/{pair}/{granularity} {df.shape}')
+
+
+if __name__ == '__main__':
+    # python -m infrastructure.candle_store migrate [data_path]
+    if len(sys.argv) > 1 and sys.argv[1] == 'migrate':
+        migrate_pickles(*sys.argv[2:3])
+    else:
+        print('usage: python -m infrastructure.candle_store migrate [data_path]')
@@ -1,11 +1,21 @@
+import os
+import json
 import pandas as pd
 import datetime as dt
+from collections import deque
 from dateutil import parser
+from concurrent.futures import ThreadPoolExecutor
 
 from infrastructure.instrument_collection import InstrumentCollection 
+from infrastructure.candle_store import STORE_DIR, write_candles, append_candles, delete_candles, replace_candles, last_time, stored_bytes
 from api.oanda_api import OandaApi
+from infrastructure.instrumentation import instrumented, df_rows
+from infrastructure.resample import BASE_GRANULARITY, DERIVED_GRANULARITIES, update_pair
 
 CANDLE_COUNT = 4000
+MAX_IN_FLIGHT = 8 # chunks requested ahead of the one being written, so at most this many are held in memory
+CHECKPOINT_DIR = 'checkpoints'
+STAGING_SUFFIX = '.partial' # a full download is written to {pair}/{granularity}.partial in the store until it is done
 
 INCREMENTS = {
     'M5' : 5 * CANDLE_COUNT,
@@ -14,79 +24,184 @@ INCREMENTS = {
     'H4' : 240 * CANDLE_COUNT,
 }
 
+@instrumented('save_file', rows=lambda result, df, *args, **kwargs: df_rows(df),
+              bytes_written=lambda result, df, file_prefix, granularity, pair: stored_bytes(pair, granularity, data_path=file_prefix))
 def save_file(final_df: pd.DataFrame, file_prefix, granularity, pair):
-    filename = f'{file_prefix}{pair}_{granularity}.pkl'
+    # the candles are saved in the candle store under file_prefix, partitioned by year
     final_df.drop_duplicates(subset=['time'], inplace=True)
     final_df.sort_values(by='time', inplace=True)
     final_df.reset_index(drop=True, inplace=True)
-    final_df.to_pickle(filename);
+    write_candles(final_df, pair, granularity, os.path.join(file_prefix, STORE_DIR))
 
     s1 = f'*** {pair} {granularity} {final_df["time"].min()} {final_df["time"].max()}'
     print(f'*** {s1} --> {final_df.shape}')
 
-def fetch_candles(pair, granularity, date_f: dt.datetime, date_t: dt.datetime, api: OandaApi):
-
-    attempts = 0
-
-    while attempts < 10:
+@instrumented('append_file', rows=lambda result, df, *args, **kwargs: df_rows(df))
+def append_file(new_df: pd.DataFrame, file_prefix, granularity, pair, verbose=True):
+    # only the candles newer than the stored history are appended, nothing already saved is rewritten
+    added = append_candles(new_df, pair, granularity, os.path.join(file_prefix, STORE_DIR))
+    if verbose == True:
+        s1 = f'*** {pair} {granularity} {new_df["time"].min()} {new_df["time"].max()}'
+        print(f'*** {s1} --> {added} new candles appended')
+    return added
 
-        candles_df = api.get_candle_df(pair, granularity = granularity, date_f=date_f, date_t=date_t)
+def fetch_candles(pair, granularity, date_f: dt.datetime, date_t: dt.datetime, api: OandaApi):
+    # the retries with backoff are done by api.make_request, so a chunk is only requested once here.
+    # None when the request failed, an empty dataframe when there are no candles in the chunk (e.g. a weekend)
+    return api.get_candle_df(pair, granularity = granularity, date_f=date_f, date_t=date_t)
 
-        if candles_df is not None:
-            break
+def get_checkpoint_file(file_prefix, pair, granularity):
+    return os.path.join(file_prefix, CHECKPOINT_DIR, f'{pair}_{granularity}.json')
 
-        attempts += 1
-    
-    if candles_df is not None  and candles_df.empty == False:
-        return candles_df
-    else:
+def read_checkpoint(file_prefix, pair, granularity):
+    filename = get_checkpoint_file(file_prefix, pair, granularity)
+    if not os.path.isfile(filename):
         return None
-
-def collect_data(pair, granularity, date_f, date_t, file_prefix, api: OandaApi):
-    
+    with open(filename, 'r') as f:
+        return json.loads(f.read())
+
+def write_checkpoint(file_prefix, pair, granularity, checkpoint):
+    # written to a temporary file which replaces the checkpoint, so a crash never leaves half of one
+    filename = get_checkpoint_file(file_prefix, pair, granularity)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(f'{filename}.tmp', 'w') as f:
+        f.write(json.dumps(checkpoint, indent=2))
+    os.replace(f'{filename}.tmp', filename)
+
+def remove_checkpoint(file_prefix, pair, granularity):
+    filename = get_checkpoint_file(file_prefix, pair, granularity)
+    if os.path.isfile(filename):
+        os.remove(filename)
+
+def fetch_chunks(fetch, chunks, executor=None, max_in_flight=MAX_IN_FLIGHT):
+    '''
+    yields the result of fetch for every chunk in chunk order. on an executor at most max_in_flight chunks are
+    requested ahead of the one being consumed, so the downloads can not run far ahead of the writes.
+    '''
+    if executor is None:
+        for chunk in chunks:
+            yield fetch(chunk)
+        return
+    pending = deque()
+    i = 0
+    try:
+        while i < len(chunks) or len(pending) > 0:
+            while i < len(chunks) and len(pending) < max_in_flight:
+                pending.append(executor.submit(fetch, chunks[i]))
+                i += 1
+            yield pending.popleft().result()
+    finally:
+        for future in pending: # the consumer stopped early
+            future.cancel()
+
+def get_chunks(granularity, from_date, end_date):
+    '''splits the window from_date -> end_date in the (from, to) chunks of CANDLE_COUNT candles that are requested one by one'''
     time_step = INCREMENTS[granularity]
-
-    end_date = parser.parse(date_t)
-    from_date = parser.parse(date_f)
-
-    candle_dfs = []
-
+    chunks = []
     to_date = from_date
-
     while to_date < end_date:
         to_date = from_date + dt.timedelta(minutes=time_step)
         if to_date > end_date:
             to_date = end_date
-        
-        candles = fetch_candles(pair, granularity, from_date, to_date, api)
-
-        if candles is not None:
-            candle_dfs.append(candles)
-            print (f'{pair} {granularity} {from_date} {to_date} --> {candles.shape[0]} candles loaded')
-        else:
-            print (f'{pair} {granularity} {from_date} {to_date} --> NO CANDLES')
-
+        chunks.append((from_date, to_date))
         from_date = to_date
-    
-    if len(candle_dfs) > 0:
-        final_df = pd.concat(candle_dfs)
-        save_file(final_df, file_prefix, granularity, pair)
+    return chunks
+
+def collect_data(pair, granularity, date_f, date_t, file_prefix, api: OandaApi, incremental=False, executor=None,
+                 max_in_flight=MAX_IN_FLIGHT):
+    '''
+    collect_data downloads the candles of the pair and granularity between date_f and date_t in chunks of CANDLE_COUNT candles.
+    every chunk is appended to the candle store as soon as it arrives, so only the chunks in flight are held in memory.
+    by default the whole window is downloaded and replaces the stored history.
+    with incremental=True the download starts from the last stored candle instead of date_f and only the newer
+    candles are appended.
+    when an executor is given the chunks are fetched concurrently on it, max_in_flight at most, and written in chunk order.
+
+    after every chunk a checkpoint ({file_prefix}/checkpoints/{pair}_{granularity}.json) records where the next one
+    starts. a run stopped by a crash or a failed chunk is resumed from there by running it again with the same dates,
+    and the checkpoint is removed once the window is done.
+    a full download is written to a staging series ({STORE_DIR}/{pair}/{granularity}.partial) and only replaces the
+    stored history once its last chunk is in, so after a stop the old history is still there. the staging series is
+    resumed from the checkpoint like an incremental download. a window without any candles leaves the history as it is.
+    returns True when the whole window was downloaded, False when it stopped at a failed chunk.
+    '''
+    end_date = parser.parse(date_t)
+    from_date = parser.parse(date_f)
+    store_path = os.path.join(file_prefix, STORE_DIR)
+
+    checkpoint = read_checkpoint(file_prefix, pair, granularity)
+    run = dict(date_f=date_f, date_t=date_t, incremental=incremental)
+    # the granularity name the chunks are appended to
+    target = granularity if incremental == True else f'{granularity}{STAGING_SUFFIX}'
+    if checkpoint is not None and checkpoint['run'] == run:
+        from_date = parser.parse(checkpoint['next'])
+        print(f'{pair} {granularity} resuming from {from_date} ({checkpoint["candles"]} candles written before)')
+    else:
+        checkpoint = dict(run=run, next=None, chunks=0, candles=0)
+        if incremental == True:
+            last = last_time(pair, granularity, store_path)
+            if last is not None:
+                from_date = last.to_pydatetime() # the last stored candle is fetched again and dropped at the seam
+        else:
+            delete_candles(pair, target, store_path) # left over from a run with other dates
+
+    chunks = get_chunks(granularity, from_date, end_date)
+    fetch = lambda chunk: fetch_candles(pair, granularity, chunk[0], chunk[1], api)
+
+    for (from_date, to_date), candles in zip(chunks, fetch_chunks(fetch, chunks, executor, max_in_flight)):
+        if candles is None:
+            # stopped here so the window has no gap, running it again resumes from this chunk
+            print(f'{pair} {granularity} {from_date} {to_date} --> FAILED, stopped at the checkpoint')
+            return False
+        added = 0
+        if candles.empty == False:
+            added = append_file(candles, file_prefix, target, pair, verbose=False)
+        checkpoint['next'] = to_date.isoformat()
+        checkpoint['chunks'] += 1
+        checkpoint['candles'] += added
+        write_checkpoint(file_prefix, pair, granularity, checkpoint)
+        print(f'{pair} {granularity} {from_date} {to_date} --> {candles.shape[0]} candles loaded, {added} written')
+
+    if target != granularity:
+        replace_candles(pair, granularity, target, store_path)
+    remove_checkpoint(file_prefix, pair, granularity)
+    if checkpoint['candles'] > 0:
+        print(f'*** {pair} {granularity} --> {checkpoint["candles"]} candles saved')
     else:
         print(f'{pair} {granularity} --> NO DATA SAVED!')
-
-
-def run_collection(ic: InstrumentCollection, api: OandaApi):
+    return True
+
+def run_collection(ic: InstrumentCollection, api: OandaApi, date_f='2016-01-01T00:00:00Z', date_t='2023-12-31T00:00:00Z', incremental=False, workers=1, derive=False):
+    # with incremental=True, e.g. for a nightly refresh up to now, only the candles after the stored history are fetched.
+    # with workers > 1 the chunks are downloaded on a pool of threads, the api's pool_size should be at least workers
+    # and its rate limiter keeps the total under the broker's limit.
+    # by default every granularity (M5, M15, H1, H4) is downloaded. with derive=True only the M5 candles are downloaded and
+    # M15, H1 and H4 are resampled from them (infrastructure/resample.py) instead of being requested.
+    # returns the (pair, granularity) downloads that did not finish, running it again with the same dates resumes them.
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        failed = collect_pairs(ic, api, date_f, date_t, incremental, executor, derive)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    if len(failed) > 0:
+        print(f'*** {len(failed)} downloads stopped before the end, run again with the same dates to resume them: {failed}')
+    return failed
+
+def collect_pairs(ic: InstrumentCollection, api: OandaApi, date_f, date_t, incremental, executor, derive=False):
     our_curr = ['AUD','CAD', 'EUR', 'GBP', 'JPY', 'NZD', 'USD']
-    for p1 in our_curr:
-        for p2 in our_curr:
-            pair = f'{p1}_{p2}'
-            if pair in ic.instruments_dict.keys():
-                for granularity in [
-                                       'M5', 
-                                       'M15', 
-                                       'H1', 
-                                       'H4'
-                                      ]:
-                    print(pair, granularity)
-                    collect_data(pair, granularity, '2016-01-01T00:00:00Z', '2023-12-31T00:00:00Z', './data/', api)
-
+    granularities = [BASE_GRANULARITY] if derive == True else ['M5', 'M15', 'H1', 'H4']
+    failed = []
+    for pair in ic.pairs_for(our_curr):
+        for granularity in granularities:
+            print(pair, granularity)
+            if collect_data(pair, granularity, date_f, date_t, './data/', api, incremental=incremental, executor=executor) == False:
+                failed.append((pair, granularity))
+        if derive == True and (pair, BASE_GRANULARITY) in failed:
+            # the base history was not (fully) updated, the derived series are left as they are until the download is resumed
+            print(f'{pair} {DERIVED_GRANULARITIES} not resampled, the {BASE_GRANULARITY} download did not finish')
+        elif derive == True:
+            # only the new base candles are aggregated after an incremental download, a full one replaced the base history
+            # so the derived series are made again from scratch
+            update_pair(pair, DERIVED_GRANULARITIES, BASE_GRANULARITY, os.path.join('./data/', STORE_DIR), rebuild=not incremental)
+    return failed
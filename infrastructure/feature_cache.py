@@ -0,0 +1,175 @@
+# in this script the feature cache is created. moving averages, indicators and candle patterns computed from the candles
+# of a pair and granularity are kept in memory (an lru bounded in bytes) and on disk under ./data/cache, keyed by
+# (pair, granularity, indicator, params, source fingerprint). the fingerprint is made from the size and modification time
+# of the candle files, so when the candles change the old entries are not used anymore and are deleted from disk.
+#
+#   values = feature_cache.get('EUR_USD', 'H4', 'MA', dict(window=20), lambda: df.mid_c.rolling(window=20).mean().to_numpy())
+
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from collections import OrderedDict
+
+from infrastructure.candle_store import STORE_DIR
+from technicals.pipeline import compute_indicators
+from technicals.patterns import pattern_signals
+
+CACHE_PATH = './data/cache'
+MAX_MEMORY_BYTES = 512 * 1024 * 1024
+
+def source_fingerprint(pair, granularity, data_path='./data'):
+    '''a short hash of the size and modification time of the candle files the pair and granularity are loaded from'''
+    parts = []
+    series_dir = os.path.join(data_path, STORE_DIR, pair, granularity)
+    if os.path.isdir(series_dir):
+        for root, _, files in sorted(os.walk(series_dir)):
+            for f in sorted(files):
+                st = os.stat(os.path.join(root, f))
+                parts.append((os.path.relpath(os.path.join(root, f), series_dir), st.st_size, st.st_mtime_ns))
+    else:
+        filename = os.path.join(data_path, f'{pair}_{granularity}.pkl')
+        if os.path.isfile(filename):
+            st = os.stat(filename)
+            parts.append((filename, st.st_size, st.st_mtime_ns))
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+
+def params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+def get_nbytes(value):
+    if isinstance(value, dict):
+        return sum([v.nbytes for v in value.values()])
+    return value.nbytes
+
+def freeze(value):
+    '''makes the arrays of a value read only, the same arrays are handed to every caller so none of them can change them'''
+    for v in (value.values() if isinstance(value, dict) else [value]):
+        v.setflags(write=False)
+    return value
+
+def get_length(value):
+    if isinstance(value, dict):
+        return next(iter(value.values())).shape[0] if len(value) > 0 else 0
+    return value.shape[0]
+
+class FeatureCache:
+    '''
+    get() returns the cached value of a feature or computes it with compute(), caching the result.
+    a value is a numpy array or a dict of column name to numpy array, e.g. the output of compute_indicators(as_frame=False).
+    the arrays are shared by every caller and read only, a caller that changes them has to copy them first.
+    '''
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_MEMORY_BYTES, data_path='./data'):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.data_path = data_path
+        self.memory = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f'FeatureCache(entries={len(self.memory)}, bytes={self.memory_bytes}, hits={self.hits}, disk_hits={self.disk_hits}, misses={self.misses})'
+
+    def get_file(self, pair, granularity, indicator, params, fingerprint):
+        name = f'{indicator}_{params_hash(params)}'
+        return os.path.join(self.path, pair, granularity, f'{name}_{fingerprint}.npz'), name
+
+    def get(self, pair, granularity, indicator, params, compute, length=None):
+        '''
+        pair, granularity: the candles the feature is computed from.
+        indicator, params: the name and the parameters of the feature, params must be json serializable.
+        compute: called without arguments to compute the value when it is not cached.
+        length: optional number of candles the value must have, a cached value of another length is recomputed.
+        '''
+        fingerprint = source_fingerprint(pair, granularity, self.data_path)
+        filename, name = self.get_file(pair, granularity, indicator, params, fingerprint)
+        key = (pair, granularity, name, fingerprint)
+
+        value = self.memory.get(key)
+        if value is not None and (length is None or get_length(value) == length):
+            self.memory.move_to_end(key)
+            self.hits += 1
+            return value
+
+        value = self.load(filename)
+        if value is not None and (length is None or get_length(value) == length):
+            self.disk_hits += 1
+        else:
+            self.misses += 1
+            value = compute()
+            self.save(filename, name, value)
+        freeze(value)
+        self.put(key, value)
+        return value
+
+    def put(self, key, value):
+        if key in self.memory:
+            self.memory_bytes -= get_nbytes(self.memory.pop(key))
+        nbytes = get_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        self.memory[key] = value
+        self.memory_bytes += nbytes
+        while self.memory_bytes > self.max_bytes:
+            _, old = self.memory.popitem(last=False)
+            self.memory_bytes -= get_nbytes(old)
+
+    def load(self, filename):
+        if not os.path.isfile(filename):
+            return None
+        with np.load(filename) as data:
+            if '__array__' in data.files:
+                return data['__array__']
+            return {k: data[k] for k in data.files}
+
+    def save(self, filename, name, value):
+        '''writes the value to a temporary file which replaces the entry, and deletes the entries of older candle files'''
+        folder = os.path.dirname(filename)
+        os.makedirs(folder, exist_ok=True)
+        for f in os.listdir(folder):
+            if f.startswith(f'{name}_') and f.endswith('.npz') and os.path.join(folder, f) != filename:
+                try:
+                    os.remove(os.path.join(folder, f))
+                except FileNotFoundError: # another worker got there first
+                    pass
+
+        # a unique temporary file in the same folder, so threads and processes writing the same entry do not collide
+        fd, tmp = tempfile.mkstemp(dir=folder, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                if isinstance(value, dict):
+                    np.savez(f, **value)
+                else:
+                    np.savez(f, __array__=value)
+            os.replace(tmp, filename)
+        except BaseException:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+            raise
+
+    def clear_memory(self):
+        self.memory.clear()
+        self.memory_bytes = 0
+
+def moving_average(df, pair, granularity, window, cache=None):
+    '''the rolling mean of mid_c over window candles, df must hold all the candles of the pair and granularity'''
+    cache = feature_cache if cache is None else cache
+    return cache.get(pair, granularity, 'MA', dict(window=window),
+                     lambda: df['mid_c'].rolling(window=window).mean().to_numpy(), length=df.shape[0])
+
+def cached_indicators(df, pair, granularity, specs, cache=None):
+    '''compute_indicators(df, specs, as_frame=False) through the cache, df must hold all the candles of the pair and granularity'''
+    cache = feature_cache if cache is None else cache
+    return cache.get(pair, granularity, 'indicators', dict(specs=specs),
+                     lambda: compute_indicators(df, specs, as_frame=False), length=df.shape[0])
+
+def cached_patterns(df, pair, granularity, patterns=None, cache=None):
+    '''pattern_signals(df, patterns, as_frame=False) through the cache, df must hold all the candles of the pair and granularity'''
+    cache = feature_cache if cache is None else cache
+    return cache.get(pair, granularity, 'patterns', dict(patterns=patterns),
+                     lambda: pattern_signals(df, patterns, as_frame=False), length=df.shape[0])
+
+feature_cache = FeatureCache()
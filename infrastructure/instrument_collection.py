@@ -2,7 +2,9 @@
 #  into a python dictionary object.
 
 from models.instruments import Instrument
+import os
 import json
+import numpy as np
 
 class InstrumentCollection:
     FILENAME = 'instruments.json' # intialize the filename to instruments.json, a name i want to save the file with
@@ -19,6 +21,35 @@ class InstrumentCollection:
 
     def __init__(self):
         self.instruments_dict = {} # at instantiation, the instruments_dict is initialized to empty
+        self.loaded_from = None # (file, modification time) of the loaded file, so it is only parsed again when it changes
+        self.build_index()
+
+    def __getstate__(self):
+        # only the instruments are sent to worker processes, the index is rebuilt on arrival
+        return {'instruments_dict': self.instruments_dict, 'loaded_from': self.loaded_from}
+
+    def __setstate__(self, state):
+        self.instruments_dict = state['instruments_dict']
+        self.loaded_from = state['loaded_from']
+        self.build_index()
+
+    def build_index(self):
+        '''
+        precomputes from instruments_dict:
+        names: the instrument names in file order, position: name -> position in names.
+        by_currency: currency -> the names of the pairs it is in, on either side. by_base: the same for the base currency only.
+        pip_locations, margin_rates: numpy arrays in the order of names, for pip and margin math over many pairs at once.
+        '''
+        self.names = list(self.instruments_dict.keys())
+        self.position = {name: i for i, name in enumerate(self.names)}
+        self.by_currency = {}
+        self.by_base = {}
+        for name, ins in self.instruments_dict.items():
+            self.by_base.setdefault(ins.base, []).append(name)
+            for curr in (ins.base, ins.quote):
+                self.by_currency.setdefault(curr, []).append(name)
+        self.pip_locations = np.array([ins.pipLocation for ins in self.instruments_dict.values()], dtype=np.float64)
+        self.margin_rates = np.array([ins.marginRate for ins in self.instruments_dict.values()], dtype=np.float64)
 
     def CreateFile(self, data, path):
         #  to create the dict object, Createfile takes the data returned from the instruments endpoint of the oandaapi class
@@ -38,12 +69,44 @@ class InstrumentCollection:
             
 
     def LoadInstruments(self, path):
-        self.instruments_dict = {}
         fileName =f'{path}/{self.FILENAME}'
+        loaded_from = (os.path.abspath(fileName), os.stat(fileName).st_mtime_ns)
+        if loaded_from == self.loaded_from: # already loaded and the file has not changed
+            return
+
+        self.instruments_dict = {}
         with open(fileName, 'r') as f:
             data = json.loads(f.read())
             for k, v in data.items():
                 self.instruments_dict[k] = Instrument.FromApiObject(v)
+        self.loaded_from = loaded_from
+        self.build_index()
+
+    def pairs_for(self, curr_list):
+        '''
+        the tradable pairs made of two currencies of curr_list, in the order of combining every p1 with every p2 of
+        curr_list, like probing f'{p1}_{p2}' for all of them, but only the pairs of the index are looked at.
+        a currency repeated in curr_list is only used once.
+        '''
+        order = {}
+        for i, curr in enumerate(curr_list):
+            order.setdefault(curr, i)
+        pairs = []
+        for p1 in order.keys():
+            quoted = [name for name in self.by_base.get(p1, []) if self.instruments_dict[name].quote in order]
+            pairs += sorted(quoted, key=lambda name: order[self.instruments_dict[name].quote])
+        return pairs
+
+    def get_positions(self, pairs):
+        return np.array([self.position[pair] for pair in pairs], dtype=np.int64)
+
+    def get_pip_locations(self, pairs):
+        '''the pipLocation of every pair of the list as a numpy array, e.g. pips = price_diffs / ic.get_pip_locations(pairs)'''
+        return self.pip_locations[self.get_positions(pairs)]
+
+    def get_margin_rates(self, pairs):
+        '''the marginRate of every pair of the list as a numpy array, e.g. margins = units * prices * ic.get_margin_rates(pairs)'''
+        return self.margin_rates[self.get_positions(pairs)]
 
     def PrintInstruments(self):
         [print(k,v) for k, v in self.instruments_dict.items()]
@@ -0,0 +1,279 @@
+# in this script the opt-in instrumentation of the collection and the simulation is created. the hot functions are wrapped
+# with @instrumented(stage) and, once instrumentation.enable() is called, every call adds its wall time (and, when known,
+# the rows it processed and the bytes it read or wrote) to the stats of its stage. when it is not enabled the wrappers only
+# check a flag, so the normal runs are not slowed down.
+#
+#   with profile_run('backfill', report_path='./data/reports', profiler='cprofile'):
+#       run_collection(ic, api)
+#
+# prints a report per stage: calls, wall time, latency percentiles, rows/s and bytes read / written, and saves it as json
+# (with the cProfile stats next to it). the http responses of the api are recorded as the api_response stage, from the
+# time the broker took to answer, so its percentiles are the api latency.
+
+import os
+import sys
+import time
+import json
+import random
+import cProfile
+import pstats
+import functools
+import threading
+import contextlib
+import datetime as dt
+import numpy as np
+
+# pyinstrument is a sampling profiler with a much lower overhead than cProfile, it is used when it is installed
+try:
+    from pyinstrument import Profiler as SamplingProfiler
+except ImportError:
+    SamplingProfiler = None
+
+MAX_SAMPLES = 100_000 # durations kept per stage for the percentiles, a random sample of them once there are more
+PERCENTILES = [50, 90, 99]
+
+def merge_samples(a, a_calls, b, b_calls, size=MAX_SAMPLES):
+    '''
+    merges two uniform samples of durations, standing for a_calls and b_calls calls, into one of at most size durations.
+    each sample gives a share of the result in proportion to its calls, so the percentiles are not skewed to either side.
+    '''
+    if len(a) + len(b) <= size:
+        return a + b
+    n_a = min(len(a), round(size * a_calls / max(a_calls + b_calls, 1)))
+    n_b = min(len(b), size - n_a)
+    return random.sample(a, n_a) + random.sample(b, n_b)
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.durations = []
+
+    def add_duration(self, seconds):
+        self.calls += 1
+        self.seconds += seconds
+        if len(self.durations) < MAX_SAMPLES:
+            self.durations.append(seconds)
+        else: # reservoir sampling keeps a uniform sample of all the calls
+            i = random.randrange(self.calls)
+            if i < MAX_SAMPLES:
+                self.durations[i] = seconds
+
+    def merge(self, other):
+        self.durations = merge_samples(self.durations, self.calls, other.durations, other.calls)
+        self.calls += other.calls
+        self.errors += other.errors
+        self.seconds += other.seconds
+        self.rows += other.rows
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+
+    def as_dict(self):
+        result = dict(
+            calls=self.calls,
+            errors=self.errors,
+            seconds=round(self.seconds, 6),
+            mean_ms=round(self.seconds / self.calls * 1000, 3) if self.calls > 0 else None,
+            rows=self.rows,
+            rows_per_s=round(self.rows / self.seconds, 1) if self.seconds > 0 and self.rows > 0 else None,
+            bytes_read=self.bytes_read,
+            bytes_written=self.bytes_written,
+        )
+        if len(self.durations) > 0:
+            for p, value in zip(PERCENTILES, np.percentile(self.durations, PERCENTILES)):
+                result[f'p{p}_ms'] = round(float(value) * 1000, 3)
+        return result
+
+class StageRecord:
+    '''handed out by Instrumentation.stage, the rows and bytes of the call can be set on it before the stage ends'''
+    __slots__ = ('rows', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+class Instrumentation:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.stages = {}
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+
+    def record(self, name, seconds, rows=0, bytes_read=0, bytes_written=0, error=False):
+        with self.lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(name)
+            stats.add_duration(seconds)
+            stats.errors += error
+            stats.rows += rows
+            stats.bytes_read += bytes_read
+            stats.bytes_written += bytes_written
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''times the block as a call of the stage, the rows and bytes set on the yielded record are added to it'''
+        record = StageRecord()
+        if self.enabled == False:
+            yield record
+            return
+        start = time.perf_counter()
+        error = False
+        try:
+            yield record
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, record.rows, record.bytes_read, record.bytes_written, error)
+
+    def snapshot(self):
+        '''the stats as plain objects, to send them from a worker process to the parent'''
+        with self.lock:
+            return list(self.stages.values())
+
+    def merge(self, snapshot):
+        if snapshot is None:
+            return
+        with self.lock:
+            for other in snapshot:
+                if other.name not in self.stages:
+                    self.stages[other.name] = StageStats(other.name)
+                self.stages[other.name].merge(other)
+
+    def report(self):
+        '''stage name -> stats dict, the slowest stages first'''
+        with self.lock:
+            stages = sorted(self.stages.values(), key=lambda s: s.seconds, reverse=True)
+            return {s.name: s.as_dict() for s in stages}
+
+    def print_report(self, title='instrumentation', file=None):
+        file = sys.stdout if file is None else file
+        print(f'*** {title}', file=file)
+        print(f'{"stage":22} {"calls":>8} {"wall s":>9} {"mean ms":>9} {"p50 ms":>9} {"p90 ms":>9} {"p99 ms":>9} '
+              f'{"rows/s":>12} {"MB read":>9} {"MB written":>10}', file=file)
+        fmt = lambda v, width, spec: format(v, f'>{width}{spec}') if v is not None else format('-', f'>{width}')
+        for name, s in self.report().items():
+            print(f'{name:22} {s["calls"]:>8} {s["seconds"]:>9.3f} {fmt(s["mean_ms"], 9, ".2f")} '
+                  f'{fmt(s.get("p50_ms"), 9, ".2f")} {fmt(s.get("p90_ms"), 9, ".2f")} {fmt(s.get("p99_ms"), 9, ".2f")} '
+                  f'{fmt(s["rows_per_s"], 12, ",.0f")} {s["bytes_read"] / 1e6:>9.2f} {s["bytes_written"] / 1e6:>10.2f}', file=file)
+
+instrumentation = Instrumentation()
+
+def instrumented(name, rows=None, bytes_read=None, bytes_written=None):
+    '''
+    decorator timing every call of the function as the stage name when instrumentation is enabled.
+    rows, bytes_read, bytes_written: optional functions of (result, *args, **kwargs) giving the rows processed and
+    the bytes read / written by the call.
+    '''
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if instrumentation.enabled == False:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                instrumentation.record(name, time.perf_counter() - start, error=True)
+                raise
+            seconds = time.perf_counter() - start
+            instrumentation.record(
+                name, seconds,
+                rows=0 if rows is None else rows(result, *args, **kwargs),
+                bytes_read=0 if bytes_read is None else bytes_read(result, *args, **kwargs),
+                bytes_written=0 if bytes_written is None else bytes_written(result, *args, **kwargs)
+            )
+            return result
+        return wrapper
+    return decorator
+
+def df_rows(df):
+    return 0 if df is None else df.shape[0]
+
+def file_size(filename):
+    return os.path.getsize(filename) if filename is not None and os.path.isfile(filename) else 0
+
+def record_response(response, *args, **kwargs):
+    '''a requests response hook recording the time the api took to answer and the size of the body as the api_response stage'''
+    if instrumentation.enabled:
+        instrumentation.record('api_response', response.elapsed.total_seconds(), bytes_read=len(response.content),
+                               error=response.status_code >= 400)
+    return response
+
+def worker_init(enabled):
+    '''initializer of the worker processes, so they are instrumented when the parent is'''
+    instrumentation.enable(enabled)
+
+def call_with_stats(fn, *args, **kwargs):
+    '''runs fn in a worker process and returns (result, the stats of the call) so the parent can merge them'''
+    if instrumentation.enabled == False:
+        return fn(*args, **kwargs), None
+    instrumentation.reset()
+    result = fn(*args, **kwargs)
+    return result, instrumentation.snapshot()
+
+@contextlib.contextmanager
+def profile_run(title='run', report_path=None, profiler=None):
+    '''
+    enables the instrumentation for the block and prints the report at the end.
+    report_path: optional folder the report is saved to as {title}_{time}.json.
+    profiler: None, 'cprofile' or 'sampling' (pyinstrument). the profile is printed (top 30 functions by cumulative time)
+    and, with report_path, saved next to the report.
+    '''
+    was_enabled = instrumentation.enabled
+    instrumentation.reset()
+    instrumentation.enable()
+
+    prof = None
+    if profiler == 'cprofile':
+        prof = cProfile.Profile()
+        prof.enable()
+    elif profiler == 'sampling':
+        if SamplingProfiler is None:
+            print('profile_run: pyinstrument is not installed, running without the sampling profiler')
+        else:
+            prof = SamplingProfiler()
+            prof.start()
+
+    start = time.perf_counter()
+    try:
+        yield instrumentation
+    finally:
+        wall = time.perf_counter() - start
+        if profiler == 'cprofile':
+            prof.disable()
+        elif prof is not None:
+            prof.stop()
+        instrumentation.enable(was_enabled)
+
+        instrumentation.print_report(f'{title} {wall:.2f} s')
+        stamp = dt.datetime.now().strftime('%Y%m%d-%H%M%S')
+        if report_path is not None:
+            os.makedirs(report_path, exist_ok=True)
+            filename = os.path.join(report_path, f'{title}_{stamp}')
+            with open(f'{filename}.json', 'w') as f:
+                f.write(json.dumps(dict(title=title, created=stamp, wall_seconds=round(wall, 6),
+                                        stages=instrumentation.report()), indent=2))
+            print('report saved', f'{filename}.json')
+        if profiler == 'cprofile':
+            pstats.Stats(prof).sort_stats('cumulative').print_stats(30)
+            if report_path is not None:
+                prof.dump_stats(f'{filename}.prof')
+        elif prof is not None:
+            print(prof.output_text())
+            if report_path is not None:
+                with open(f'{filename}_profile.html', 'w') as f:
+                    f.write(prof.output_html())
@@ -0,0 +1,321 @@
+# in this script the live price ingestion is created. one asyncio task reads the pricing stream of all the pairs
+# (api/price_stream.py), every tick updates the candles being built for each granularity, and every completed candle is
+# pushed to the streaming indicators (technicals/streaming.py) and the strategy of its pair and granularity, and queued
+# for the candle store. the queued candles are appended with append_candles in batches on a worker thread, so the disk
+# writes do not hold up the stream.
+#
+# the candles are aligned like the broker's and the resampled ones (infrastructure/resample.py). a candle is complete
+# when a tick or a heartbeat of a later period arrives. the first candle after the start, and the ones open across a
+# reconnect, missed the ticks before the stream was (re)opened: they are partial and dropped, so they never reach the
+# indicators, the strategies or the candle store.
+#
+#   python -m infrastructure.live_stream                                   # live, from the broker's stream
+#   python -m infrastructure.live_stream --replay --from 2023-01-02 --to 2023-02-01 --speed 0
+#
+# with --replay the stream comes from the local replay server of api/stream_server.py, which sends the stored M5 candles
+# as ticks, and nothing is written unless --store is given.
+
+import time
+import asyncio
+import argparse
+import pandas as pd
+
+from api.price_stream import PriceStream, StreamError, HEARTBEAT, PRICE, parse_time, parse_price
+from api.stream_server import start_stream_server
+from api.retry import backoff_delay
+from infrastructure.candle_store import STORE_PATH, from_time_values, append_candles
+from infrastructure.resample import bin_start, next_bin_start
+from infrastructure.instrumentation import instrumentation, profile_run
+from infrastructure.instrument_collection import instrumentCollection as ic
+from technicals.streaming import PairIndicators
+from simulation.crossover import BUY, NONE
+from simulation.strategies import StreamingMACross
+
+LIVE_CURRENCIES = ['AUD', 'CAD', 'EUR', 'GBP', 'JPY', 'NZD', 'USD']
+LIVE_GRANULARITIES = ['M5', 'M15', 'H1', 'H4']
+INDICATOR_SPECS = ['BollingerBands', 'ATR', 'RSI', 'MACD']
+SIDES = ['mid', 'bid', 'ask']
+SIDE_KEYS = [(f'{side}_h', f'{side}_l', f'{side}_c') for side in SIDES]
+BATCH_SIZE = 500 # completed candles queued before they are written
+FLUSH_SECONDS = 30.0 # and the longest they wait
+MAX_RECONNECTS = 10
+
+class CandleBuilder:
+    '''builds the candles of one pair and granularity from its ticks'''
+    def __init__(self, pair, granularity):
+        self.pair = pair
+        self.granularity = granularity
+        self.end = None
+        self.candle = None
+        self.since = None # the time of the first tick since the stream was (re)opened, the ticks before it were missed
+        self.partial = False # the candle being built started before since
+        self.dropped = 0
+
+    def reset(self):
+        '''the stream was interrupted, the candle being built misses the ticks of the gap'''
+        self.since = None
+        if self.candle is not None:
+            self.partial = True
+
+    def open(self, time, bid, ask):
+        start = bin_start(time, self.granularity)
+        self.end = next_bin_start(start, self.granularity)
+        while self.end <= time: # only around a daylight saving change
+            self.end = next_bin_start(self.end, self.granularity)
+        self.partial = start < self.since
+        self.candle = dict(time=start, volume=1)
+        for side, price in zip(SIDES, [(bid + ask) / 2, bid, ask]):
+            for x in 'ohlc':
+                self.candle[f'{side}_{x}'] = price
+
+    def update(self, time, bid, ask):
+        '''adds a tick (time in utc ns) and returns the previous candle when the tick is the first of a later period, else None'''
+        if self.since is None:
+            self.since = time
+        done = self.close_due(time)
+        if self.candle is None:
+            self.open(time, bid, ask)
+            return done
+        candle = self.candle
+        candle['volume'] += 1
+        for (h, l, c), price in zip(SIDE_KEYS, ((bid + ask) / 2, bid, ask)):
+            if price > candle[h]:
+                candle[h] = price
+            if price < candle[l]:
+                candle[l] = price
+            candle[c] = price
+        return done
+
+    def close_due(self, time):
+        '''
+        the candle being built when time is past its end, which then starts over with the next tick.
+        None when it is partial, it is only counted in dropped.
+        '''
+        if self.candle is None or time < self.end:
+            return None
+        done = self.candle
+        self.candle = None
+        if self.partial == True:
+            self.partial = False
+            self.dropped += 1
+            return None
+        return done
+
+def candles_frame(candles):
+    '''the candle dicts as a dataframe with the columns and dtypes of the candle store'''
+    df = pd.DataFrame(candles)
+    df['time'] = from_time_values(df['time'])
+    df['volume'] = df['volume'].astype('int64')
+    return df
+
+class CandleWriter:
+    '''queues the completed candles per pair and granularity and appends them to the candle store in batches'''
+    def __init__(self, path=STORE_PATH, batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.pending = {}
+        self.count = 0
+        self.written = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, pair, granularity, candle):
+        self.pending.setdefault((pair, granularity), []).append(candle)
+        self.count += 1
+
+    def is_due(self):
+        return self.count >= self.batch_size or (self.count > 0 and time.monotonic() - self.last_flush >= self.flush_seconds)
+
+    def take(self):
+        '''hands over the queued candles, to be written with write on another thread while new ones are queued'''
+        batch = self.pending
+        self.pending = {}
+        self.count = 0
+        self.last_flush = time.monotonic()
+        return batch
+
+    def write(self, batch):
+        with instrumentation.stage('live_flush') as record:
+            for (pair, granularity), candles in batch.items():
+                written = append_candles(candles_frame(candles), pair, granularity, self.path)
+                self.written += written
+                record.rows += written
+
+def print_signal(pair, granularity, candle, signal, values):
+    print(f'*** {pair} {granularity} {from_time_values([candle["time"]])[0]} {"BUY" if signal == BUY else "SELL"} mid_c={candle["mid_c"]}')
+
+class LiveService:
+    '''
+    pairs, granularities: the candles built from the stream.
+    specs: the streaming indicators updated with every candle of every pair and granularity.
+    strategy: optional function of (pair, granularity) returning the strategy of that series (an object with
+    update(candle, values) returning BUY / SELL / NONE) or None for no strategy.
+    on_signal: called with (pair, granularity, candle, signal, values) for every BUY / SELL, print_signal by default.
+    writer: the CandleWriter of the completed candles, None to keep them in memory only.
+    '''
+    def __init__(self, pairs, granularities=LIVE_GRANULARITIES, specs=INDICATOR_SPECS, strategy=None, on_signal=None, writer=None):
+        self.pairs = list(pairs)
+        self.granularities = list(granularities)
+        self.builders = {pair: [CandleBuilder(pair, g) for g in self.granularities] for pair in self.pairs}
+        self.indicators = {g: PairIndicators(specs) for g in self.granularities}
+        self.strategy = strategy
+        self.strategies = {}
+        self.on_signal = print_signal if on_signal is None else on_signal
+        self.writer = writer
+        self.flush_task = None
+        self.stats = dict(ticks=0, heartbeats=0, candles=0, signals=0, reconnects=0)
+
+    def get_strategy(self, pair, granularity):
+        key = (pair, granularity)
+        if key not in self.strategies:
+            self.strategies[key] = None if self.strategy is None else self.strategy(pair, granularity)
+        return self.strategies[key]
+
+    def on_tick(self, pair, time, bid, ask):
+        self.stats['ticks'] += 1
+        for builder in self.builders.get(pair, []):
+            candle = builder.update(time, bid, ask)
+            if candle is not None:
+                self.on_candle(pair, builder.granularity, candle)
+
+    def on_gap(self):
+        '''the stream was cut, the candles being built are partial'''
+        for builders in self.builders.values():
+            for builder in builders:
+                builder.reset()
+
+    def get_dropped(self):
+        '''the number of partial candles dropped'''
+        return sum([builder.dropped for builders in self.builders.values() for builder in builders])
+
+    def on_heartbeat(self, time):
+        self.stats['heartbeats'] += 1
+        for pair, builders in self.builders.items():
+            for builder in builders:
+                candle = builder.close_due(time)
+                if candle is not None:
+                    self.on_candle(pair, builder.granularity, candle)
+
+    def on_candle(self, pair, granularity, candle):
+        '''a completed candle: indicators, strategy, signal and queued for the store. returns the signal'''
+        with instrumentation.stage('live_candle'):
+            values = self.indicators[granularity].update(pair, candle)
+            strategy = self.get_strategy(pair, granularity)
+            signal = NONE if strategy is None else strategy.update(candle, values)
+            if signal != NONE:
+                self.stats['signals'] += 1
+                self.on_signal(pair, granularity, candle, signal, values)
+            if self.writer is not None:
+                self.writer.add(pair, granularity, candle)
+        self.stats['candles'] += 1
+        return signal
+
+    def handle(self, msg):
+        if msg['type'] == PRICE:
+            self.on_tick(*parse_price(msg))
+        elif msg['type'] == HEARTBEAT:
+            self.on_heartbeat(parse_time(msg['time']))
+
+    def start_flush(self):
+        '''writes the queued candles on a worker thread, one batch at a time'''
+        if self.writer is None or (self.flush_task is not None and not self.flush_task.done()):
+            return
+        self.flush_task = asyncio.ensure_future(asyncio.to_thread(self.writer.write, self.writer.take()))
+
+    async def flush(self):
+        if self.flush_task is not None:
+            await self.flush_task
+        if self.writer is not None and self.writer.count > 0:
+            await asyncio.to_thread(self.writer.write, self.writer.take())
+
+    async def consume(self, stream: PriceStream):
+        async for msg in stream.messages(self.pairs):
+            self.handle(msg)
+            if self.writer is not None and self.writer.is_due():
+                self.start_flush()
+
+    async def run(self, stream: PriceStream, reconnect=True, max_reconnects=MAX_RECONNECTS):
+        '''
+        consumes the stream until it ends. with reconnect, a dropped or ended stream is opened again after a backoff
+        (the candles being built carry on but are partial and dropped when they close), up to max_reconnects times in a row.
+        '''
+        attempt = 0
+        try:
+            while True:
+                ticks = self.stats['ticks']
+                try:
+                    await self.consume(stream)
+                    error = 'stream ended'
+                except (StreamError, ConnectionError, asyncio.TimeoutError, asyncio.IncompleteReadError, OSError) as e:
+                    error = e
+                if reconnect == False:
+                    if error != 'stream ended':
+                        print('live stream stopped:', error)
+                    return
+                attempt = 0 if self.stats['ticks'] > ticks else attempt + 1
+                if attempt > max_reconnects:
+                    print('live stream: giving up after', max_reconnects, 'reconnects:', error)
+                    return
+                delay = backoff_delay(attempt)
+                print(f'live stream: {error}, reconnecting in {delay:.1f}s')
+                self.stats['reconnects'] += 1
+                self.on_gap()
+                await asyncio.sleep(delay)
+        finally:
+            await self.flush()
+
+def run_live(curr_list=LIVE_CURRENCIES, granularities=LIVE_GRANULARITIES, replay=False, replay_granularity='M5',
+             date_f=None, date_t=None, speed=0.0, store_path=STORE_PATH, ma_s=10, ma_l=20, strategy_granularities=None):
+    '''
+    run_live runs the LiveService on the pairs of curr_list with the MA cross strategy (ma_s, ma_l) on
+    strategy_granularities (all of them by default). with replay, the stream is the local replay of the stored
+    replay_granularity candles between date_f and date_t at speed x real time (0 for as fast as possible).
+    store_path: where the completed candles are appended, None to not write them.
+    '''
+    ic.LoadInstruments('./data')
+    pairs = ic.pairs_for(curr_list)
+    base_url = None
+    if replay == True:
+        server = start_stream_server(data_path='./data', granularity=replay_granularity, date_f=date_f, date_t=date_t, speed=speed)
+        base_url = server.base_url
+        print(f'replaying {replay_granularity} {date_f} -> {date_t} from {base_url}')
+
+    strategy_granularities = granularities if strategy_granularities is None else strategy_granularities
+    service = LiveService(
+        pairs,
+        granularities,
+        strategy=lambda pair, g: StreamingMACross(ma_s, ma_l) if g in strategy_granularities else None,
+        writer=None if store_path is None else CandleWriter(store_path)
+    )
+    start = time.perf_counter()
+    try:
+        asyncio.run(service.run(PriceStream(base_url=base_url), reconnect=not replay))
+    except KeyboardInterrupt:
+        pass
+    elapsed = time.perf_counter() - start
+    written = 0 if service.writer is None else service.writer.written
+    print(f'*** {len(pairs)} pairs {elapsed:.1f}s: {service.stats}, {written} candles written, {service.get_dropped()} partial dropped, '
+          f'{service.stats["ticks"] / max(elapsed, 1e-9):,.0f} ticks/s')
+    return service
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='live candles, indicators and strategies from the pricing stream')
+    parser.add_argument('--currencies', nargs='+', default=LIVE_CURRENCIES)
+    parser.add_argument('--granularities', nargs='+', default=LIVE_GRANULARITIES)
+    parser.add_argument('--replay', action='store_true', help='stream the stored candles from the local replay server')
+    parser.add_argument('--from', dest='date_f')
+    parser.add_argument('--to', dest='date_t')
+    parser.add_argument('--speed', type=float, default=0.0)
+    parser.add_argument('--store', help=f'candle store the completed candles are appended to, {STORE_PATH} when live')
+    parser.add_argument('--profile', action='store_true', help='print the instrumentation report at the end')
+    args = parser.parse_args()
+
+    store_path = args.store if args.store is not None or args.replay else STORE_PATH
+    run = lambda: run_live(args.currencies, args.granularities, args.replay, date_f=args.date_f, date_t=args.date_t,
+                           speed=args.speed, store_path=store_path)
+    if args.profile:
+        with profile_run('live_stream'):
+            run()
+    else:
+        run()
@@ -0,0 +1,148 @@
+# in this script the higher granularities are derived from the base (M5) candles in the candle store, so the collection
+# only has to download the base granularity. a candle of the higher granularity is the aggregate of the base candles in
+# its bin: the first open, the highest high, the lowest low and the last close of mid, bid and ask, and the sum of volume.
+#
+# the bins are aligned like the broker's candles: on the wall clock of new york with the trading day starting at 17:00
+# (the default alignmentTimezone and dailyAlignment of the candles endpoint). the hourly and shorter bins fall on the utc
+# hours anyway, while the H4 bins start at 17:00, 21:00, 01:00 ... new york time, which is 22:00, 02:00 ... utc in winter
+# and 21:00, 01:00 ... utc in summer. the offset is taken per candle, so the bins follow the daylight saving changes.
+#
+# only complete bins are emitted, a bin whose last base candle is not in yet is left for the next update.
+#
+#   python -m infrastructure.resample EUR_USD H1 H4      # updates H1 and H4 of EUR_USD from its M5 candles
+
+import sys
+import numpy as np
+import pandas as pd
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+from infrastructure.candle_store import STORE_PATH, TIME_COL, to_time_values, from_time_values, read_candles, write_candles, append_candles, last_time
+
+BASE_GRANULARITY = 'M5'
+DERIVED_GRANULARITIES = ['M15', 'H1', 'H4']
+ALIGNMENT_TZ = 'America/New_York'
+DAILY_ALIGNMENT = 17 # the hour the trading day starts in ALIGNMENT_TZ
+ALIGNMENT_ZONE = ZoneInfo(ALIGNMENT_TZ)
+
+MINUTES = {
+    'M1': 1,
+    'M5': 5,
+    'M15': 15,
+    'M30': 30,
+    'H1': 60,
+    'H2': 120,
+    'H4': 240,
+    'H6': 360,
+    'H8': 480,
+    'H12': 720,
+    'D': 1440,
+}
+NS_PER_MINUTE = 60 * 10**9
+AGGREGATES = {
+    'o': 'first',
+    'h': 'max',
+    'l': 'min',
+    'c': 'last',
+}
+
+def bin_starts(times: pd.Series, granularity):
+    '''
+    the start of the bin of granularity every time falls in, as int64 utc nanoseconds.
+    the position of a time in its bin is measured on the new york wall clock from DAILY_ALIGNMENT, and the bin starts
+    that many minutes before the time.
+    '''
+    minutes = MINUTES[granularity]
+    local = times.dt.tz_convert(ALIGNMENT_TZ)
+    wall_minute = local.dt.hour.to_numpy() * 60 + local.dt.minute.to_numpy()
+    offset = (wall_minute - DAILY_ALIGNMENT * 60) % minutes
+    values = to_time_values(times)
+    return values - (values % NS_PER_MINUTE) - offset.astype(np.int64) * NS_PER_MINUTE
+
+def bin_start(value, granularity):
+    '''bin_starts for a single time given as int utc nanoseconds, without pandas, for the live candles'''
+    minutes = MINUTES[granularity]
+    local = dt.datetime.fromtimestamp(value // 10**9, tz=ALIGNMENT_ZONE)
+    offset = (local.hour * 60 + local.minute - DAILY_ALIGNMENT * 60) % minutes
+    return value - (value % NS_PER_MINUTE) - offset * NS_PER_MINUTE
+
+def aggregate_col(col, values, starts, ends):
+    how = AGGREGATES.get(col.split('_')[-1]) if col != 'volume' else 'sum'
+    if how == 'first':
+        return values[starts]
+    if how == 'last':
+        return values[ends - 1]
+    if how == 'max':
+        return np.maximum.reduceat(values, starts)
+    if how == 'min':
+        return np.minimum.reduceat(values, starts)
+    if how == 'sum':
+        return np.add.reduceat(values, starts)
+    raise KeyError(f'no aggregate for the column {col}')
+
+def resample_candles(df: pd.DataFrame, granularity, base_granularity=BASE_GRANULARITY, complete_only=True):
+    '''
+    resample_candles aggregates the base candles of df (sorted on time, with the columns of get_candle_df or a subset of them)
+    into candles of granularity, with the same columns. with complete_only the last bin is dropped unless the base candle
+    closing it is in df.
+    '''
+    if MINUTES[granularity] % MINUTES[base_granularity] != 0 or MINUTES[granularity] <= MINUTES[base_granularity]:
+        raise ValueError(f'{granularity} can not be made from {base_granularity} candles')
+    if df.shape[0] == 0:
+        return df.iloc[0:0].copy()
+
+    keys = bin_starts(df[TIME_COL], granularity)
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    ends = np.append(starts[1:], keys.shape[0])
+
+    out = {TIME_COL: from_time_values(keys[starts])}
+    for col in df.columns:
+        if col != TIME_COL:
+            out[col] = aggregate_col(col, df[col].to_numpy(), starts, ends)
+    df_out = pd.DataFrame(out)
+
+    if complete_only == True:
+        last_close = to_time_values(df[TIME_COL].iloc[-1]) + MINUTES[base_granularity] * NS_PER_MINUTE
+        if last_close < next_bin_start(keys[-1], granularity):
+            df_out = df_out.iloc[:-1]
+    return df_out
+
+def next_bin_start(start, granularity):
+    '''
+    the start of the bin after the one starting at start (int64 utc ns). it is usually granularity later, but around a
+    daylight saving change the bin in new york time can start an hour earlier or later than that.
+    '''
+    nominal = start + MINUTES[granularity] * NS_PER_MINUTE
+    next_start = bin_start(nominal, granularity)
+    return next_start if next_start > start else nominal
+
+def update_resampled(pair, granularity, base_granularity=BASE_GRANULARITY, path=STORE_PATH, rebuild=False):
+    '''
+    update_resampled brings the granularity of the pair in the store up to date with its base candles.
+    only the base candles from the start of the last stored bin are read and aggregated, and the complete bins after
+    the last stored one are appended. with rebuild, or when nothing is stored yet, the whole series is made again.
+    returns the number of candles written.
+    '''
+    last = None if rebuild == True else last_time(pair, granularity, path)
+    df_base = read_candles(pair, base_granularity, date_f=last, path=path)
+    if df_base is None or df_base.shape[0] == 0:
+        return 0
+
+    df = resample_candles(df_base, granularity, base_granularity)
+    if last is None:
+        write_candles(df, pair, granularity, path)
+        return df.shape[0]
+    return append_candles(df, pair, granularity, path)
+
+def update_pair(pair, granularities=DERIVED_GRANULARITIES, base_granularity=BASE_GRANULARITY, path=STORE_PATH, rebuild=False):
+    '''updates every granularity of the pair from its base candles and prints what was written'''
+    for granularity in granularities:
+        written = update_resampled(pair, granularity, base_granularity, path, rebuild)
+        print(f'*** {pair} {granularity} from {base_granularity} --> {written} candles')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('usage: python -m infrastructure.resample PAIR [GRANULARITY ...]')
+        sys.exit(1)
+    update_pair(sys.argv[1], sys.argv[2:] if len(sys.argv) > 2 else DERIVED_GRANULARITIES)
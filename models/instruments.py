@@ -1,7 +1,11 @@
 # with oandaapi class, i can fetch the tradable instruments for the account id housed in instrument key of the object
 # the instrument class here will create an object from the tradable objects returned with only the selected items from objects.
 
+# __slots__ keeps the instruments small (no __dict__ per object) and cheap to pickle when they are sent to worker processes.
+
 class Instrument:
+    __slots__ = ('name', 'ins_type', 'displayName', 'pipLocation', 'tradeUnitsPrecision', 'marginRate', 'base', 'quote')
+
     def __init__(self, name, ins_type, displayName, pipLocation, tradeUnitsPrecision, marginRate):
         self.name = name
         self.ins_type = ins_type
@@ -9,9 +13,16 @@ class Instrument:
         self.pipLocation = pow(10, pipLocation)
         self.tradeUnitsPrecision = tradeUnitsPrecision
         self.marginRate = float(marginRate)
+        self.base, _, self.quote = name.partition('_') # EUR_USD -> EUR and USD
 
     def __repr__(self):
-        return str(vars(self))
+        return str({k: getattr(self, k) for k in self.__slots__})
+
+    def __eq__(self, other):
+        return isinstance(other, Instrument) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    def __hash__(self):
+        return hash(self.name)
     
     #  the following class medthod will instatiate the Instrument objects using the returned objects from the tradable instruments
     #  associated with the account id.
@@ -0,0 +1,39 @@
+import numpy as np
+
+BUY = 1
+SELL = -1
+NONE = 0
+
+def detect_trades(delta):
+    '''
+    detect_trades takes the ma delta (ma_short - ma_long) as an array and returns an array of the same length holding
+    BUY where the delta crosses from negative to zero or above, SELL where it crosses from zero or above to negative and NONE elsewhere.
+
+    it gives the same answer as the row by row check it replaced (see tests/test_crossover.py): the first row has no previous
+    delta and comparisons with NaN are always False, so rows next to a NaN never trade.
+    '''
+    delta = np.asarray(delta, dtype=np.float64)
+    delta_prev = np.empty_like(delta)
+    delta_prev[:1] = np.nan
+    delta_prev[1:] = delta[:-1]
+
+    trades = np.zeros(delta.shape[0], dtype=np.int64)
+    trades[(delta >= 0) & (delta_prev < 0)] = BUY
+    trades[(delta < 0) & (delta_prev >= 0)] = SELL
+    return trades
+
+def crossover_rows(price_data, ma_l, ma_s):
+    '''
+    crossover_rows takes the price dataframe and the names of the long and short ma columns.
+    it detects the crossovers on the numpy arrays of the two columns and only copies the rows where a trade happens,
+    adding the Delta, Delta_Prev and Trades columns to them. the result holds only the trade rows.
+    '''
+    delta = price_data[ma_s].to_numpy(dtype=np.float64) - price_data[ma_l].to_numpy(dtype=np.float64)
+    trades = detect_trades(delta)
+    rows = np.flatnonzero(trades)
+
+    df_analysis = price_data.iloc[rows].copy()
+    df_analysis['Delta'] = delta[rows]
+    df_analysis['Delta_Prev'] = delta[rows - 1] # a trade is never on row 0, so rows - 1 is always valid
+    df_analysis['Trades'] = trades[rows]
+    return df_analysis
@@ -0,0 +1,212 @@
+# in this script the backtest engine is created. unlike the ma cross simulation (assess_grid), which measures the mid_c difference between two signals,
+# the engine fills the trades on the bid/ask columns (buy at the ask, sell at the bid), keeps one position at a time with
+# optional stop loss / take profit and position sizing, and tracks the balance, equity and margin candle by candle.
+#
+# a strategy is any object with a get_signals(candles) method returning an array of BUY / SELL / NONE, one per candle.
+# a signal is acted on at the close of its candle: an opposite position is closed and a new one opened.
+# the engine then walks from signal to signal and finds the stop loss / take profit hits in between with numpy searches,
+# so it does not visit every candle in python.
+#
+# the balance, the profits and the margin are kept in the account currency: the profit of a trade is made in the quote
+# currency of the pair and converted with the rate of the quote currency at the exit candle (see get_home_rate).
+
+import numpy as np
+import pandas as pd
+
+from simulation.crossover import BUY, SELL, NONE
+
+ACCOUNT_CURRENCY = 'USD'
+PRICE_COLS = ['bid_o', 'bid_h', 'bid_l', 'bid_c', 'ask_o', 'ask_h', 'ask_l', 'ask_c']
+
+class CandleArrays:
+    '''the columns of a candle dataframe as float64 numpy arrays, which is all the engine and the strategies work on'''
+    def __init__(self, df: pd.DataFrame):
+        self.time = df['time'].to_numpy()
+        self.n = df.shape[0]
+        for col in PRICE_COLS:
+            setattr(self, col, df[col].to_numpy(dtype=np.float64))
+        if 'mid_c' in df.columns:
+            self.mid_c = df['mid_c'].to_numpy(dtype=np.float64)
+        else:
+            self.mid_c = (self.bid_c + self.ask_c) / 2
+
+    def __repr__(self):
+        return f'CandleArrays(n={self.n})'
+
+class BacktestResult:
+    '''
+    holds the outcome of run_backtest:
+    df_trades: one row per closed trade with its entry/exit, units, pips, profit and the reason it was closed.
+    equity: the balance plus the open profit at the close of every candle.
+    margin: the margin used at the close of every candle.
+    result: the summary dict, in the spirit of MAResult.result.
+    '''
+    def __init__(self, df_trades, equity, margin, pairname, balance, skipped, account=ACCOUNT_CURRENCY):
+        self.df_trades = df_trades
+        self.equity = equity
+        self.margin = margin
+        self.pairname = pairname
+        self.balance = balance
+        self.skipped = skipped
+        self.account = account
+        self.result = self.result_ob()
+
+    def __repr__(self):
+        return str(self.result)
+
+    def result_ob(self):
+        peak = np.maximum.accumulate(self.equity) if self.equity.shape[0] > 0 else self.equity
+        drawdown = (peak - self.equity).max() if self.equity.shape[0] > 0 else 0.0
+        return dict(
+            pair = self.pairname,
+            num_trades = self.df_trades.shape[0],
+            total_pips = round(float(self.df_trades['pips'].sum()), 1),
+            total_pl = round(float(self.df_trades['pl'].sum()), 2),
+            final_equity = round(float(self.equity[-1]), 2) if self.equity.shape[0] > 0 else self.balance,
+            max_drawdown = round(float(drawdown), 2),
+            max_margin = round(float(self.margin.max()), 2) if self.margin.shape[0] > 0 else 0.0,
+            skipped = self.skipped,
+            account = self.account,
+        )
+
+def first_hit(mask):
+    '''position of the first True in mask or -1'''
+    pos = int(np.argmax(mask)) if mask.shape[0] > 0 else 0
+    return pos if mask.shape[0] > 0 and mask[pos] else -1
+
+def find_exit(candles: CandleArrays, direction, start, end, stop, take):
+    '''
+    looks for the first candle in start..end (inclusive) where the stop loss or take profit of the position is hit.
+    a long position exits on the bid and a short one on the ask. the fill is the level, or the open when the price gapped
+    through it. when both levels are inside the same candle the stop loss is assumed to come first.
+    returns (candle, price, reason) or None.
+    '''
+    if end < start or (stop is None and take is None):
+        return None
+    if direction == BUY:
+        low, high, opens = candles.bid_l[start:end + 1], candles.bid_h[start:end + 1], candles.bid_o
+    else:
+        low, high, opens = candles.ask_l[start:end + 1], candles.ask_h[start:end + 1], candles.ask_o
+
+    hit_sl = -1 if stop is None else first_hit(low <= stop if direction == BUY else high >= stop)
+    hit_tp = -1 if take is None else first_hit(high >= take if direction == BUY else low <= take)
+
+    if hit_sl >= 0 and (hit_tp < 0 or hit_sl <= hit_tp):
+        i = start + hit_sl
+        price = min(stop, opens[i]) if direction == BUY else max(stop, opens[i])
+        return i, price, 'sl'
+    if hit_tp >= 0:
+        i = start + hit_tp
+        price = max(take, opens[i]) if direction == BUY else min(take, opens[i])
+        return i, price, 'tp'
+    return None
+
+def get_home_rate(candles: CandleArrays, instrument, account=ACCOUNT_CURRENCY, conversion=None):
+    '''
+    the value of one unit of the quote currency of the instrument in the account currency at the close of every candle:
+    1 when the quote is the account currency (EUR_USD), 1 / price when the base is (USD_JPY). for the other pairs
+    (EUR_GBP, CAD_JPY) it comes from the prices of the pair linking the quote and the account currency, which the
+    caller aligns with the candles and passes as conversion (see load_home_rate in simulation/strategies.py).
+    '''
+    if conversion is not None:
+        return np.asarray(conversion, dtype=np.float64)
+    if instrument.quote == account:
+        return np.ones(candles.n)
+    if instrument.base == account:
+        return 1.0 / candles.mid_c
+    raise ValueError(f'{instrument.name} needs the {instrument.quote}/{account} rate to convert its profits to {account}')
+
+def get_units(balance, units, risk, sl_pips, pip_location, home_rate=1.0):
+    '''
+    fixed units, or with risk (a share of the balance) and a stop loss, the units that lose that share at the stop.
+    home_rate: the value of one unit of the quote currency in the account currency.
+    '''
+    if risk is None or sl_pips is None:
+        return units
+    return int(balance * risk / (sl_pips * pip_location * home_rate))
+
+def run_backtest(candles: CandleArrays, instrument, strategy, units=10000, balance=10000.0, sl_pips=None, tp_pips=None, risk=None,
+                 account=ACCOUNT_CURRENCY, home_rate=None):
+    '''
+    run_backtest runs the strategy over the candles of the instrument:
+    units: the size of every position, unless risk is given.
+    balance: the starting balance in the account currency.
+    sl_pips, tp_pips: optional stop loss and take profit distances in pips from the entry.
+    risk: optional share of the balance lost at the stop loss, used to size the positions when sl_pips is given.
+    account: the account currency the balance, the profits (pl) and the margin are in.
+    home_rate: optional value of one unit of the quote currency in the account currency at every candle, needed when the
+    instrument holds neither the account currency nor is quoted in it, see get_home_rate.
+
+    the margin of a new position is units * price * instrument.marginRate, a position needing more than the balance is skipped.
+    a position still open on the last candle is closed at its close.
+    the trades keep their profit in the quote currency too (pl_quote).
+    '''
+    rate = get_home_rate(candles, instrument, account, home_rate)
+    signals = np.asarray(strategy.get_signals(candles), dtype=np.int64)
+    sig_idx = np.flatnonzero(signals)
+    sig_dir = signals[sig_idx]
+    pip = instrument.pipLocation
+    last = candles.n - 1
+
+    # for every signal, the position of the next signal in the other direction (or len when there is none)
+    run_starts = np.flatnonzero(sig_dir[1:] != sig_dir[:-1]) + 1
+    next_opposite = np.append(run_starts, sig_idx.shape[0])[np.searchsorted(run_starts, np.arange(sig_idx.shape[0]), side='right')]
+
+    trades = []
+    skipped = 0
+    k = 0
+    while k < sig_idx.shape[0]:
+        i, direction = int(sig_idx[k]), int(sig_dir[k])
+        entry = candles.ask_c[i] if direction == BUY else candles.bid_c[i]
+        size = get_units(balance, units, risk, sl_pips, pip, rate[i])
+        # the next opposite signal closes the position, signals in the same direction are ignored while it is open
+        m = int(next_opposite[k]) if next_opposite[k] < sig_idx.shape[0] else None
+        if size <= 0 or size * entry * instrument.marginRate * rate[i] > balance:
+            skipped += 1
+            k = k + 1 if m is None else m
+            continue
+
+        stop = None if sl_pips is None else entry - direction * sl_pips * pip
+        take = None if tp_pips is None else entry + direction * tp_pips * pip
+        close_i = last if m is None else int(sig_idx[m])
+        hit = find_exit(candles, direction, i + 1, close_i, stop, take)
+
+        if hit is not None:
+            exit_i, exit_price, reason = hit
+            # after a stop the next signal of any direction, even one on the exit candle, opens a new position
+            next_k = int(np.searchsorted(sig_idx, exit_i, side='left'))
+        else:
+            exit_i = close_i
+            exit_price = candles.bid_c[exit_i] if direction == BUY else candles.ask_c[exit_i]
+            reason = 'end' if m is None else 'signal'
+            next_k = sig_idx.shape[0] if m is None else m
+
+        pl_quote = (exit_price - entry) * direction * size
+        pl = pl_quote * rate[exit_i]
+        balance += pl
+        trades.append((i, exit_i, direction, entry, exit_price, size, (exit_price - entry) * direction / pip, pl_quote, pl, reason))
+        k = next_k
+
+    df_trades = pd.DataFrame(trades, columns=['entry_i', 'exit_i', 'direction', 'entry', 'exit', 'units', 'pips', 'pl_quote', 'pl', 'reason'])
+    df_trades['entry_time'] = candles.time[df_trades['entry_i'].to_numpy(dtype=np.int64)]
+    df_trades['exit_time'] = candles.time[df_trades['exit_i'].to_numpy(dtype=np.int64)]
+    equity, margin = get_equity(candles, df_trades, balance - df_trades['pl'].sum(), instrument.marginRate, rate)
+    return BacktestResult(df_trades, equity, margin, instrument.name, balance, skipped, account)
+
+def get_equity(candles: CandleArrays, df_trades, start_balance, margin_rate, rate):
+    '''
+    builds the equity and margin of every candle from the trades with numpy: the balance steps up or down on the exit candles
+    and the open profit is marked on the bid (long) or the ask (short) close while a position is open.
+    rate converts the open profit and the margin from the quote currency to the account currency candle by candle.
+    '''
+    realized = np.zeros(candles.n)
+    np.add.at(realized, df_trades['exit_i'].to_numpy(dtype=np.int64), df_trades['pl'].to_numpy())
+    equity = start_balance + np.cumsum(realized)
+    margin = np.zeros(candles.n)
+
+    for t in df_trades.itertuples(index=False):
+        s = slice(t.entry_i, t.exit_i) # the exit candle is already in the balance
+        mark = candles.bid_c[s] if t.direction == BUY else candles.ask_c[s]
+        equity[s] += (mark - t.entry) * t.direction * t.units * rate[s]
+        margin[s] = t.units * candles.mid_c[s] * margin_rate * rate[s]
+    return equity, margin
@@ -1,7 +1,12 @@
 import pandas as pd
-import os.path
-from simulation.ma_excel import create_ma_res
+from concurrent.futures import ProcessPoolExecutor
+from simulation.ma_excel import create_ma_res, create_ma_reports
+from simulation.results_store import new_run_id, write_results
+from simulation.ma_grid import get_crosses, grid_trades
 from infrastructure.instrument_collection import instrumentCollection as ic
+from infrastructure.candle_store import load_candles, stored_bytes
+from infrastructure.feature_cache import moving_average
+from infrastructure.instrumentation import instrumentation, instrumented, worker_init, call_with_stats, df_rows
 
 class MAResult:
     '''
@@ -35,177 +40,184 @@ class MAResult:
         )
         
 
-BUY = 1
-SELL = -1
-NONE = 0
-
 get_ma_col = lambda x: f'MA_{x}'
-add_cross = lambda x: f'{x.ma_s}_{x.ma_l}'
+# the ma cross simulation only needs these columns of the candles, the rest is not loaded from the candle store
+SIM_COLS = ['time', 'mid_c']
 
-def load_price_data(pair, granularity, ma_list):
+@instrumented('load_price_data', rows=lambda df, *args, **kwargs: df_rows(df),
+              bytes_read=lambda df, pair, granularity, ma_list, columns=None: stored_bytes(pair, granularity, columns))
+def load_price_data(pair, granularity, ma_list, columns=None):
     '''
     load_price_data take a pair, a list of granularity and a list of moving average.
     the elements of the lists are used to form moving average columns in the dataset.
+    columns is an optional list of the candle columns to load, all of them are loaded when it is None.
     '''
-    df = pd.read_pickle(f'./data/{pair}_{granularity}.pkl')
+    df = load_candles(pair, granularity, columns=columns)
     for ma in ma_list:
-        df[get_ma_col(ma)] = df.mid_c.rolling(window=ma).mean()
+        df[get_ma_col(ma)] = moving_average(df, pair, granularity, ma) # cached per pair, granularity and candle file
     df.dropna(inplace=True)
     df.reset_index(drop=True, inplace=True)
     return df
 
-def is_trade(df):
-    # detects the trades when there is a crossover
-    if df['Delta'] >= 0 and df['Delta_Prev'] < 0:
-        return BUY
-    elif df['Delta'] < 0 and df['Delta_Prev'] >= 0:
-        return SELL
-    return NONE
-
-def get_trades(df_analysis, instrument, granularity):
-    '''get_tarde uses the instrument.pipLocation to calculate the pips lost or gained by the ma crossover'''
-    df_trades = df_analysis[df_analysis['Trades']!=NONE].copy()
-    df_trades['Diff'] = df_trades['mid_c'].diff().shift(-1)
-    df_trades.fillna(0, inplace=True)
-    df_trades['Gain'] = df_trades['Diff'] / instrument.pipLocation
-    df_trades['Gain'] = df_trades['Gain'] * df_trades['Trades']
-    df_trades['Granularity'] = granularity
-    df_trades['Pair'] = instrument.name
-    df_trades['Gain_C'] = df_trades['Gain'].cumsum()
-    return df_trades
-
-def assess_pair(price_data, ma_l, ma_s, instrument, granularity):
-    '''assess_pair takes a dataframe, an ma_long, ma_short, the instrument and the granularity. It uses the ma values to setup the ma-cross over 
-    principle and then detects trades using the said ma values.
-
-    To further prepare the dataset, assess_pair uses get_trade to the ma_cross over trades using the provided ma values
-
-    The resulting dataframe is used to return a MAResult object.
+@instrumented('assess_grid', rows=lambda result, price_data, crosses, *args, **kwargs: price_data.shape[0] * len(crosses))
+def assess_grid(price_data, crosses, instrument, granularity):
+    '''assess_grid takes a dataframe, a list of (ma_l, ma_s) crosses, the instrument and the granularity.
+    the ma columns are taken once as a candles x windows matrix and grid_trades evaluates all the crosses in a batched pass.
+
+    only the trade rows of each cross are taken from the dataframe, so the whole frame is not copied for every cross.
+    the df_trades of every cross holds the Delta, Trades, Diff, Gain and Gain_C of its trades and is used to return a MAResult.
     '''
-    df_analysis = price_data.copy()
-    df_analysis['Delta'] = df_analysis[ma_s] - df_analysis[ma_l]
-    df_analysis['Delta_Prev'] = df_analysis['Delta'].shift(1)
-    df_analysis['Trades'] = df_analysis.apply(is_trade, axis=1)
-    df_trade = get_trades(df_analysis, instrument, granularity)
-    df_trade['ma_l'] = ma_l
-    df_trade['ma_s'] = ma_s
-    df_trade['Cross'] = df_trade.apply(add_cross, axis=1)
-    return MAResult(
-        df_trade,
-        instrument.name,
-        ma_l,
-        ma_s,
-        granularity
+    windows = sorted(set([ma for cross in crosses for ma in cross]))
+    col_idx = {ma: i for i, ma in enumerate(windows)}
+    ma_matrix = price_data[[get_ma_col(ma) for ma in windows]].to_numpy(dtype='float64')
+
+    cross_trades = grid_trades(
+        ma_matrix,
+        price_data['mid_c'].to_numpy(),
+        instrument.pipLocation,
+        [(col_idx[ma_l], col_idx[ma_s]) for ma_l, ma_s in crosses]
     )
+
+    result_list = []
+    for (ma_l, ma_s), ct in zip(crosses, cross_trades):
+        df_trade = price_data.iloc[ct.rows].copy()
+        df_trade['Delta'] = ct.delta
+        df_trade['Delta_Prev'] = ct.delta_prev
+        df_trade['Trades'] = ct.trades
+        df_trade['Diff'] = ct.diff
+        df_trade['Gain'] = ct.gain
+        df_trade['Granularity'] = granularity
+        df_trade['Pair'] = instrument.name
+        df_trade['Gain_C'] = df_trade['Gain'].cumsum()
+        df_trade['ma_l'] = get_ma_col(ma_l)
+        df_trade['ma_s'] = get_ma_col(ma_s)
+        df_trade['Cross'] = f'{get_ma_col(ma_s)}_{get_ma_col(ma_l)}'
+        result_list.append(MAResult(
+            df_trade,
+            instrument.name,
+            get_ma_col(ma_l),
+            get_ma_col(ma_s),
+            granularity
+        ))
+    return result_list
+
 # analyse _pair is the function that will be fed into run_ma_sim. the function will take an instrument, the granukarity in or oder to read the 
 # dataset that corresponds to the pair and granularity. It takes the lists of the ma_long and ma_short and combine them.
 
-def append_df_to_file(df, filename):
-    '''                                                                                                                                                                                                                                                                                                                                                                                         
-    append_df_to_file takes a dataframe and its name and checks if the file is already in the path.
-    if it is, the existing file and the new dataframe are concatinated. if it is not there, the dataset is created using the dataframe.
-    '''
-    if os.path.isfile(filename):
-        fd = pd.read_pickle(filename)
-        df = pd.concat([fd, df])
-    df.reset_index(inplace=True, drop=True)
-    df.to_pickle(filename)
-    print(filename, df.shape)
-    print(df.tail(2))
-
-def get_fullname(filepath, filename):
-    '''get_fullname provides full path where we want to save the dataset and the anme of the dataset'''
-    return f'{filepath}/{filename}.pkl'
-
-def process_macro(result_list, filename):
-    '''process_trades uses the result attribute of the MAResult class to access the result dict of the pairs and 
-        creates a list of them with is used to create a dataframe which is saved using append_df_to_file to save the resulting dataset
+def process_macro(result_list, filepath, run_id):
+    '''process_macro uses the result attribute of the MAResult class to access the result dict of the pairs and
+        creates a list of them with is used to create a dataframe which is added to the ma_res results store
     '''
     rl = [x.result for x in result_list]
     df = pd.DataFrame.from_dict(rl)
-    append_df_to_file(df, filename)
+    write_results(df, 'ma_res', filepath, run_id, 'pair', 'granularity')
 
-def process_trades(result_list, filename):
-    '''process_trades uses the df_trades attribute of the MAResult class to access the trade datafram of the pairs and concatinates 
-        and uses append_df_to_file to save the resulting dataset
+def process_trades(result_list, filepath, run_id):
+    '''process_trades uses the df_trades attribute of the MAResult class to access the trade datafram of the pairs and concatinates
+        them to add them to the ma_trades results store
     '''
     df = pd.concat([x.df_trades for x in result_list])
-    append_df_to_file(df, filename)
+    write_results(df, 'ma_trades', filepath, run_id, 'Pair', 'Granularity')
 
-def process_results(result_list, filepath):
-    '''process_result uses two functions namely: 
-    process_macro and process_trades to save the data from the MAResult class and trade datasets from get_trades respectively.
+def process_results(result_list, filepath, run_id=None):
+    '''process_result uses two functions namely:
+    process_macro and process_trades to save the data from the MAResult class and trade datasets from assess_grid respectively.
+    the results are appended to the results stores under the run_id (a new one when None), the existing results are not
+    read or rewritten, so the cost only depends on the new rows. returns the run_id.
     '''
-    process_macro(result_list, get_fullname(filepath, 'ma_res'))
-    process_trades(result_list, get_fullname(filepath, 'ma_trades'))
-    # rl = [x.result for x in result_list]
-    # df = pd.DataFrame.from_dict(rl)
-    # print(df)
-    # print(result_list[0].df_trades.head(2))
-
-def analyse_pair(instrument, granularity, ma_long, ma_short, filepath):
+    run_id = new_run_id() if run_id is None else run_id
+    process_macro(result_list, filepath, run_id)
+    process_trades(result_list, filepath, run_id)
+    return run_id
+
+def evaluate_pair(instrument, granularity, ma_long, ma_short):
+    '''evaluate_pair loads the price data of the instrument for the granularity with all the ma columns and uses assess_grid
+    to evaluate every (ma_l, ma_s) where ma_l is longer than ma_s. it returns the list of MAResult without saving anything,
+    so it can run in a worker process and hand its results back to the parent.
+    '''
+    ma_list = set(ma_long + ma_short)
+    pair = instrument.name
+
+    #the ma_list is fed into load_price_data where the dataset is finally read in having the columns of all the MAs
+    price_data = load_price_data(pair, granularity, ma_list, columns=SIM_COLS)
+
+    # every (ma_l, ma_s) where ma_l is longer than ma_s is evaluated in one pass of the grid engine
+    return assess_grid(price_data, get_crosses(ma_long, ma_short), instrument, granularity)
+
+def analyse_pair(instrument, granularity, ma_long, ma_short, filepath, run_id=None):
     '''analyze_pair takes five arguments :
     instrument: a tradable instrument.
     granularity: the granlarity of the pair.
     ma_long: list of the long moving average.
     ma_short: list of short moving avaerage,
     filepath: path to the data folder.
+    run_id: the run the results are saved under.
 
-    analyse_pair makes a set of ma_long and ma_short and makes a list it. it then loads the pair corresponding to the provided granularity
-    using load_price_data.
-
-    analyse_pair iterates through all the values of the MAs and checks to filter out cases where ma_long is shorter than ma_short to exclude them
-    and only makes use of the cases where ma_long is actually longer than ma_long.
-
-    it thn uses assess_pair to analyse the pair and the result is appened in result_list.
+    analyse_pair uses evaluate_pair to load the pair corresponding to the provided granularity and to analyse all the crosses
+    where ma_long is actually longer than ma_short in one batched pass.
 
     process_results is used to save the result of the analysis
     '''
-    ma_list = set(ma_long + ma_short)
-    pair = instrument.name
+    result_list = evaluate_pair(instrument, granularity, ma_long, ma_short)
+    for ma_result in result_list:
+        print(ma_result)
 
-    #the ma_list is fed into load_price_data where the dataset is finally read in having the columns of all the MAs
-    price_data = load_price_data(pair, granularity, ma_list)
-    
-    #
-    result_list = []
-    for ma_l in ma_long:
-        for ma_s in ma_list:
-            if ma_l <= ma_s:
-                continue
-            ma_result = assess_pair(
-                price_data,
-                get_ma_col(ma_l),
-                get_ma_col(ma_s),
-                instrument,
-                granularity
-            )
-            print(ma_result)
-            result_list.append(ma_result)
-
-    process_results(result_list, filepath)
+    process_results(result_list, filepath, run_id)
+
+def get_sim_pairs(curr_list):
+    '''the pairs made of the currencies of curr_list that are in our tradable instruments, from the index of the collection'''
+    return ic.pairs_for(curr_list)
 
+def run_parallel_sim(pairs, granularity, ma_long, ma_short, filepath, workers, run_id=None):
+    '''run_parallel_sim shards the simulation by (pair, granularity) over a pool of worker processes.
+    every worker loads its own price file and returns its MAResult list. the parent waits for all of them in submission order,
+    so the output is the same as a serial run, and then writes all the results with a single process_results.
+    '''
+    # with the instrumentation enabled, the workers are instrumented too and send their stats back with the results
+    with ProcessPoolExecutor(max_workers=workers, initializer=worker_init, initargs=(instrumentation.enabled,)) as executor:
+        futures = [
+            executor.submit(call_with_stats, evaluate_pair, ic.instruments_dict[pair], g, ma_long, ma_short)
+            for g in granularity
+            for pair in pairs
+        ]
+        result_list = []
+        for future in futures:
+            results, stats = future.result()
+            instrumentation.merge(stats)
+            result_list += results
+
+    for ma_result in result_list:
+        print(ma_result)
+    if len(result_list) > 0:
+        process_results(result_list, filepath, run_id)
 
 def run_ma_sim(
         curr_list=['CAD', 'JPY', 'NZD', 'GBP'],# curr_list is a list of all our tradable in currencies. In the function, there shall be a combination using the list to generate all our tradable instruments
         granularity=['H1'],# granularityt is the list of granularities of the dataset.
         ma_long=[20,40],# ma_long is the list of the longer ma values to be considered.
         ma_short=[10],#ma_short is the list of shorter ma values to be considered.
-        filepath='./data'
+        filepath='./data',
+        workers=None# number of worker processes. None or 1 runs everything serially in this process.
 ):
-    '''run_ma_sim takes five arguments, is the most basic funtion that impliments the ma strategy.
+    '''run_ma_sim takes six arguments, is the most basic funtion that impliments the ma strategy.
      curr_list: is the list of all the tradable instruments in our account.
      granuarity: is the list of granuarities of the different datasets of our tradable instruments.
      ma_long: list of our desired long moving averages.
      ma_short: list of our dersired short moving average
      filepath: path to our dataset.
+     workers: when more than 1, the (pair, granularity) jobs are run on a process pool with run_parallel_sim.
     '''
     ic.LoadInstruments('./data') #load up the instruments
+    pairs = get_sim_pairs(curr_list)
+    run_id = new_run_id() # every result of this simulation is saved under the same run, which is what the reports show
+
+    if workers is not None and workers > 1:
+        run_parallel_sim(pairs, granularity, ma_long, ma_short, filepath, workers, run_id)
+        create_ma_reports(granularity, run_id, filepath, workers) # the workbooks of the granularities are written in parallel too
+        return
+
     for g in granularity:#iterate over the granularity to exhauste the different dataset of each pair
-        for p1 in curr_list:
-            for p2 in curr_list:
-                pair = f'{p1}_{p2}'# combine the different currency pair to make a pair
-                if pair in ic.instruments_dict.keys(): # check if the pair is in our tradable instruments
-                    # if the pair is in our tradable instrument, we use analyse_pair to analyse the dataset corresponding to the pair
-                    analyse_pair(ic.instruments_dict[pair], g, ma_long, ma_short, filepath)
-        create_ma_res(g)
\ No newline at end of file
+        for pair in pairs:
+            # we use analyse_pair to analyse the dataset corresponding to the pair
+            analyse_pair(ic.instruments_dict[pair], g, ma_long, ma_short, filepath, run_id)
+        create_ma_res(g, run_id, filepath)
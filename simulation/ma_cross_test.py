@@ -1,29 +1,20 @@
 import pandas as pd
 from infrastructure.instrument_collection import instrumentCollection as ic
-
-BUY = 1
-SELL = -1
-NONE = 0
+from infrastructure.candle_store import load_candles
+from infrastructure.feature_cache import moving_average
+from simulation.crossover import NONE, crossover_rows
 
 get_ma_col = lambda x: f'MA_{x}'
 
-def load_price_data(pair, granularity, ma_list):
+def load_price_data(pair, granularity, ma_list, columns=None):
     # this function loads the dataset and creates ma columns from the ma_list given to it
-    df = pd.read_pickle(f'./data/{pair}_{granularity}.pkl')
+    df = load_candles(pair, granularity, columns=columns)
     for ma in ma_list:
-        df[get_ma_col(ma)] = df.mid_c.rolling(window=ma).mean()
+        df[get_ma_col(ma)] = moving_average(df, pair, granularity, ma) # cached per pair, granularity and candle file
     df.dropna(inplace=True)
     df.reset_index(drop=True, inplace=True)
     return df
 
-def is_trade(df):
-    # detects the trades when there is a crossover
-    if df['Delta'] >= 0 and df['Delta_Prev'] < 0:
-        return BUY
-    elif df['Delta'] < 0 and df['Delta_Prev'] >= 0:
-        return SELL
-    return NONE
-
 def get_trades(df_analysis, instrument):
     # get_tarde uses the instrument.pipLocation to calculate the pips lost or gained by the ma crossover
     df_trades = df_analysis[df_analysis['Trades']!=NONE].copy()
@@ -37,10 +28,7 @@ def get_trades(df_analysis, instrument):
 def assess_pair(price_data, ma_l, ma_s, instrument):
     #assess_pair performs relevant data prepatations in order to assess the performance of the startegy
     #it uses the get_trade to complete this task
-    df_analysis = price_data.copy()
-    df_analysis['Delta'] = df_analysis[ma_s] - df_analysis[ma_l]
-    df_analysis['Delta_Prev'] = df_analysis['Delta'].shift(1)
-    df_analysis['Trades'] = df_analysis.apply(is_trade, axis=1)
+    df_analysis = crossover_rows(price_data, ma_l, ma_s)
     # print(ma_l,ma_s)
     # print(df_analysis.head(3))
     return get_trades(df_analysis, instrument)
@@ -1,12 +1,25 @@
+import numpy as np
 import pandas as pd
+import xlsxwriter
+from concurrent.futures import ProcessPoolExecutor
+from simulation.results_store import read_results
+from infrastructure.instrumentation import instrumentation, instrumented, worker_init, call_with_stats, file_size
+
+# the workbook is written with xlsxwriter directly in constant_memory mode: every row is flushed to disk as soon as the
+# next one starts, so a sheet is written top to bottom in one pass, with the ma_res rows of the pair in columns A:J and the
+# Time / Gain_C of its best cross in columns L:M, next to each other on the same rows.
 
 WIDTHS = {
     'L:L': 20,
     'B:F' : 9
 }
 
-def set_widths(pair, writer):
-    worksheet = writer.sheets[pair]
+HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'} # the header style of pandas to_excel
+DATE_FORMAT = 'yyyy-mm-dd hh:mm:ss'
+TIME_COL = 11
+EXCEL_EPOCH = pd.Timestamp('1899-12-30').value
+
+def set_widths(worksheet):
     for k,v in WIDTHS.items():
         worksheet.set_column(k,v)
 
@@ -21,62 +34,128 @@ def get_line_chart(book, start_row, end_row, labels_col, data_col, title, sheetn
     chart.set_legend({'none' : True})
     return chart
 
-def add_chart(pair, cross, df, writer):
-    workbook = writer.book
-    worksheet = writer.sheets[pair]
-
-    chart = get_line_chart(workbook, 1, df.shape[0], 11, 12, f'Gain_C for {pair} {cross}', pair)
+def add_chart(workbook, worksheet, pair, cross, num_rows):
+    chart = get_line_chart(workbook, 1, num_rows, TIME_COL, TIME_COL + 1, f'Gain_C for {pair} {cross}', pair)
     chart.set_size({'x_scale' : 2.5, 'y_scale' : 2.5})
     worksheet.insert_chart('O1', chart)
 
-def add_pair_charts(df_ma_res, df_ma_trades, writer):
-    cols = ['Time', 'Gain_C']
-    df_temp = df_ma_res.drop_duplicates(subset='pair')
-
-    for _, row in df_temp.iterrows():
-        dft = df_ma_trades[(df_ma_trades['Cross'] == row['cross']) & (df_ma_trades['Pair'] == row['pair'])]
-        dft[cols].to_excel(writer, sheet_name=row['pair'], index=False, startrow=0, startcol=11)
-        set_widths(row['pair'], writer)
-        add_chart(row['pair'], row['cross'], dft, writer)
-
-
-def add_pair(df_ma_res, writer):
-    for pair in df_ma_res['pair'].unique():
-        tdf = df_ma_res[df_ma_res['pair'] == pair]
-        tdf.to_excel(writer, sheet_name=pair, index=False)
-
-def prepare_data(df_ma_res, df_ma_trades):
-    df_ma_res.sort_values(by=['pair', 'total_gain'], ascending=[True, False], inplace=True)
-    df_ma_trades['Time'] = [x.replace(tzinfo=None) for x in df_ma_trades['time']]
-
-def process_data(df_ma_res, df_ma_trades, writer):
-    prepare_data(df_ma_res, df_ma_trades)
-    add_pair(df_ma_res, writer)
-    add_pair_charts(df_ma_res, df_ma_trades, writer)
-    
-
-def create_excel(df_ma_res, df_ma_trades, granularity):
-    filename = f'ma_sim_{granularity}.xlsx'
-    writer =  pd.ExcelWriter(filename, engine='xlsxwriter')
+def to_excel_dates(times: pd.Series):
+    '''the times as excel serial dates (days since 1899-12-30), the timezone is dropped keeping the wall time. NaT gives NaN'''
+    if times.dt.tz is not None:
+        times = times.dt.tz_localize(None)
+    values = times.astype('datetime64[ns]')
+    days = (values.to_numpy().view(np.int64) - EXCEL_EPOCH) / 86400e9
+    return np.where(values.isna().to_numpy(), np.nan, days)
+
+def write_value(worksheet, row, col, value):
+    if isinstance(value, float) and value != value: # NaN is left empty like to_excel does
+        return
+    worksheet.write(row, col, value)
+
+def write_pair_sheet(workbook, pair, res_columns, res_rows, cross, times, gains, formats):
+    '''
+    writes the sheet of the pair row by row: the header row, then the ma_res rows (res_rows, lists of values)
+    in columns A:J and the times / gains of the best cross in columns L:M. the chart of the gains is added at O1.
+    '''
+    worksheet = workbook.add_worksheet(pair)
+    set_widths(worksheet)
+
+    worksheet.write_row(0, 0, res_columns, formats['header'])
+    worksheet.write_string(0, TIME_COL, 'Time', formats['header'])
+    worksheet.write_string(0, TIME_COL + 1, 'Gain_C', formats['header'])
+
+    for i in range(max(len(res_rows), len(times))):
+        if i < len(res_rows):
+            for col, value in enumerate(res_rows[i]):
+                write_value(worksheet, i + 1, col, value)
+        if i < len(times):
+            if times[i] == times[i]:
+                worksheet.write_number(i + 1, TIME_COL, times[i], formats['date'])
+            write_value(worksheet, i + 1, TIME_COL + 1, gains[i])
+
+    add_chart(workbook, worksheet, pair, cross, len(times))
+
+def process_data(df_ma_res, df_ma_trades, workbook):
+    '''
+    the ma_res rows are sorted by pair and total_gain, so the first row of a pair is its best cross, the one that is charted.
+    the rows of every pair and of every (pair, cross) are found with a single groupby each instead of a mask per pair.
+    '''
+    df_ma_res = df_ma_res.sort_values(by=['pair', 'total_gain'], ascending=[True, False])
+    formats = {
+        'header': workbook.add_format(HEADER_FORMAT),
+        'date': workbook.add_format({'num_format': DATE_FORMAT}),
+    }
+
+    res_columns = [str(c) for c in df_ma_res.columns]
+    res_values = df_ma_res.astype(object).to_numpy().tolist()
+    res_groups = df_ma_res.reset_index(drop=True).groupby('pair', sort=True).indices
+
+    trade_groups = df_ma_trades.groupby(['Pair', 'Cross'], sort=False).indices
+    times = to_excel_dates(df_ma_trades['time'])
+    gains = df_ma_trades['Gain_C'].to_numpy()
+    empty = np.array([], dtype=np.int64)
+
+    for pair, res_idx in res_groups.items():
+        cross = res_values[res_idx[0]][res_columns.index('cross')]
+        trade_idx = trade_groups.get((pair, cross), empty)
+        write_pair_sheet(
+            workbook, pair, res_columns,
+            [res_values[i] for i in res_idx],
+            cross,
+            times[trade_idx].tolist(),
+            gains[trade_idx].tolist(),
+            formats
+        )
+
+# the columns of the ma_trades results the report reads
+TRADE_COLUMNS = {'time': 'datetime64[ns, UTC]', 'Pair': object, 'Cross': object, 'Granularity': object, 'Gain_C': 'float64'}
+
+def get_report_rows(filename, df_ma_res, df_ma_trades, granularity, *args, **kwargs):
+    return int((df_ma_trades['Granularity'] == granularity).sum())
+
+@instrumented('create_excel', rows=get_report_rows, bytes_written=lambda filename, *args, **kwargs: file_size(filename))
+def create_excel(df_ma_res, df_ma_trades, granularity, filename=None):
+    filename = f'ma_sim_{granularity}.xlsx' if filename is None else filename
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
 
     process_data(
-        df_ma_res[df_ma_res['granularity'] == granularity].copy(),
-        df_ma_trades[df_ma_trades['Granularity'] == granularity].copy(),
-        writer
+        df_ma_res[df_ma_res['granularity'] == granularity],
+        df_ma_trades[df_ma_trades['Granularity'] == granularity],
+        workbook
     )
 
-    writer.close()
-
-def create_ma_res(granularity):
-    df_ma_res = pd.read_pickle('./data/ma_res.pkl')
-    df_ma_trades = pd.read_pickle('./data/ma_trades.pkl')
-    create_excel(df_ma_res, df_ma_trades, granularity)
+    workbook.close()
+    return filename
+
+def create_ma_res(granularity, run_id=None, filepath='./data'):
+    '''creates the report of the granularity from the results of the run, or from all the results (with the ones saved
+    before the results store) when run_id is None. only the parts of the granularity are read.
+    when there are no results for the granularity no report is written and None is returned.'''
+    include_legacy = run_id is None
+    df_ma_res = read_results('ma_res', filepath, run_id=run_id, granularity=granularity, include_legacy=include_legacy)
+    if df_ma_res.empty == True:
+        print(f'no ma_res results for {granularity} (run {run_id}) in {filepath}, no report written')
+        return None
+    df_ma_trades = read_results('ma_trades', filepath, run_id=run_id, granularity=granularity, include_legacy=include_legacy)
+    if df_ma_trades.empty == True: # the crosses made no trades, the sheets only get their ma_res rows
+        df_ma_trades = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in TRADE_COLUMNS.items()})
+    return create_excel(df_ma_res, df_ma_trades, granularity)
+
+def create_ma_reports(granularity, run_id=None, filepath='./data', workers=None):
+    '''creates the report of every granularity in the list, on a process pool (one workbook per worker) when workers > 1'''
+    if workers is None or workers <= 1 or len(granularity) <= 1:
+        return [create_ma_res(g, run_id, filepath) for g in granularity]
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(granularity)), initializer=worker_init, initargs=(instrumentation.enabled,)) as executor:
+        futures = [executor.submit(call_with_stats, create_ma_res, g, run_id, filepath) for g in granularity]
+        filenames = []
+        for future in futures:
+            filename, stats = future.result()
+            instrumentation.merge(stats)
+            filenames.append(filename)
+        return filenames
 
 
 if __name__ == '__main__':
 
-    df_ma_res = pd.read_pickle('../data/ma_res.pkl')
-    df_ma_trades = pd.read_pickle('../data/ma_trades.pkl')
-
-    create_excel(df_ma_res, df_ma_trades, 'H1')
-    create_excel(df_ma_res, df_ma_trades, 'H4')
+    create_ma_reports(['H1', 'H4'], filepath='../data', workers=2)
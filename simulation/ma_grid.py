@@ -0,0 +1,88 @@
+import numpy as np
+
+# the number of cells (candles x crosses) evaluated at once. the delta matrix of one batch is about 8 bytes per cell
+BATCH_CELLS = 4_000_000
+
+class CrossTrades:
+    '''
+    holds the trades of one (long, short) cross found by grid_trades as plain numpy arrays:
+    rows: the row positions of the trades in the price data.
+    trades: BUY or SELL for each trade.
+    delta, delta_prev: the ma delta on the trade candle and the candle before it.
+    diff: the mid_c difference to the next trade (0 for the last one).
+    gain: diff in pips multiplied by the trade direction.
+    '''
+    def __init__(self, rows, trades, delta, delta_prev, diff, gain):
+        self.rows = rows
+        self.trades = trades
+        self.delta = delta
+        self.delta_prev = delta_prev
+        self.diff = diff
+        self.gain = gain
+
+    def __repr__(self):
+        return f'CrossTrades(num_trades={self.rows.shape[0]}, total_gain={self.gain.sum()})'
+
+def get_crosses(ma_long, ma_short):
+    '''get_crosses lists the valid (ma_l, ma_s) combinations in the same order analyse_pair has always used'''
+    ma_list = set(ma_long + ma_short)
+    return [(ma_l, ma_s) for ma_l in ma_long for ma_s in ma_list if ma_l > ma_s]
+
+def get_batches(n_candles, n_crosses):
+    '''splits the crosses in batches so that one batch never holds more than BATCH_CELLS delta values'''
+    size = max(1, BATCH_CELLS // max(n_candles, 1))
+    return [(start, min(start + size, n_crosses)) for start in range(0, n_crosses, size)]
+
+def grid_trades(ma_matrix, close, pip_location, crosses):
+    '''
+    grid_trades evaluates every cross in one batched pass instead of one cross at a time.
+    ma_matrix: 2-D array of candles x ma windows.
+    close: the mid_c prices of the candles.
+    pip_location: the instrument pipLocation.
+    crosses: list of (long column, short column) index pairs into ma_matrix.
+
+    the deltas of a whole batch of crosses are computed as one matrix, the crossovers are found with the same rules as detect_trades
+    and the gains are computed for all the trades of the batch at once. a list of CrossTrades is returned in the order of crosses.
+    '''
+    ma_matrix = np.asarray(ma_matrix, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    results = []
+
+    for start, end in get_batches(ma_matrix.shape[0], len(crosses)):
+        batch = crosses[start:end]
+        long_idx = np.array([c[0] for c in batch])
+        short_idx = np.array([c[1] for c in batch])
+
+        # crosses are in the rows of the transposed matrix so np.nonzero returns the trades grouped by cross and sorted by time
+        delta = (ma_matrix[:, short_idx] - ma_matrix[:, long_idx]).T.copy()
+        buy = (delta[:, 1:] >= 0) & (delta[:, :-1] < 0)
+        sell = (delta[:, 1:] < 0) & (delta[:, :-1] >= 0)
+        signal = buy.astype(np.int64) - sell.astype(np.int64)
+
+        cross_pos, prev_rows = np.nonzero(signal)
+        rows = prev_rows + 1
+        trades = signal[cross_pos, prev_rows]
+        prices = close[rows]
+
+        # the diff of a trade is the price of the next trade of the same cross, the last trade of each cross gets 0
+        diff = np.zeros(rows.shape[0])
+        diff[:-1] = prices[1:] - prices[:-1]
+        last = np.ones(rows.shape[0], dtype=bool)
+        last[:-1] = cross_pos[1:] != cross_pos[:-1]
+        diff[last] = 0.0
+        gain = diff / pip_location
+        gain = gain * trades
+
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(cross_pos, minlength=len(batch)))))
+        for i in range(len(batch)):
+            s = slice(bounds[i], bounds[i + 1])
+            results.append(CrossTrades(
+                rows[s],
+                trades[s],
+                delta[i, rows[s]],
+                delta[i, prev_rows[s]],
+                diff[s],
+                gain[s]
+            ))
+
+    return results
@@ -0,0 +1,49 @@
+# in this script the candlestick patterns of technicals/patterns.py are counted over the stored candles of many pairs:
+#
+#   scan_patterns()                                   # every pair of SCAN_CURRENCIES on H4
+#   scan_patterns(granularities=['H1', 'H4'], workers=4)
+#
+# a pair and granularity with no stored candles is skipped (and printed), so a scan over granularities that were only
+# collected for some pairs still runs.
+
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from technicals.patterns import DIRECTIONAL_PATTERNS, OHLC_COLUMNS, pattern_signals
+from infrastructure.candle_store import has_data, load_candles
+from infrastructure.instrument_collection import instrumentCollection as ic
+
+SCAN_CURRENCIES = ['AUD', 'CAD', 'EUR', 'GBP', 'JPY', 'NZD', 'USD']
+SCAN_GRANULARITIES = ['H4'] # the granularity stored for every pair, M5 / M15 / H1 only when they were collected
+
+def count_patterns(pair, granularity, data_path='./data'):
+    '''the number of candles and of bullish / bearish signals of every pattern for the pair and granularity'''
+    df = load_candles(pair, granularity, columns=OHLC_COLUMNS, data_path=data_path)
+    counts = dict(pair=pair, granularity=granularity, candles=df.shape[0])
+    for name, signal in pattern_signals(df, as_frame=False).items():
+        counts[name] = int(np.count_nonzero(signal == 1))
+        if name in DIRECTIONAL_PATTERNS:
+            counts[f'{name}_BEAR'] = int(np.count_nonzero(signal == -1))
+    return counts
+
+def scan_patterns(curr_list=SCAN_CURRENCIES, granularities=SCAN_GRANULARITIES, data_path='./data', workers=None):
+    '''
+    scan_patterns counts the patterns of every pair of curr_list and granularity that has stored candles, on a pool of
+    worker processes when workers > 1. returns a dataframe with one row per pair and granularity.
+    '''
+    ic.LoadInstruments(data_path)
+    jobs = []
+    for g in granularities:
+        for pair in ic.pairs_for(curr_list):
+            if has_data(pair, g, data_path):
+                jobs.append((pair, g))
+            else:
+                print(f'{pair} {g} --> no candles in {data_path}, skipped')
+    if workers is not None and workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(count_patterns, pair, g, data_path) for pair, g in jobs]
+            rows = [f.result() for f in futures]
+    else:
+        rows = [count_patterns(pair, g, data_path) for pair, g in jobs]
+    return pd.DataFrame(rows)
@@ -0,0 +1,230 @@
+# in this script the replay engine is created. it runs the live loop of infrastructure/live_stream.py (LiveService: the
+# streaming indicators and the strategies) against the stored history instead of the price stream, at real speed
+# (speed=1), N times faster (speed=N) or as fast as possible (speed=0), to soak test the bot and to size the hardware.
+#
+# the candles of every pair are read from the store a month at a time, and the pairs are merged in time order with a
+# heap (heapq.merge), so the memory stays bounded whatever the number of pairs and years. with source='candles' every
+# stored candle is handed to LiveService.on_candle when it closes, with source='ticks' the candles are turned into ticks
+# (like the replay server of api/stream_server.py does) and go through on_tick and the candle builders, like the live feed.
+#
+#   python -m simulation.replay --from 2023-01-01 --to 2023-07-01
+#   python -m simulation.replay --granularities M5 H1 --from 2023-01-01 --to 2023-07-01
+#   python -m simulation.replay --source ticks --from 2023-03-01 --to 2023-03-08 --speed 600
+#
+# a granularity no pair has stored candles for is dropped and a pair without one of the others is skipped (both printed),
+# so the replay runs on the H4 history every pair has, and on M5 / M15 / H1 only for the pairs they were collected for.
+#
+# the report gives the decision latency per candle (the time on_candle takes: indicators, strategy and signal), how late
+# the events were handled against the replay clock, and the throughput over all the pairs, with how many times the live
+# rate of the replayed pairs it can keep up with.
+
+import time
+import heapq
+import argparse
+import pandas as pd
+
+from api.stream_server import candle_ticks
+from infrastructure.candle_store import to_time_values, load_candles, has_data
+from infrastructure.resample import MINUTES, NS_PER_MINUTE, bin_start, next_bin_start
+from infrastructure.instrumentation import StageStats
+from infrastructure.instrument_collection import instrumentCollection as ic
+from infrastructure.live_stream import LIVE_CURRENCIES, INDICATOR_SPECS, LiveService
+from simulation.strategies import StreamingMACross
+
+CHUNK_FREQ = 'MS' # the candles are read from the store a month at a time
+SOURCES = ['candles', 'ticks']
+REPLAY_GRANULARITIES = ['H4'] # the granularity stored for every pair, M5 / M15 / H1 only when they were collected
+
+def get_periods(date_f, date_t, freq=CHUNK_FREQ):
+    '''(from, to) pairs covering date_f -> date_t in chunks of freq'''
+    bounds = pd.date_range(pd.Timestamp(date_f, tz='UTC'), pd.Timestamp(date_t, tz='UTC'), freq=freq)
+    bounds = [pd.Timestamp(date_f, tz='UTC')] + [b for b in bounds if b > pd.Timestamp(date_f, tz='UTC')]
+    if bounds[-1] < pd.Timestamp(date_t, tz='UTC'):
+        bounds.append(pd.Timestamp(date_t, tz='UTC'))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def read_chunks(pair, granularity, date_f, date_t, data_path='./data'):
+    for f, t in get_periods(date_f, date_t):
+        df = load_candles(pair, granularity, f, t, data_path=data_path)
+        if df.shape[0] > 0:
+            yield df
+
+def candle_events(pair, granularity, rank, date_f, date_t, data_path='./data'):
+    '''
+    yields (close time in utc ns, rank, pair, granularity, candle) for the stored candles of the pair in time order.
+    rank orders the candles closing at the same time, the shorter granularities first.
+    '''
+    length = MINUTES[granularity] * NS_PER_MINUTE
+    for df in read_chunks(pair, granularity, date_f, date_t, data_path):
+        times = to_time_values(df['time'])
+        df = df.drop(columns=['time'])
+        for t, candle in zip(times.tolist(), df.to_dict('records')):
+            candle['time'] = t
+            yield t + length, rank, pair, granularity, candle
+
+def tick_events(pair, granularity, date_f, date_t, data_path='./data'):
+    '''yields (time in utc ns, 0, pair, bid, ask) for the ticks of the stored candles of the pair, 4 per candle'''
+    for df in read_chunks(pair, granularity, date_f, date_t, data_path):
+        times, bids, asks = candle_ticks(df, granularity)
+        for t, b, a in zip(times.tolist(), bids.tolist(), asks.tolist()):
+            yield t, 0, pair, b, a
+
+def get_tick_granularity(granularities):
+    '''the ticks are made from the candles of the shortest granularity, the service builds the longer ones from them'''
+    return min(granularities, key=lambda g: MINUTES[g])
+
+def get_replayed(pairs, granularities, data_path='./data'):
+    '''
+    the pairs and granularities that have stored candles: the granularities no pair has are dropped, then the pairs
+    missing one of the others are skipped, so every replayed pair has the same series.
+    '''
+    kept = []
+    for g in granularities:
+        if any([has_data(pair, g, data_path) for pair in pairs]):
+            kept.append(g)
+        else:
+            print(f'{g} --> no candles in {data_path} for any pair, dropped')
+    replayed = []
+    for pair in pairs:
+        missing = [g for g in kept if not has_data(pair, g, data_path)]
+        if len(missing) > 0:
+            print(f'{pair} {missing} --> no candles in {data_path}, skipped')
+        else:
+            replayed.append(pair)
+    return replayed, kept
+
+def merge_events(pairs, granularities, date_f, date_t, source='candles', data_path='./data'):
+    '''the events of all the pairs merged in time order with a heap, only one chunk per pair and granularity is in memory'''
+    if source == 'candles':
+        streams = [candle_events(pair, g, rank, date_f, date_t, data_path)
+                   for rank, g in enumerate(sorted(granularities, key=lambda g: MINUTES[g])) for pair in pairs]
+    elif source == 'ticks':
+        streams = [tick_events(pair, get_tick_granularity(granularities), date_f, date_t, data_path) for pair in pairs]
+    else:
+        raise ValueError(f'unknown source {source}, expected one of {SOURCES}')
+    return heapq.merge(*streams, key=lambda e: (e[0], e[1]))
+
+class ReplayStats:
+    '''the latency and throughput of a replay'''
+    def __init__(self):
+        self.decision = StageStats('decision') # seconds on_candle / on_tick took for the events that completed candles
+        self.lag = StageStats('lag') # seconds the events were handled after their time on the replay clock
+        self.events = 0
+        self.candles = 0
+        self.first_time = None
+        self.last_time = None
+        self.wall = 0.0
+
+    def report(self, pairs, source):
+        history = (self.last_time - self.first_time) / 1e9 if self.first_time is not None else 0.0
+        decision = self.decision.as_dict()
+        lag = self.lag.as_dict()
+        live_rate = self.events / history if history > 0 else None
+        throughput = self.events / self.wall if self.wall > 0 else None
+        return dict(
+            pairs=len(pairs),
+            source=source,
+            events=self.events,
+            candles=self.candles,
+            history_days=round(history / 86400, 1),
+            wall_seconds=round(self.wall, 3),
+            events_per_s=round(throughput, 1) if throughput is not None else None,
+            candles_per_s=round(self.candles / self.wall, 1) if self.wall > 0 else None,
+            live_events_per_s=round(live_rate, 4) if live_rate is not None else None,
+            capacity=round(throughput / live_rate, 1) if throughput is not None and live_rate is not None else None,
+            decision_mean_ms=decision['mean_ms'],
+            decision_p50_ms=decision.get('p50_ms'),
+            decision_p90_ms=decision.get('p90_ms'),
+            decision_p99_ms=decision.get('p99_ms'),
+            lag_p50_ms=lag.get('p50_ms'),
+            lag_p99_ms=lag.get('p99_ms'),
+        )
+
+def timed(stats, service, fn, *args):
+    '''calls fn and adds its time to the decision latency when it completed candles'''
+    candles = service.stats['candles']
+    t0 = time.perf_counter()
+    fn(*args)
+    seconds = time.perf_counter() - t0
+    if service.stats['candles'] > candles:
+        stats.decision.add_duration(seconds)
+
+def replay(service: LiveService, events, source='candles', speed=0.0, tick_granularity=None):
+    '''
+    hands the events to the service in order. with speed > 0 an event waits until its time on the replay clock
+    (speed x real time from the first event). returns the ReplayStats.
+    with source='ticks' a last heartbeat at the end of the candle of tick_granularity of the last tick closes the candles
+    the history completes, like the next tick would, so the last candle of every builder is counted too.
+    '''
+    stats = ReplayStats()
+    start = time.perf_counter()
+    for event in events:
+        event_time = event[0]
+        if stats.first_time is None:
+            stats.first_time = event_time
+        stats.last_time = event_time
+        if speed > 0:
+            due = start + (event_time - stats.first_time) / 1e9 / speed
+            now = time.perf_counter()
+            if due > now:
+                time.sleep(due - now)
+            stats.lag.add_duration(max(time.perf_counter() - due, 0.0))
+
+        if source == 'candles':
+            _, _, pair, granularity, candle = event
+            timed(stats, service, service.on_candle, pair, granularity, candle)
+        else:
+            _, _, pair, bid, ask = event
+            timed(stats, service, service.on_tick, pair, event_time, bid, ask)
+        stats.events += 1
+
+    if source == 'ticks' and tick_granularity is not None and stats.last_time is not None:
+        end = next_bin_start(bin_start(stats.last_time, tick_granularity), tick_granularity)
+        timed(stats, service, service.on_heartbeat, end)
+    stats.wall = time.perf_counter() - start
+    stats.candles = service.stats['candles']
+    return stats
+
+def run_replay(curr_list=LIVE_CURRENCIES, granularities=REPLAY_GRANULARITIES, date_f='2023-01-01', date_t='2023-02-01', source='candles',
+               speed=0.0, ma_s=10, ma_l=20, specs=INDICATOR_SPECS, data_path='./data', quiet=True):
+    '''
+    run_replay replays the stored candles of the pairs of curr_list through a LiveService running the MA cross
+    (ma_s, ma_l) on every granularity and prints the report. with source='ticks' the ticks are made from the candles of
+    the shortest granularity and the service builds all the granularities from them.
+    the pairs and granularities without stored candles are left out (get_replayed), None is returned when nothing is left.
+    quiet: the signals are counted but not printed.
+    '''
+    ic.LoadInstruments(data_path)
+    pairs, granularities = get_replayed(ic.pairs_for(curr_list), granularities, data_path)
+    if len(pairs) == 0 or len(granularities) == 0:
+        print(f'*** replay {date_f} -> {date_t} --> no stored candles to replay')
+        return None
+    service = LiveService(
+        pairs,
+        granularities,
+        specs,
+        strategy=lambda pair, g: StreamingMACross(ma_s, ma_l),
+        on_signal=(lambda *args: None) if quiet == True else None
+    )
+    events = merge_events(pairs, granularities, date_f, date_t, source, data_path)
+    stats = replay(service, events, source, speed, get_tick_granularity(granularities))
+
+    report = stats.report(pairs, source)
+    report['signals'] = service.stats['signals']
+    print(f'*** replay {source} {list(granularities)} {date_f} -> {date_t} speed {speed}')
+    for k, v in report.items():
+        print(f'{k:20} {v}')
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='replays the stored candles through the live loop and measures it')
+    parser.add_argument('--currencies', nargs='+', default=LIVE_CURRENCIES)
+    parser.add_argument('--granularities', nargs='+', default=REPLAY_GRANULARITIES)
+    parser.add_argument('--from', dest='date_f', default='2023-01-01')
+    parser.add_argument('--to', dest='date_t', default='2023-02-01')
+    parser.add_argument('--source', choices=SOURCES, default='candles')
+    parser.add_argument('--speed', type=float, default=0.0, help='1 for real time, N for N x, 0 for as fast as possible')
+    parser.add_argument('--signals', action='store_true', help='print the signals')
+    args = parser.parse_args()
+    run_replay(args.currencies, args.granularities, args.date_f, args.date_t, args.source, args.speed, quiet=not args.signals)
@@ -0,0 +1,108 @@
+# in this script the results store of the simulations is created. instead of reading the whole ma_res.pkl / ma_trades.pkl,
+# concatenating and rewriting them on every write, every write adds new part files and a line to a manifest:
+#
+#   ./data/results/ma_trades/manifest.jsonl
+#   ./data/results/ma_trades/run=20240101-120000-1a2b3c/EUR_USD_H1_5f1e2d3c.pkl
+#
+# a write never touches the existing parts, so it costs O(new rows), and the manifest lines are appended with a single
+# O_APPEND write each, so parallel workers writing to the same store do not overwrite each other.
+#
+# the parts are pickles, not parquet / arrow, as pyarrow is not in requirements.txt. the trade off: they can only be read
+# from python (with a compatible pandas), and a part is always loaded whole, there is no reading of only some columns.
+# the filters of read_results only choose which parts are loaded.
+
+import os
+import json
+import uuid
+import datetime as dt
+import pandas as pd
+
+from infrastructure.instrumentation import instrumentation
+
+RESULTS_DIR = 'results'
+MANIFEST = 'manifest.jsonl'
+
+def new_run_id():
+    return f'{dt.datetime.now().strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:6]}'
+
+def get_store_dir(filepath, name):
+    return os.path.join(filepath, RESULTS_DIR, name)
+
+def append_manifest(store_dir, entry):
+    line = (json.dumps(entry) + '\n').encode()
+    fd = os.open(os.path.join(store_dir, MANIFEST), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+def read_manifest(store_dir):
+    filename = os.path.join(store_dir, MANIFEST)
+    if not os.path.isfile(filename):
+        return []
+    with open(filename, 'r') as f:
+        return [json.loads(line) for line in f if line.strip() != '']
+
+def write_results(df: pd.DataFrame, name, filepath, run_id, pair_col, granularity_col):
+    '''
+    write_results saves the rows of df in the results store `name` under filepath, one part per pair and granularity,
+    and records every part in the manifest. pair_col and granularity_col are the columns holding them.
+    '''
+    store_dir = get_store_dir(filepath, name)
+    run_dir = os.path.join(store_dir, f'run={run_id}')
+    os.makedirs(run_dir, exist_ok=True)
+
+    for (pair, granularity), df_part in df.groupby([pair_col, granularity_col], sort=False):
+        part = f'{pair}_{granularity}_{uuid.uuid4().hex[:8]}.pkl'
+        filename = os.path.join(run_dir, part)
+        with instrumentation.stage('write_results') as stage:
+            df_part.reset_index(drop=True).to_pickle(f'{filename}.tmp')
+            os.replace(f'{filename}.tmp', filename)
+            stage.rows = df_part.shape[0]
+            stage.bytes_written = os.path.getsize(filename)
+        append_manifest(store_dir, dict(
+            run_id=run_id,
+            pair=pair,
+            granularity=granularity,
+            file=os.path.join(f'run={run_id}', part),
+            rows=df_part.shape[0],
+            created=dt.datetime.now().isoformat()
+        ))
+        print(filename, df_part.shape)
+
+def list_runs(name, filepath='./data'):
+    '''the run ids of the results store in the order they were first written'''
+    runs = []
+    for entry in read_manifest(get_store_dir(filepath, name)):
+        if entry['run_id'] not in runs:
+            runs.append(entry['run_id'])
+    return runs
+
+def read_results(name, filepath='./data', run_id=None, pairs=None, granularity=None, include_legacy=False):
+    '''
+    read_results loads the parts of the results store `name` that match the filters:
+    run_id: only this run, all runs when None.
+    pairs: optional list of pairs.
+    granularity: optional granularity.
+    include_legacy: also loads the old {filepath}/{name}.pkl written before the store existed.
+    only the matching part files are read, in the order they were written.
+    '''
+    store_dir = get_store_dir(filepath, name)
+    dfs = []
+
+    legacy = os.path.join(filepath, f'{name}.pkl')
+    if include_legacy == True and os.path.isfile(legacy):
+        dfs.append(pd.read_pickle(legacy))
+
+    for entry in read_manifest(store_dir):
+        if run_id is not None and entry['run_id'] != run_id:
+            continue
+        if pairs is not None and entry['pair'] not in pairs:
+            continue
+        if granularity is not None and entry['granularity'] != granularity:
+            continue
+        dfs.append(pd.read_pickle(os.path.join(store_dir, entry['file'])))
+
+    if len(dfs) == 0:
+        return pd.DataFrame()
+    return pd.concat(dfs).reset_index(drop=True)
@@ -0,0 +1,81 @@
+# in this script the strategies run by the backtest engine in simulation/engine.py are created.
+# a strategy only has to turn the candles into one BUY / SELL / NONE signal per candle in get_signals.
+# the live loop (infrastructure/live_stream.py) gets one candle at a time instead, its strategies have an
+# update(candle, values) method returning the signal of the candle, values being the streaming indicators of the pair.
+
+import numpy as np
+import pandas as pd
+
+from simulation.crossover import BUY, SELL, NONE, detect_trades
+from simulation.engine import ACCOUNT_CURRENCY, CandleArrays, run_backtest
+from infrastructure.candle_store import TIME_COL, to_time_values, load_candles
+from infrastructure.instrument_collection import instrumentCollection as ic
+from technicals.streaming import SMA
+
+class MACrossStrategy:
+    '''
+    the ma cross of simulation/ma_cross.py on the engine: BUY when the short ma crosses the long one from below and
+    SELL when it crosses from above, with the same crossover rules as detect_trades.
+    '''
+    def __init__(self, ma_s=10, ma_l=20):
+        self.ma_s = ma_s
+        self.ma_l = ma_l
+
+    def __repr__(self):
+        return f'MACrossStrategy(ma_s={self.ma_s}, ma_l={self.ma_l})'
+
+    def get_signals(self, candles: CandleArrays):
+        mid_c = pd.Series(candles.mid_c)
+        delta = mid_c.rolling(window=self.ma_s).mean().to_numpy() - mid_c.rolling(window=self.ma_l).mean().to_numpy()
+        return detect_trades(delta)
+
+class StreamingMACross:
+    '''MACrossStrategy one candle at a time, with the streaming moving averages. gives the signals of get_signals'''
+    def __init__(self, ma_s=10, ma_l=20):
+        self.ma_s = SMA(ma_s)
+        self.ma_l = SMA(ma_l)
+        self.delta_prev = float('nan')
+
+    def update(self, candle, values=None):
+        delta = self.ma_s.update(candle)[self.ma_s.name] - self.ma_l.update(candle)[self.ma_l.name]
+        signal = NONE
+        if delta >= 0 and self.delta_prev < 0:
+            signal = BUY
+        elif delta < 0 and self.delta_prev >= 0:
+            signal = SELL
+        self.delta_prev = delta
+        return signal
+
+def load_home_rate(df, instrument, granularity, account=ACCOUNT_CURRENCY, data_path='./data'):
+    '''
+    the value of one unit of the quote currency of the instrument in the account currency at every candle of df, from the
+    mid closes of the pair linking them (GBP_USD for EUR_GBP, USD_JPY for CAD_JPY). the last close at or before every
+    candle is used. None when the instrument holds the account currency, the engine converts with its own prices then.
+    '''
+    if account in (instrument.base, instrument.quote):
+        return None
+    for conversion, invert in [(f'{instrument.quote}_{account}', False), (f'{account}_{instrument.quote}', True)]:
+        if conversion in ic.instruments_dict:
+            break
+    else:
+        raise ValueError(f'no pair links {instrument.quote} and {account} to convert the profits of {instrument.name}')
+
+    times = to_time_values(df[TIME_COL])
+    df_conv = load_candles(conversion, granularity, columns=[TIME_COL, 'mid_c'], data_path=data_path)
+    conv_times = to_time_values(df_conv[TIME_COL])
+    pos = np.clip(np.searchsorted(conv_times, times, side='right') - 1, 0, None) # the first close before the conversion starts
+    rate = df_conv['mid_c'].to_numpy(dtype=np.float64)[pos]
+    return 1.0 / rate if invert == True else rate
+
+def run_ma_backtest(pair, granularity, ma_s, ma_l, date_f=None, date_t=None, **kwargs):
+    '''
+    loads the candles of the pair and runs MACrossStrategy on them, kwargs are passed to run_backtest.
+    the profits are converted to the account currency with the prices of the pair linking it to the quote currency.
+    '''
+    if len(ic.instruments_dict) == 0:
+        ic.LoadInstruments('./data')
+    instrument = ic.instruments_dict[pair]
+    df = load_candles(pair, granularity, date_f, date_t)
+    if kwargs.get('home_rate') is None:
+        kwargs['home_rate'] = load_home_rate(df, instrument, granularity, kwargs.get('account', ACCOUNT_CURRENCY))
+    return run_backtest(CandleArrays(df), instrument, MACrossStrategy(ma_s, ma_l), **kwargs)
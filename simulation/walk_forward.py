@@ -0,0 +1,193 @@
+# in this script the walk-forward mode of the ma cross simulation is created. instead of picking the best (ma_s, ma_l)
+# over the whole history, the history of each pair is split in rolling windows: the best cross of the in-sample part of a
+# window is picked and then traded on the out-of-sample part that follows it, so the out-of-sample gains are what the
+# picked parameters would have made live.
+#
+# the price data and the ma columns are loaded once per pair and grid_trades finds the trades of every cross once over
+# the whole history. a window is then only a range of rows: the trades of a cross in it are found with a binary search and
+# its total gain comes from prefix sums of the gains, so the windows cost almost nothing on top of one full sweep.
+
+import numpy as np
+import pandas as pd
+
+from simulation.ma_cross import load_price_data, get_ma_col
+from simulation.ma_grid import get_crosses, grid_trades
+from simulation.results_store import new_run_id, write_results
+from infrastructure.instrument_collection import instrumentCollection as ic
+
+METRICS = ['total_gain', 'average_gain']
+
+class CrossGains:
+    '''
+    the trades of one cross as arrays for window queries:
+    rows: the row of every trade in the price data.
+    prefix: prefix sums of the gains of the trades, the gain of a trade being the move to the next trade of the cross.
+    '''
+    def __init__(self, rows, gain):
+        self.rows = rows
+        self.prefix = np.concatenate(([0.0], np.cumsum(gain)))
+
+    def window_stats(self, starts, ends):
+        '''
+        the number of trades and the total gain of the cross in every window of rows starts[i] -> ends[i] (end excluded),
+        as if the simulation was run on the rows of the window alone: the first row can not be a crossover (it has no
+        previous candle) and the last trade of the window gets no gain.
+        '''
+        first = np.searchsorted(self.rows, starts + 1, side='left')
+        last = np.searchsorted(self.rows, ends, side='left')
+        num_trades = last - first
+        # the gains of the trades first .. last-2, the last trade of the window is closed with no gain
+        total = np.where(num_trades > 0, self.prefix[np.maximum(last - 1, first)] - self.prefix[first], 0.0)
+        return num_trades, total
+
+def get_windows(times: pd.Series, in_sample='730D', out_sample=None, folds=None, anchored=False):
+    '''
+    splits the candles in walk-forward windows and returns a list of (is_start, is_end, oos_start, oos_end) row positions.
+    in_sample: the length of the in-sample part, e.g. '730D'.
+    out_sample: the length of the out-of-sample part, e.g. '90D'. or
+    folds: the number of windows, the out-of-sample parts then split what comes after the first in-sample part evenly.
+    the out-of-sample parts follow each other without gaps and the last one ends at the last candle. a window with no
+    candle in its out-of-sample part is left out.
+    anchored: every in-sample part starts at the first candle (expanding window) instead of rolling with the window.
+    '''
+    values = pd.DatetimeIndex(times)
+    first, end = values[0], values[-1]
+    is_length = pd.Timedelta(in_sample)
+    if first + is_length >= end:
+        return []
+    if folds is not None:
+        oos_length = (end - (first + is_length)) / folds
+        starts = [first + is_length + oos_length * k for k in range(folds)]
+    elif out_sample is not None:
+        oos_length = pd.Timedelta(out_sample)
+        starts = []
+        oos_start = first + is_length
+        while oos_start < end:
+            starts.append(oos_start)
+            oos_start = oos_start + oos_length
+    else:
+        raise ValueError('get_windows needs out_sample or folds')
+
+    windows = []
+    for k, oos_start in enumerate(starts):
+        is_start = first if anchored == True else oos_start - is_length
+        bounds = values.searchsorted([is_start, oos_start, oos_start + oos_length], side='left')
+        # the last out-of-sample part runs to the last candle, whatever the rounding of the lengths
+        oos_end = len(values) if k == len(starts) - 1 else int(bounds[2])
+        if oos_end > bounds[1]:
+            windows.append((int(bounds[0]), int(bounds[1]), int(bounds[1]), oos_end))
+    return windows
+
+def pick_best(num_trades, total, metric='total_gain', min_trades=1):
+    '''the position of the best cross of a window by the metric, -1 when no cross has min_trades trades'''
+    if metric not in METRICS:
+        raise KeyError(f'unknown metric {metric}, expected one of {METRICS}')
+    score = total if metric == 'total_gain' else np.where(num_trades > 0, total / np.maximum(num_trades, 1), 0.0)
+    if score.shape[0] == 0:
+        return -1
+    score = np.where(num_trades >= min_trades, score, -np.inf)
+    best = int(np.argmax(score))
+    return best if np.isfinite(score[best]) else -1
+
+def walk_forward(price_data, crosses, instrument, granularity, windows, metric='total_gain', min_trades=1):
+    '''
+    walk_forward picks the best cross of the in-sample part of every window and measures it on the out-of-sample part.
+    price_data: the candles with the mid_c and ma columns, as load_price_data returns them.
+    crosses: list of (ma_l, ma_s).
+    windows: the (is_start, is_end, oos_start, oos_end) row positions of get_windows.
+    returns a dataframe with one row per window.
+    '''
+    ma_windows = sorted(set([ma for cross in crosses for ma in cross]))
+    col_idx = {ma: i for i, ma in enumerate(ma_windows)}
+    ma_matrix = price_data[[get_ma_col(ma) for ma in ma_windows]].to_numpy(dtype='float64')
+    cross_trades = grid_trades(
+        ma_matrix,
+        price_data['mid_c'].to_numpy(),
+        instrument.pipLocation,
+        [(col_idx[ma_l], col_idx[ma_s]) for ma_l, ma_s in crosses]
+    )
+    gains = [CrossGains(ct.rows, ct.gain) for ct in cross_trades]
+
+    bounds = np.array(windows, dtype=np.int64).reshape(-1, 4)
+    # windows x crosses matrices of the trades and total gains of the in-sample and out-of-sample parts
+    is_stats = [g.window_stats(bounds[:, 0], bounds[:, 1]) for g in gains]
+    oos_stats = [g.window_stats(bounds[:, 2], bounds[:, 3]) for g in gains]
+    is_trades = np.stack([s[0] for s in is_stats], axis=1)
+    is_total = np.stack([s[1] for s in is_stats], axis=1)
+    oos_trades = np.stack([s[0] for s in oos_stats], axis=1)
+    oos_total = np.stack([s[1] for s in oos_stats], axis=1)
+
+    times = price_data['time']
+    rows = []
+    for w, (is_start, is_end, oos_start, oos_end) in enumerate(windows):
+        best = pick_best(is_trades[w], is_total[w], metric, min_trades)
+        ma_l, ma_s = crosses[best] if best >= 0 else (None, None)
+        rows.append(dict(
+            pair=instrument.name,
+            granularity=granularity,
+            fold=w,
+            is_from=times.iloc[is_start],
+            is_to=times.iloc[is_end - 1],
+            oos_from=times.iloc[oos_start],
+            oos_to=times.iloc[oos_end - 1],
+            ma_l=get_ma_col(ma_l) if best >= 0 else None,
+            ma_s=get_ma_col(ma_s) if best >= 0 else None,
+            cross=f'{get_ma_col(ma_s)}_{get_ma_col(ma_l)}' if best >= 0 else None,
+            is_trades=int(is_trades[w, best]) if best >= 0 else 0,
+            is_gain=float(is_total[w, best]) if best >= 0 else 0.0,
+            oos_trades=int(oos_trades[w, best]) if best >= 0 else 0,
+            oos_gain=float(oos_total[w, best]) if best >= 0 else 0.0,
+        ))
+    df = pd.DataFrame(rows)
+    if df.shape[0] > 0:
+        df['oos_gain_c'] = df['oos_gain'].cumsum()
+    return df
+
+def walk_forward_pair(instrument, granularity, ma_long, ma_short, in_sample='730D', out_sample=None, folds=None,
+                      anchored=False, metric='total_gain', min_trades=1):
+    '''loads the price data of the instrument once with all the ma columns and runs walk_forward on its windows'''
+    price_data = load_price_data(instrument.name, granularity, set(ma_long + ma_short), columns=['time', 'mid_c'])
+    windows = get_windows(price_data['time'], in_sample, out_sample, folds, anchored)
+    return walk_forward(price_data, get_crosses(ma_long, ma_short), instrument, granularity, windows, metric, min_trades)
+
+def summarize(df_wf: pd.DataFrame):
+    '''one row per pair and granularity: the out-of-sample totals of the walk-forward and how stable the picks were'''
+    return df_wf.groupby(['pair', 'granularity'], sort=False).agg(
+        folds=('fold', 'count'),
+        oos_trades=('oos_trades', 'sum'),
+        oos_gain=('oos_gain', 'sum'),
+        is_gain=('is_gain', 'sum'),
+        winning_folds=('oos_gain', lambda x: int((x > 0).sum())),
+        crosses_picked=('cross', 'nunique'),
+    ).reset_index()
+
+def run_walk_forward(
+        curr_list=['CAD', 'JPY', 'NZD', 'GBP'],
+        granularity=['H1'],
+        ma_long=[20, 40],
+        ma_short=[10],
+        in_sample='730D',# the length of the in-sample part of every window
+        out_sample=None,# the length of the out-of-sample part, or
+        folds=20,# the number of windows
+        anchored=False,
+        metric='total_gain',# what the best cross of an in-sample part is picked by: total_gain or average_gain
+        filepath='./data'
+):
+    '''
+    run_walk_forward runs the walk-forward of every pair of curr_list and granularity and saves the windows in the
+    ma_walk_forward results store under a new run id. the summary per pair is printed and returned.
+    '''
+    ic.LoadInstruments('./data')
+    run_id = new_run_id()
+    dfs = []
+    for g in granularity:
+        for pair in ic.pairs_for(curr_list):
+            df_wf = walk_forward_pair(ic.instruments_dict[pair], g, ma_long, ma_short, in_sample, out_sample, folds, anchored, metric)
+            if df_wf.shape[0] > 0:
+                write_results(df_wf, 'ma_walk_forward', filepath, run_id, 'pair', 'granularity')
+                dfs.append(df_wf)
+    if len(dfs) == 0:
+        return None
+    df_summary = summarize(pd.concat(dfs))
+    print(df_summary)
+    return df_summary
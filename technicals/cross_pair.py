@@ -0,0 +1,202 @@
+# in this script the cross pair analytics are created. everything else looks at one pair at a time, here the closes of
+# many pairs are loaded into one pairs x time matrix on a shared time axis, so the portfolio views are matrix operations:
+#
+#   pm = load_price_matrix(ic.pairs_for(['AUD', 'CAD', 'EUR', 'GBP', 'JPY', 'NZD', 'USD']), 'M15')
+#   returns = log_returns(pm.values)
+#   corr = rolling_correlation(returns, window=96)          # time x pairs x pairs, the correlation of the last 96 returns
+#   strength = currency_strength(returns, pm.pairs)          # currencies x time, cumulative log strength of each currency
+#   net_exposure({'EUR_USD': 10000, 'USD_JPY': -5000}, pm)   # the net units of every currency and their value in USD
+#
+# the matrix is float32 (half the memory of the float64 candles) and can be written to a memory mapped .npy file with
+# mmap_path, so a long M5 or M15 history of 21 pairs does not have to fit in memory and can be opened again without
+# reading the candle store (open_price_matrix).
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+from infrastructure.candle_store import TIME_COL, to_time_values, from_time_values, load_candles
+
+CHUNK_SIZE = 8192 # rows of the time axis processed at once by rolling_correlation
+
+class PriceMatrix:
+    '''
+    the prices of several pairs on one time axis:
+    pairs: the pair names, in the order of the rows of values.
+    times: int64 utc nanoseconds, the union of the candle times of the pairs.
+    values: float32 pairs x time. a pair with no candle at a time keeps its last price, and is NaN before its first candle.
+    '''
+    def __init__(self, pairs, times, values, granularity=None, column='mid_c'):
+        self.pairs = list(pairs)
+        self.times = times
+        self.values = values
+        self.granularity = granularity
+        self.column = column
+        self.position = {pair: i for i, pair in enumerate(self.pairs)}
+
+    def __repr__(self):
+        return f'PriceMatrix({self.granularity} {self.column}, {len(self.pairs)} pairs x {self.times.shape[0]} times)'
+
+    def get_times(self):
+        return from_time_values(self.times)
+
+    def to_frame(self):
+        '''the matrix as a time x pairs dataframe indexed by time'''
+        return pd.DataFrame(self.values.T, index=self.get_times(), columns=self.pairs)
+
+def forward_fill(row):
+    '''replaces the NaNs of a 1d array with the last value before them, in place'''
+    idx = np.where(np.isnan(row), 0, np.arange(row.shape[0]))
+    np.maximum.accumulate(idx, out=idx)
+    row[:] = row[idx]
+
+def load_price_matrix(pairs, granularity, column='mid_c', date_f=None, date_t=None, data_path='./data', mmap_path=None):
+    '''
+    load_price_matrix reads the column of every pair from the candle store and aligns them on the union of their times.
+    mmap_path: optional folder, the matrix is then written to {mmap_path}/values.npy as a memory map, with the times and
+    the pairs next to it, instead of being kept in memory.
+    '''
+    series = []
+    for pair in pairs:
+        df = load_candles(pair, granularity, date_f, date_t, columns=[TIME_COL, column], data_path=data_path)
+        series.append((to_time_values(df[TIME_COL]), df[column].to_numpy(dtype=np.float32)))
+
+    times = np.unique(np.concatenate([t for t, _ in series])) if len(series) > 0 else np.empty(0, dtype=np.int64)
+    shape = (len(pairs), times.shape[0])
+    if mmap_path is not None:
+        os.makedirs(mmap_path, exist_ok=True)
+        values = np.lib.format.open_memmap(os.path.join(mmap_path, 'values.npy'), mode='w+', dtype=np.float32, shape=shape)
+    else:
+        values = np.empty(shape, dtype=np.float32)
+
+    for i, (t, v) in enumerate(series):
+        row = np.full(times.shape[0], np.nan, dtype=np.float32)
+        row[np.searchsorted(times, t)] = v
+        forward_fill(row)
+        values[i] = row
+
+    pm = PriceMatrix(pairs, times, values, granularity, column)
+    if mmap_path is not None:
+        values.flush()
+        np.save(os.path.join(mmap_path, 'times.npy'), times)
+        with open(os.path.join(mmap_path, 'meta.json'), 'w') as f:
+            f.write(json.dumps(dict(pairs=pm.pairs, granularity=granularity, column=column), indent=2))
+    return pm
+
+def open_price_matrix(mmap_path, mode='r'):
+    '''opens a matrix written by load_price_matrix(mmap_path=...), the values are memory mapped'''
+    with open(os.path.join(mmap_path, 'meta.json'), 'r') as f:
+        meta = json.loads(f.read())
+    values = np.load(os.path.join(mmap_path, 'values.npy'), mmap_mode=mode)
+    times = np.load(os.path.join(mmap_path, 'times.npy'))
+    return PriceMatrix(meta['pairs'], times, values, meta['granularity'], meta['column'])
+
+def log_returns(values):
+    '''the log returns of every row of a pairs x time matrix, float32 and NaN at the first time and before the first price'''
+    returns = np.empty(values.shape, dtype=np.float32)
+    returns[:, 0] = np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        np.log(values[:, 1:] / values[:, :-1], out=returns[:, 1:])
+    return returns
+
+def window_sums(values, window):
+    '''the sums of the values over the last window rows (axis 0), from their cumulative sums'''
+    cum = np.cumsum(values, axis=0)
+    out = cum[window - 1:].copy()
+    out[1:] -= cum[:-window]
+    return out
+
+def rolling_correlation(returns, window, min_time=0):
+    '''
+    rolling_correlation returns the correlation of every pair with every other one over the last window returns, as a
+    float32 array of time x pairs x pairs (NaN for the first window times), like pandas rolling(window).corr().
+    the windowed sums of the returns, their squares and their products come from cumulative sums along time, computed
+    chunk by chunk so only CHUNK_SIZE + window times of pair x pair products are in memory at once.
+    min_time: the first time position to compute, the earlier ones are left out of the result.
+    a window holding a NaN return of a pair gives NaN correlations for that pair.
+    '''
+    num_pairs, num_times = returns.shape
+    out = np.full((max(num_times - min_time, 0), num_pairs, num_pairs), np.nan, dtype=np.float32)
+    for chunk_start in range(max(min_time, window - 1), num_times, CHUNK_SIZE):
+        chunk_end = min(chunk_start + CHUNK_SIZE, num_times)
+        # the returns of the windows ending at chunk_start .. chunk_end-1, as float64 time x pairs
+        x = returns[:, chunk_start - window + 1:chunk_end].T.astype(np.float64)
+        invalid = np.isnan(x)
+        x[invalid] = 0.0
+        s = window_sums(x, window)
+        sxy = window_sums(x[:, :, None] * x[:, None, :], window)
+        bad = window_sums(invalid.astype(np.int32), window) > 0
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cov = sxy - s[:, :, None] * s[:, None, :] / window
+            var = np.diagonal(cov, axis1=1, axis2=2)
+            corr = cov / np.sqrt(var[:, :, None] * var[:, None, :])
+        corr[bad[:, :, None] | bad[:, None, :]] = np.nan
+        out[chunk_start - min_time:chunk_end - min_time] = corr
+    return out
+
+def incidence_matrix(pairs, currencies=None):
+    '''
+    the pairs x currencies matrix with 1 for the base and -1 for the quote currency of every pair, so the log return of a
+    pair is the strength return of its base minus the one of its quote: returns = incidence @ strength.
+    '''
+    if currencies is None:
+        currencies = []
+        for pair in pairs:
+            for curr in pair.split('_'):
+                if curr not in currencies:
+                    currencies.append(curr)
+    position = {curr: i for i, curr in enumerate(currencies)}
+    incidence = np.zeros((len(pairs), len(currencies)), dtype=np.float64)
+    for i, pair in enumerate(pairs):
+        base, _, quote = pair.partition('_')
+        incidence[i, position[base]] = 1.0
+        incidence[i, position[quote]] = -1.0
+    return incidence, list(currencies)
+
+def strength_returns(returns, pairs, currencies=None):
+    '''
+    the log return of every currency against the basket of the others, currencies x time, as the least squares solution
+    of returns = incidence @ strength with the strengths summing to 0 (the pseudo inverse of the incidence matrix).
+    NaN returns are taken as 0.
+    '''
+    incidence, currencies = incidence_matrix(pairs, currencies)
+    solver = np.linalg.pinv(incidence)
+    return (solver @ np.nan_to_num(returns.astype(np.float64))).astype(np.float32), currencies
+
+def currency_strength(returns, pairs, currencies=None):
+    '''the cumulative log strength of every currency, currencies x time, starting at 0'''
+    strength, currencies = strength_returns(returns, pairs, currencies)
+    return np.cumsum(strength, axis=1), currencies
+
+def home_rates(pm: PriceMatrix, home='USD', t=-1):
+    '''the value of one unit of every currency of the matrix in the home currency at time position t, NaN when no pair links them'''
+    _, currencies = incidence_matrix(pm.pairs)
+    rates = {home: 1.0}
+    for curr in currencies:
+        if f'{curr}_{home}' in pm.position:
+            rates[curr] = float(pm.values[pm.position[f'{curr}_{home}'], t])
+        elif f'{home}_{curr}' in pm.position:
+            rates[curr] = 1.0 / float(pm.values[pm.position[f'{home}_{curr}'], t])
+    return {curr: rates.get(curr, np.nan) for curr in currencies}
+
+def net_exposure(positions, pm: PriceMatrix, home='USD', t=-1):
+    '''
+    net_exposure nets the positions (pair -> units of the base currency, negative when short) into the units held of
+    every currency at the prices of time position t: a long EUR_USD is long its units of EUR and short units x price of USD.
+    returns a dataframe with the currency, its net units and their value in the home currency.
+    '''
+    pairs = [pair for pair in positions.keys()]
+    incidence, currencies = incidence_matrix(pm.pairs)
+    rows = np.array([pm.position[pair] for pair in pairs], dtype=np.int64)
+    units = np.array([positions[pair] for pair in pairs], dtype=np.float64)
+    prices = np.asarray(pm.values[rows, t], dtype=np.float64)
+
+    base = np.clip(incidence[rows], 0, None)
+    quote = np.clip(-incidence[rows], 0, None)
+    net = base.T @ units - quote.T @ (units * prices)
+
+    rates = home_rates(pm, home, t)
+    df = pd.DataFrame(dict(currency=currencies, units=net, home_value=net * np.array([rates[c] for c in currencies])))
+    return df[df['units'] != 0].reset_index(drop=True)
@@ -1,64 +1,88 @@
 import pandas as pd
 
-def BollingerBands(df: pd.DataFrame, n=20, s=2) -> pd.DataFrame:
-    df = df.copy()
-    typical_p =(df['mid_c'] + df['mid_h'] + df['mid_l']) / 3
-    stddev = typical_p.rolling(window=n).std()
-    df['BB_MA'] = typical_p.rolling(window=n).mean()
-    df['BB_UP'] = df['BB_MA'] + stddev * s
-    df['BB_LW'] = df['BB_MA'] - stddev * s
-    return df
+# the kernels below compute the values of the indicators from the columns they need, without copying the dataframe.
+# the indicator functions and the pipeline in technicals/pipeline.py are both built on them.
 
-def ATR(df: pd.DataFrame, n=14):
-    df = df.copy()
+def typical_price(df: pd.DataFrame) -> pd.Series:
+    return (df['mid_c'] + df['mid_h'] + df['mid_l']) / 3
+
+def true_range(df: pd.DataFrame) -> pd.Series:
     prev_c = df['mid_c'].shift(1)
     tr1 = df['mid_h'] - df['mid_l']
     tr2 = abs(df['mid_h'] - prev_c)
     tr3 = abs(prev_c - df['mid_l'])
+    return pd.DataFrame({'tr1': tr1, 'tr2': tr2, 'tr3': tr3}).max(axis=1)
 
-    tr = pd.DataFrame({'tr1': tr1, 'tr2': tr2, 'tr3': tr3}).max(axis=1)
-    df[f'ATR_{n}'] = tr.rolling(window=n).mean()
-    return df
+def ema(close: pd.Series, span) -> pd.Series:
+    return close.ewm(span=span, min_periods=span).mean()
 
-def KeltnerChannel(df: pd.DataFrame, n_ema=20, n_atr=10):
-    df = df.copy()
-    df['EMA'] = df['mid_c'].ewm(span=n_ema, min_periods=n_ema).mean()
-    df = ATR(df, n=n_atr)
-    c_atr = f'ATR_{n_atr}'
-    df['KeUp'] = df[c_atr] * 2 + df['EMA']
-    df['KeLo'] = df['EMA'] - df[c_atr] * 2
-    df.drop(c_atr, axis=1, inplace=True) 
-    return df                
-
-def RSI(df: pd.DataFrame, n=14):
-    df = df.copy()                     
+def bollinger_values(typical_p: pd.Series, n=20, s=2) -> dict:
+    stddev = typical_p.rolling(window=n).std()
+    bb_ma = typical_p.rolling(window=n).mean()
+    return {
+        'BB_MA': bb_ma,
+        'BB_UP': bb_ma + stddev * s,
+        'BB_LW': bb_ma - stddev * s,
+    }
+
+def atr_values(tr: pd.Series, n=14) -> pd.Series:
+    return tr.rolling(window=n).mean()
+
+def keltner_values(ema_c: pd.Series, atr: pd.Series) -> dict:
+    return {
+        'EMA': ema_c,
+        'KeUp': atr * 2 + ema_c,
+        'KeLo': ema_c - atr * 2,
+    }
+
+def rsi_values(close: pd.Series, n=14) -> pd.Series:
+    # the wins and losses keep the index of close, the first diff is NaN and counts as 0.0 for both
     alpha = 1.0 / n
-    gains = df['mid_c'].diff()
+    gains = close.diff()
 
-    wins = pd.Series([ x if x >= 0 else 0.0 for x in gains], name='wins')
-    losses = pd.Series([ x * -1 if x < 0 else 0.0 for x in gains], name='losses')
+    wins = gains.clip(lower=0.0).fillna(0.0)
+    losses = (-gains).clip(lower=0.0).fillna(0.0)
 
     wins_rma = wins.ewm(min_periods=n, alpha=alpha).mean()
     losses_rma = losses.ewm(min_periods=n, alpha=alpha).mean()
 
     rs = wins_rma / losses_rma
+    return 100.0 - (100.0 / (1.0 + rs))
 
-    df[f'RSI_{n}'] = 100.0 - (100.0 / (1.0 + rs))
-    return df
+def macd_values(ema_short: pd.Series, ema_long: pd.Series, n_signal=9) -> dict:
+    macd = ema_short - ema_long
+    signal = macd.ewm(min_periods=n_signal, span=n_signal).mean()
+    return {
+        'MACD': macd,
+        'SIGNAL': signal,
+        'HIST': macd - signal,
+    }
 
-def MACD(df: pd.DataFrame, n_slow=26, n_fast=12, n_signal=9):
+def BollingerBands(df: pd.DataFrame, n=20, s=2) -> pd.DataFrame:
     df = df.copy()
-    
-    ema_long = df['mid_c'].ewm(min_periods=n_slow, span=n_slow).mean()
-    ema_short = df['mid_c'].ewm(min_periods=n_fast, span=n_fast).mean()
-
-    df['MACD'] = ema_short - ema_long
-    df['SIGNAL'] = df['MACD'].ewm(min_periods=n_signal, span=n_signal).mean()
-    df['HIST'] = df['MACD'] - df['SIGNAL']
-
+    for k, v in bollinger_values(typical_price(df), n, s).items():
+        df[k] = v
     return df
 
+def ATR(df: pd.DataFrame, n=14):
+    df = df.copy()
+    df[f'ATR_{n}'] = atr_values(true_range(df), n)
+    return df
 
+def KeltnerChannel(df: pd.DataFrame, n_ema=20, n_atr=10):
+    # the atr is only used to build the channel, so it is computed without copying the frame a second time
+    df = df.copy()
+    for k, v in keltner_values(ema(df['mid_c'], n_ema), atr_values(true_range(df), n_atr)).items():
+        df[k] = v
+    return df
 
+def RSI(df: pd.DataFrame, n=14):
+    df = df.copy()
+    df[f'RSI_{n}'] = rsi_values(df['mid_c'], n)
+    return df
 
-                                                                                                                                     
\ No newline at end of file
+def MACD(df: pd.DataFrame, n_slow=26, n_fast=12, n_signal=9):
+    df = df.copy()
+    for k, v in macd_values(ema(df['mid_c'], n_fast), ema(df['mid_c'], n_slow), n_signal).items():
+        df[k] = v
+    return df
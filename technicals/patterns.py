@@ -1,26 +1,153 @@
+# in this script the candlestick patterns are detected. the props of apply_candle_props (body size and position in the
+# range of the candle) are computed once on the numpy arrays of the ohlc columns, and every pattern compares them with the
+# props of the previous candles through shifted arrays, so a whole history is scanned without a python loop.
+#
+# every pattern is an int8 column: 1 / 0 for the shapes (HAMMER, SHOOTING_STAR, INSIDE_BAR, OUTSIDE_BAR, ...) and
+# 1 bullish / -1 bearish / 0 for the patterns with a direction (ENGULFING, STAR for morning / evening star, MARUBOZU).
+#
+#   df_sig = pattern_signals(df)                  # the int8 columns only, with the index of df
+#   df_an = apply_patterns(df)                    # the candles with the props and the pattern columns
+#
+# the scan of the stored pairs (the count of every pattern per pair and granularity) is in simulation/pattern_scan.py.
+
+import numpy as np
 import pandas as pd
 
+HANGING_MAN_BODY = 15.0 # the body is less than this % of the range
+HANGING_MAN_HEIGHT = 75.0 # and the bottom of the body above this % of the range
+SHOOTING_STAR_HEIGHT = 25.0 # the top of the body below this % of the range
+SPINNING_TOP_BODY = 25.0
+SPINNING_TOP_SHADOW = 25.0 # both shadows longer than this % of the range
+MARUBOZU_BODY = 90.0
+STAR_BODY = 60.0 # the first and last candles of a morning / evening star have a body of more than this % of their range
+STAR_MIDDLE_BODY = 25.0 # and the middle candle less than this
+
+DIRECTIONAL_PATTERNS = ['MARUBOZU', 'ENGULFING', 'STAR'] # the patterns with a bearish (-1) signal
+
+OHLC_COLUMNS = ['mid_o', 'mid_h', 'mid_l', 'mid_c']
+
+def candle_props(mid_o, mid_h, mid_l, mid_c):
+    # np.fmin/np.fmax skip a NaN like min/max(axis=1) did, and a candle with no range gives inf/NaN percentages like the
+    # pandas division did, without the warnings.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        direction = mid_c - mid_o
+        body_size = np.abs(direction)
+        direction = np.where(direction >= 0, 1, -1)
+        full_range = mid_h - mid_l
+        body_perc = (body_size / full_range) * 100
+        body_lower = np.fmin(mid_c, mid_o)
+        body_upper = np.fmax(mid_c, mid_o)
+        body_bottom_perc = ((body_lower - mid_l) / full_range * 100)
+        body_top_perc = 100 - (((mid_h - body_upper) / full_range) * 100)
+
+    return dict(
+        body_lower=body_lower,
+        body_upper=body_upper,
+        body_bottom_perc=body_bottom_perc,
+        body_top_perc=body_top_perc,
+        body_perc=body_perc,
+        direction=direction,
+        body_size=body_size,
+    )
+
+def get_arrays(df: pd.DataFrame):
+    return [df[col].to_numpy() for col in OHLC_COLUMNS]
+
 def apply_candle_props(df: pd.DataFrame):
-    
     df_an = df.copy()
-    direction = df_an['mid_c'] - df_an['mid_o']
-    body_size = abs(direction)
-    direction = [1 if x >= 0 else -1 for x in direction]
-    full_range = df_an['mid_h'] - df_an['mid_l']
-    body_perc = (body_size / full_range) * 100
-    body_lower = df_an[['mid_c', 'mid_o']].min(axis=1)
-    body_upper = df_an[['mid_c', 'mid_o']].max(axis=1)
-    body_bottom_perc = ((body_lower - df_an['mid_l']) / full_range * 100)
-    body_top_perc = 100 - (((df_an['mid_h'] - body_upper) / full_range) * 100)
-
-    df_an['body_lower'] = body_lower
-    df_an['body_upper'] = body_upper
-    df_an['body_bottom_perc'] = body_bottom_perc
-    df_an['body_top_perc'] = body_top_perc
-    df_an['body_perc'] = body_perc
-    df_an['direction'] = direction
+    props = candle_props(*get_arrays(df_an))
+    for col in ['body_lower', 'body_upper', 'body_bottom_perc', 'body_top_perc', 'body_perc', 'direction']:
+        df_an[col] = props[col]
     return df_an
 
-def apply_patterns(df: pd.DataFrame):
+def shift(values, n=1):
+    '''values moved n candles later, the first n are NaN (or False for a bool array) so no pattern is found there'''
+    out = np.empty_like(values, dtype=bool if values.dtype == bool else 'float64')
+    out[:n] = False if values.dtype == bool else np.nan
+    out[n:] = values[:-n]
+    return out
+
+def as_signal(bullish, bearish=None):
+    signal = bullish.astype(np.int8)
+    if bearish is not None:
+        signal -= bearish.astype(np.int8)
+    return signal
+
+# every pattern takes the ohlc arrays and the props and returns its int8 signal
+def hammer(o, h, l, c, p):
+    return as_signal((p['body_bottom_perc'] > HANGING_MAN_HEIGHT) & (p['body_perc'] < HANGING_MAN_BODY))
+
+def shooting_star(o, h, l, c, p):
+    return as_signal((p['body_top_perc'] < SHOOTING_STAR_HEIGHT) & (p['body_perc'] < HANGING_MAN_BODY))
+
+def spinning_top(o, h, l, c, p):
+    return as_signal((p['body_perc'] < SPINNING_TOP_BODY) & (p['body_bottom_perc'] > SPINNING_TOP_SHADOW)
+                     & (p['body_top_perc'] < 100 - SPINNING_TOP_SHADOW))
+
+def marubozu(o, h, l, c, p):
+    big = p['body_perc'] > MARUBOZU_BODY
+    return as_signal(big & (p['direction'] == 1), big & (p['direction'] == -1))
+
+def engulfing(o, h, l, c, p):
+    # the body covers the body of the previous candle, which went the other way
+    prev_direction = shift(p['direction'])
+    covers = ((p['body_upper'] >= shift(p['body_upper'])) & (p['body_lower'] <= shift(p['body_lower']))
+              & (p['body_size'] > shift(p['body_size'])))
+    return as_signal(covers & (p['direction'] == 1) & (prev_direction == -1),
+                     covers & (p['direction'] == -1) & (prev_direction == 1))
+
+def inside_bar(o, h, l, c, p):
+    return as_signal((h < shift(h)) & (l > shift(l)))
+
+def outside_bar(o, h, l, c, p):
+    return as_signal((h > shift(h)) & (l < shift(l)))
+
+def star(o, h, l, c, p):
+    # morning star (1): a big bearish candle, a small one whose body is below it, then a big bullish candle closing above
+    # the middle of the first body. evening star (-1) the other way round.
+    first_big = shift(p['body_perc'], 2) > STAR_BODY
+    middle_small = shift(p['body_perc'], 1) < STAR_MIDDLE_BODY
+    last_big = p['body_perc'] > STAR_BODY
+    first_direction = shift(p['direction'], 2)
+    first_middle = (shift(o, 2) + shift(c, 2)) / 2
+    morning = (first_big & middle_small & last_big & (first_direction == -1) & (p['direction'] == 1)
+               & (shift(p['body_upper'], 1) < shift(p['body_lower'], 2)) & (c > first_middle))
+    evening = (first_big & middle_small & last_big & (first_direction == 1) & (p['direction'] == -1)
+               & (shift(p['body_lower'], 1) > shift(p['body_upper'], 2)) & (c < first_middle))
+    return as_signal(morning, evening)
+
+PATTERNS = {
+    'HAMMER': hammer,
+    'SHOOTING_STAR': shooting_star,
+    'SPINNING_TOP': spinning_top,
+    'MARUBOZU': marubozu,
+    'ENGULFING': engulfing,
+    'INSIDE_BAR': inside_bar,
+    'OUTSIDE_BAR': outside_bar,
+    'STAR': star,
+}
+
+def pattern_signals(df: pd.DataFrame, patterns=None, as_frame=True):
+    '''
+    pattern_signals detects the patterns (all of PATTERNS by default) over the candles of df and returns only the int8
+    signal columns: a dataframe with the index of df when as_frame is True, else a dict of column name to numpy array.
+    '''
+    patterns = list(PATTERNS.keys()) if patterns is None else patterns
+    arrays = get_arrays(df)
+    props = candle_props(*arrays)
+    with np.errstate(invalid='ignore'):
+        out = {}
+        for name in patterns:
+            if name not in PATTERNS:
+                raise KeyError(f'unknown pattern {name}, expected one of {list(PATTERNS.keys())}')
+            out[name] = PATTERNS[name](*arrays, props)
+
+    if as_frame == True:
+        return pd.DataFrame(out, index=df.index)
+    return out
+
+def apply_patterns(df: pd.DataFrame, patterns=None):
     df_an = apply_candle_props(df)
+    for name, signal in pattern_signals(df_an, patterns, as_frame=False).items():
+        df_an[name] = signal
     return df_an
@@ -0,0 +1,93 @@
+# in this script the indicator pipeline is created. every function in technicals/indicators.py copies the dataframe
+# and recomputes what it needs, so chaining them copies a wide ohlc frame again and again. the pipeline takes a list of
+# indicator specs, computes the shared intermediates (typical price, true range, emas) once and only writes the new columns:
+#
+#   specs = [('BollingerBands', dict(n=20)), ('KeltnerChannel', dict(n_ema=20, n_atr=10)), 'RSI', ('MACD', dict(n_fast=12))]
+#   df_ind = compute_indicators(df, specs)
+#   df = df.join(df_ind)
+
+import pandas as pd
+from technicals.indicators import (typical_price, true_range, ema, bollinger_values, atr_values,
+                                   keltner_values, rsi_values, macd_values)
+
+class SharedValues:
+    '''computes the intermediates of the indicators once per dataframe and hands the same series to every indicator'''
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.cache = {}
+
+    def get(self, key, fn):
+        if key not in self.cache:
+            self.cache[key] = fn()
+        return self.cache[key]
+
+    def typical_price(self):
+        return self.get(('typical_price',), lambda: typical_price(self.df))
+
+    def true_range(self):
+        return self.get(('true_range',), lambda: true_range(self.df))
+
+    def atr(self, n):
+        return self.get(('atr', n), lambda: atr_values(self.true_range(), n))
+
+    def ema(self, span):
+        return self.get(('ema', span), lambda: ema(self.df['mid_c'], span))
+
+def add_bollinger(shared: SharedValues, out, n=20, s=2):
+    out.update(bollinger_values(shared.typical_price(), n, s))
+
+def add_atr(shared: SharedValues, out, n=14):
+    out[f'ATR_{n}'] = shared.atr(n)
+
+def add_keltner(shared: SharedValues, out, n_ema=20, n_atr=10):
+    out.update(keltner_values(shared.ema(n_ema), shared.atr(n_atr)))
+
+def add_rsi(shared: SharedValues, out, n=14):
+    out[f'RSI_{n}'] = rsi_values(shared.df['mid_c'], n)
+
+def add_macd(shared: SharedValues, out, n_slow=26, n_fast=12, n_signal=9):
+    out.update(macd_values(shared.ema(n_fast), shared.ema(n_slow), n_signal))
+
+# the spec names are the names of the indicator functions, the params are the same keyword arguments
+INDICATORS = {
+    'BollingerBands': add_bollinger,
+    'ATR': add_atr,
+    'KeltnerChannel': add_keltner,
+    'RSI': add_rsi,
+    'MACD': add_macd,
+}
+
+def get_spec(spec):
+    '''a spec is either the name of an indicator or a (name, params) tuple'''
+    if isinstance(spec, str):
+        return spec, {}
+    name, params = spec
+    return name, params
+
+def compute_indicators(df: pd.DataFrame, specs, as_frame=True):
+    '''
+    compute_indicators computes every indicator in specs over df in one pass.
+    the intermediates shared by several indicators are computed once, and only the new columns are returned:
+    a dataframe with the index of df when as_frame is True, else a dict of column name to numpy array.
+    the columns have the same names and values as the ones the indicator functions add. as those names do not all hold
+    the parameters (EMA, BB_*, MACD*), two specs writing the same column raise a ValueError instead of one silently
+    replacing the other.
+    '''
+    shared = SharedValues(df)
+    out = {}
+    owners = {}
+    for spec in specs:
+        name, params = get_spec(spec)
+        if name not in INDICATORS:
+            raise KeyError(f'unknown indicator {name}, expected one of {list(INDICATORS.keys())}')
+        values = {}
+        INDICATORS[name](shared, values, **params)
+        for col in values.keys():
+            if col in owners:
+                raise ValueError(f'{spec} and {owners[col]} both write the column {col}, only one of them can be computed at once')
+            owners[col] = spec
+        out.update(values)
+
+    if as_frame == True:
+        return pd.DataFrame(out, index=df.index)
+    return {k: v.to_numpy() for k, v in out.items()}
@@ -0,0 +1,238 @@
+# in this script the streaming versions of the indicators in technicals/indicators.py are created.
+# each one keeps its own state and update(candle) takes one new candle (anything indexable by 'mid_c', 'mid_h', 'mid_l',
+# like a dict or a row of the candle dataframe) and does a constant amount of work, so a live loop does not need to
+# recompute the indicators over the whole history on every candle. update returns a dict with the same column names as
+# the batch functions and the values match them to floating point tolerance.
+
+import math
+from collections import deque
+
+NAN = float('nan')
+
+def is_nan(x):
+    return x != x
+
+class EWMean:
+    '''the same recursion as pandas ewm(alpha=..., adjust=True, min_periods=...).mean(), leading NaNs are skipped'''
+    def __init__(self, alpha, min_periods=0):
+        self.old_wt_factor = 1.0 - alpha
+        self.min_periods = max(min_periods, 1)
+        self.weighted = NAN
+        self.old_wt = 1.0
+        self.nobs = 0
+
+    def update(self, x):
+        is_observation = not is_nan(x)
+        self.nobs += is_observation
+        if not is_nan(self.weighted):
+            self.old_wt *= self.old_wt_factor
+            if is_observation:
+                if self.weighted != x:
+                    self.weighted = ((self.old_wt * self.weighted) + x) / (self.old_wt + 1.0)
+                self.old_wt += 1.0
+        elif is_observation:
+            self.weighted = x
+        return self.weighted if self.nobs >= self.min_periods else NAN
+
+class RollingWindow:
+    '''
+    rolling mean and sample standard deviation of the last n values, like pandas rolling(window=n).mean() and .std().
+    the mean and the sum of squared deviations are updated as values enter and leave the window (welford),
+    a window holding a NaN gives NaN.
+    '''
+    def __init__(self, n):
+        self.n = n
+        self.values = deque()
+        self.nan_count = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        if is_nan(x):
+            self.nan_count += 1
+            return
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        if is_nan(x):
+            self.nan_count -= 1
+            return
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+            return
+        delta = x - self.mean
+        self.mean -= delta / self.count
+        self.m2 -= delta * (x - self.mean)
+
+    def update(self, x):
+        self.values.append(x)
+        self.add(x)
+        if len(self.values) > self.n:
+            self.remove(self.values.popleft())
+
+    def is_full(self):
+        return len(self.values) == self.n and self.nan_count == 0
+
+    def get_mean(self):
+        return self.mean if self.is_full() else NAN
+
+    def get_std(self):
+        if not self.is_full() or self.n < 2:
+            return NAN
+        return math.sqrt(max(self.m2, 0.0) / (self.n - 1))
+
+def typical_price(candle):
+    return (candle['mid_c'] + candle['mid_h'] + candle['mid_l']) / 3
+
+class TrueRange:
+    def __init__(self):
+        self.prev_c = NAN
+
+    def update(self, candle):
+        # like the max(axis=1) of the batch version, the NaN gaps of the first candle are skipped
+        trs = [candle['mid_h'] - candle['mid_l'], abs(candle['mid_h'] - self.prev_c), abs(self.prev_c - candle['mid_l'])]
+        trs = [x for x in trs if not is_nan(x)]
+        self.prev_c = candle['mid_c']
+        return max(trs) if len(trs) > 0 else NAN
+
+class SMA:
+    def __init__(self, n=20, col='mid_c'):
+        self.col = col
+        self.name = f'MA_{n}'
+        self.window = RollingWindow(n)
+
+    def update(self, candle):
+        self.window.update(candle[self.col])
+        return {self.name: self.window.get_mean()}
+
+class EMA:
+    def __init__(self, span=20, col='mid_c'):
+        self.col = col
+        self.ewm = EWMean(2.0 / (span + 1.0), span)
+
+    def update(self, candle):
+        return {'EMA': self.ewm.update(candle[self.col])}
+
+class BollingerBands:
+    def __init__(self, n=20, s=2):
+        self.s = s
+        self.window = RollingWindow(n)
+
+    def update(self, candle):
+        self.window.update(typical_price(candle))
+        bb_ma = self.window.get_mean()
+        stddev = self.window.get_std()
+        return {
+            'BB_MA': bb_ma,
+            'BB_UP': bb_ma + stddev * self.s,
+            'BB_LW': bb_ma - stddev * self.s,
+        }
+
+class ATR:
+    def __init__(self, n=14):
+        self.name = f'ATR_{n}'
+        self.tr = TrueRange()
+        self.window = RollingWindow(n)
+
+    def update(self, candle):
+        self.window.update(self.tr.update(candle))
+        return {self.name: self.window.get_mean()}
+
+class KeltnerChannel:
+    def __init__(self, n_ema=20, n_atr=10):
+        self.ema = EMA(n_ema)
+        self.atr = ATR(n_atr)
+
+    def update(self, candle):
+        ema_c = self.ema.update(candle)['EMA']
+        atr = self.atr.update(candle)[self.atr.name]
+        return {
+            'EMA': ema_c,
+            'KeUp': atr * 2 + ema_c,
+            'KeLo': ema_c - atr * 2,
+        }
+
+class RSI:
+    def __init__(self, n=14):
+        self.name = f'RSI_{n}'
+        self.prev_c = NAN
+        self.wins = EWMean(1.0 / n, n)
+        self.losses = EWMean(1.0 / n, n)
+
+    def update(self, candle):
+        gain = candle['mid_c'] - self.prev_c
+        self.prev_c = candle['mid_c']
+        if is_nan(gain): # the first diff counts as 0.0 for both, like the batch version
+            gain = 0.0
+        wins_rma = self.wins.update(max(gain, 0.0))
+        losses_rma = self.losses.update(max(-gain, 0.0))
+        if is_nan(wins_rma) or is_nan(losses_rma):
+            return {self.name: NAN}
+        if losses_rma == 0:
+            return {self.name: 100.0 if wins_rma > 0 else NAN}
+        return {self.name: 100.0 - (100.0 / (1.0 + wins_rma / losses_rma))}
+
+class MACD:
+    def __init__(self, n_slow=26, n_fast=12, n_signal=9):
+        self.ema_long = EMA(n_slow)
+        self.ema_short = EMA(n_fast)
+        self.signal = EWMean(2.0 / (n_signal + 1.0), n_signal)
+
+    def update(self, candle):
+        macd = self.ema_short.update(candle)['EMA'] - self.ema_long.update(candle)['EMA']
+        signal = self.signal.update(macd)
+        return {
+            'MACD': macd,
+            'SIGNAL': signal,
+            'HIST': macd - signal,
+        }
+
+# the same names and keyword arguments as the specs of technicals/pipeline.py, plus SMA and EMA
+INDICATORS = {
+    'SMA': SMA,
+    'EMA': EMA,
+    'BollingerBands': BollingerBands,
+    'ATR': ATR,
+    'KeltnerChannel': KeltnerChannel,
+    'RSI': RSI,
+    'MACD': MACD,
+}
+
+class IndicatorSet:
+    '''a group of streaming indicators built from a list of specs, update returns all of their values in one dict'''
+    def __init__(self, specs):
+        self.specs = specs
+        self.indicators = []
+        for spec in specs:
+            name, params = (spec, {}) if isinstance(spec, str) else spec
+            if name not in INDICATORS:
+                raise KeyError(f'unknown indicator {name}, expected one of {list(INDICATORS.keys())}')
+            self.indicators.append(INDICATORS[name](**params))
+        self.values = {}
+
+    def update(self, candle):
+        values = {}
+        for indicator in self.indicators:
+            values.update(indicator.update(candle))
+        self.values = values
+        return values
+
+class PairIndicators:
+    '''keeps one IndicatorSet per pair, created on the first candle of the pair, for a live loop over many instruments'''
+    def __init__(self, specs):
+        self.specs = specs
+        self.pairs = {}
+
+    def update(self, pair, candle):
+        if pair not in self.pairs:
+            self.pairs[pair] = IndicatorSet(self.specs)
+        return self.pairs[pair].update(candle)
+
+    def get_values(self, pair):
+        return self.pairs[pair].values if pair in self.pairs else {}
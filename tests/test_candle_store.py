@@ -0,0 +1,70 @@
+# the candle store (infrastructure/candle_store.py): appends line up with the stored history, also after an append that
+# stopped part way through.
+
+import builtins
+import numpy as np
+import pandas as pd
+import pytest
+
+import infrastructure.candle_store as candle_store
+from benchmarks.synthetic import make_candles
+from infrastructure.candle_store import TIME_COL, get_col_file, write_candles, append_candles, read_candles, last_time
+
+PAIR = 'EUR_USD'
+GRANULARITY = 'H1'
+
+@pytest.fixture
+def candles():
+    df = make_candles(PAIR, GRANULARITY, years=1, seed=1)
+    df[TIME_COL] = df[TIME_COL].dt.as_unit('ns') # the unit read_candles returns
+    return df
+
+def read_all(path):
+    return read_candles(PAIR, GRANULARITY, path=str(path))
+
+def crash_on_open(monkeypatch, count):
+    # the count-th file opened for appending raises, like a crash in the middle of append_candles
+    opened = []
+    def crashing_open(file, mode='r', *args, **kwargs):
+        if 'a' in mode:
+            opened.append(file)
+            if len(opened) == count:
+                raise OSError('crashed')
+        return builtins.open(file, mode, *args, **kwargs)
+    monkeypatch.setattr(candle_store, 'open', crashing_open, raising=False)
+    return opened
+
+def test_append_matches_write(tmp_path, candles):
+    write_candles(candles.iloc[:3000], PAIR, GRANULARITY, str(tmp_path))
+    assert append_candles(candles.iloc[2990:6000], PAIR, GRANULARITY, str(tmp_path)) == 3000
+    assert append_candles(candles.iloc[6000:], PAIR, GRANULARITY, str(tmp_path)) == candles.shape[0] - 6000
+    pd.testing.assert_frame_equal(read_all(tmp_path), candles.reset_index(drop=True))
+
+@pytest.mark.parametrize('crash_at', [1, 5, 13, 14])
+def test_append_after_crash(tmp_path, monkeypatch, candles, crash_at):
+    write_candles(candles.iloc[:3000], PAIR, GRANULARITY, str(tmp_path))
+    opened = crash_on_open(monkeypatch, crash_at)
+    with pytest.raises(OSError):
+        append_candles(candles.iloc[3000:6000], PAIR, GRANULARITY, str(tmp_path))
+    monkeypatch.undo()
+    assert len(opened) == crash_at
+
+    # the rows the crashed append wrote to some of the columns are not read, and the next append lines up with the times
+    pd.testing.assert_frame_equal(read_all(tmp_path), candles.iloc[:3000].reset_index(drop=True))
+    assert last_time(PAIR, GRANULARITY, str(tmp_path)) == candles['time'].iloc[2999]
+    append_candles(candles.iloc[3000:], PAIR, GRANULARITY, str(tmp_path))
+    pd.testing.assert_frame_equal(read_all(tmp_path), candles.reset_index(drop=True))
+
+def test_append_after_partial_time_row(tmp_path, candles):
+    write_candles(candles.iloc[:3000], PAIR, GRANULARITY, str(tmp_path))
+    year_dir = tmp_path / PAIR / GRANULARITY / str(candles['time'].iloc[2999].year)
+    # a crash while time.bin was written: every price column has 2 more rows and time.bin half of the first one
+    for col in candles.columns:
+        with open(get_col_file(str(year_dir), col), 'ab') as f:
+            if col == TIME_COL:
+                f.write(b'\x00' * 4)
+            else:
+                np.full(2, 9.0, dtype=candles[col].dtype).tofile(f)
+
+    append_candles(candles.iloc[3000:], PAIR, GRANULARITY, str(tmp_path))
+    pd.testing.assert_frame_equal(read_all(tmp_path), candles.reset_index(drop=True))
@@ -0,0 +1,112 @@
+# the chunked backfill of infrastructure/collect_data.py with a fake fetch: a full download replaces the stored history only
+# once it is done, a failed chunk is resumed from the checkpoint and other dates start again from scratch.
+
+import os
+import pandas as pd
+import pytest
+
+import infrastructure.collect_data as collect_data
+from benchmarks.synthetic import make_candles
+from infrastructure.candle_store import STORE_DIR, TIME_COL, write_candles, read_candles, has_candles
+from infrastructure.collect_data import read_checkpoint, get_checkpoint_file
+
+PAIR = 'EUR_USD'
+GRANULARITY = 'H1'
+DATE_F = '2016-01-04T00:00:00Z'
+DATE_T = '2016-07-01T00:00:00Z'
+
+class FakeFetch:
+    '''serves the chunks from a dataframe like the broker would and returns None (a failed request) for the fail_at-th one'''
+    def __init__(self, candles, fail_at=None):
+        self.candles = candles
+        self.fail_at = fail_at
+        self.chunks = []
+
+    def __call__(self, pair, granularity, date_f, date_t, api):
+        self.chunks.append((date_f, date_t))
+        if len(self.chunks) == self.fail_at:
+            return None
+        times = self.candles[TIME_COL]
+        return self.candles[(times >= date_f) & (times < date_t)].reset_index(drop=True)
+
+@pytest.fixture
+def source():
+    df = make_candles(PAIR, GRANULARITY, years=1, seed=1)
+    df[TIME_COL] = df[TIME_COL].dt.as_unit('ns') # the unit read_candles returns
+    return df
+
+@pytest.fixture
+def old_history(tmp_path):
+    # what an earlier download stored, its prices are from another seed so it can not be mistaken for the new window
+    df = make_candles(PAIR, GRANULARITY, years=1, seed=2)
+    df[TIME_COL] = df[TIME_COL].dt.as_unit('ns')
+    write_candles(df, PAIR, GRANULARITY, os.path.join(str(tmp_path), STORE_DIR))
+    return df
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # 500 candles a chunk, so the window is downloaded in 9 chunks
+    monkeypatch.setitem(collect_data.INCREMENTS, GRANULARITY, 60 * 500)
+
+def run(tmp_path, fetch, monkeypatch, date_f=DATE_F, date_t=DATE_T):
+    monkeypatch.setattr(collect_data, 'fetch_candles', fetch)
+    return collect_data.collect_data(PAIR, GRANULARITY, date_f, date_t, str(tmp_path), None)
+
+def stored(tmp_path):
+    return read_candles(PAIR, GRANULARITY, path=os.path.join(str(tmp_path), STORE_DIR))
+
+def in_window(df, date_f=DATE_F, date_t=DATE_T):
+    times = df[TIME_COL]
+    return df[(times >= pd.Timestamp(date_f)) & (times < pd.Timestamp(date_t))].reset_index(drop=True)
+
+def test_full_run(tmp_path, monkeypatch, source, old_history):
+    fetch = FakeFetch(source)
+    assert run(tmp_path, fetch, monkeypatch) == True
+    assert len(fetch.chunks) == 9
+    pd.testing.assert_frame_equal(stored(tmp_path), in_window(source))
+    assert not os.path.exists(get_checkpoint_file(str(tmp_path), PAIR, GRANULARITY))
+    assert not has_candles(PAIR, f'{GRANULARITY}.partial', os.path.join(str(tmp_path), STORE_DIR))
+
+def test_failure_then_resume(tmp_path, monkeypatch, source, old_history):
+    fetch = FakeFetch(source, fail_at=4)
+    assert run(tmp_path, fetch, monkeypatch) == False
+
+    # the old history is kept until the window is done, the checkpoint points at the failed chunk
+    pd.testing.assert_frame_equal(stored(tmp_path), old_history)
+    checkpoint = read_checkpoint(str(tmp_path), PAIR, GRANULARITY)
+    assert checkpoint['run'] == dict(date_f=DATE_F, date_t=DATE_T, incremental=False)
+    assert checkpoint['chunks'] == 3
+    assert pd.Timestamp(checkpoint['next']) == pd.Timestamp(fetch.chunks[3][0])
+    assert checkpoint['candles'] == in_window(source, DATE_F, checkpoint['next']).shape[0]
+
+    fetch = FakeFetch(source)
+    assert run(tmp_path, fetch, monkeypatch) == True
+    assert pd.Timestamp(fetch.chunks[0][0]) == pd.Timestamp(checkpoint['next'])
+    assert len(fetch.chunks) == 6
+    pd.testing.assert_frame_equal(stored(tmp_path), in_window(source))
+    assert read_checkpoint(str(tmp_path), PAIR, GRANULARITY) is None
+
+def test_changed_dates_start_fresh(tmp_path, monkeypatch, source, old_history):
+    assert run(tmp_path, FakeFetch(source, fail_at=4), monkeypatch) == False
+
+    # a checkpoint of other dates is not resumed, and the chunks staged by it are not part of the new window
+    date_f = '2016-02-01T00:00:00Z'
+    fetch = FakeFetch(source)
+    assert run(tmp_path, fetch, monkeypatch, date_f=date_f) == True
+    assert pd.Timestamp(fetch.chunks[0][0]) == pd.Timestamp(date_f)
+    pd.testing.assert_frame_equal(stored(tmp_path), in_window(source, date_f))
+    assert read_checkpoint(str(tmp_path), PAIR, GRANULARITY) is None
+
+def test_incremental_resume(tmp_path, monkeypatch, source):
+    write_candles(in_window(source, DATE_F, '2016-02-01T00:00:00Z'), PAIR, GRANULARITY, os.path.join(str(tmp_path), STORE_DIR))
+    monkeypatch.setattr(collect_data, 'fetch_candles', FakeFetch(source, fail_at=3))
+    assert collect_data.collect_data(PAIR, GRANULARITY, DATE_F, DATE_T, str(tmp_path), None, incremental=True) == False
+
+    # the chunks before the failed one are appended to the history, the rest is fetched when the run is resumed
+    checkpoint = read_checkpoint(str(tmp_path), PAIR, GRANULARITY)
+    pd.testing.assert_frame_equal(stored(tmp_path), in_window(source, DATE_F, checkpoint['next']))
+    fetch = FakeFetch(source)
+    monkeypatch.setattr(collect_data, 'fetch_candles', fetch)
+    assert collect_data.collect_data(PAIR, GRANULARITY, DATE_F, DATE_T, str(tmp_path), None, incremental=True) == True
+    assert pd.Timestamp(fetch.chunks[0][0]) == pd.Timestamp(checkpoint['next'])
+    pd.testing.assert_frame_equal(stored(tmp_path), in_window(source))
@@ -0,0 +1,82 @@
+# the vectorized crossover detection (simulation/crossover.py) and the batched grid of simulation/ma_cross.py against the
+# row by row is_trade path they replaced, on the stored H4 candles and on synthetic ones.
+
+import os
+import pytest
+import pandas as pd
+
+from benchmarks.synthetic import make_candles, make_instruments
+from infrastructure.candle_store import load_candles
+from infrastructure.instrument_collection import InstrumentCollection
+from simulation.crossover import BUY, SELL, NONE, detect_trades, crossover_rows
+from simulation.ma_cross import assess_grid
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data')
+CROSSES = [(20, 10), (40, 10), (80, 20), (160, 40)]
+COMPARED = ['time', 'mid_c', 'Delta', 'Delta_Prev', 'Trades', 'Diff', 'Gain', 'Gain_C']
+
+def is_trade(df):
+    # the row by row reference, as assess_pair applied it before
+    if df['Delta'] >= 0 and df['Delta_Prev'] < 0:
+        return BUY
+    elif df['Delta'] < 0 and df['Delta_Prev'] >= 0:
+        return SELL
+    return NONE
+
+def get_trades(df_analysis, pip_location):
+    df_trades = df_analysis[df_analysis['Trades'] != NONE].copy()
+    df_trades['Diff'] = df_trades['mid_c'].diff().shift(-1)
+    df_trades.fillna(0, inplace=True)
+    df_trades['Gain'] = df_trades['Diff'] / pip_location * df_trades['Trades']
+    df_trades['Gain_C'] = df_trades['Gain'].cumsum()
+    return df_trades
+
+def reference_trades(price_data, ma_l, ma_s, pip_location):
+    df_analysis = price_data.copy()
+    df_analysis['Delta'] = df_analysis[ma_s] - df_analysis[ma_l]
+    df_analysis['Delta_Prev'] = df_analysis['Delta'].shift(1)
+    df_analysis['Trades'] = df_analysis.apply(is_trade, axis=1)
+    return get_trades(df_analysis, pip_location)
+
+def add_mas(df):
+    for ma in set([ma for cross in CROSSES for ma in cross]):
+        df[f'MA_{ma}'] = df['mid_c'].rolling(window=ma).mean()
+    df.dropna(inplace=True)
+    return df.reset_index(drop=True)
+
+def get_price_data(source, pair):
+    if source == 'stored':
+        ic = InstrumentCollection()
+        ic.LoadInstruments(DATA_PATH)
+        df = load_candles(pair, 'H4', columns=['time', 'mid_c'], data_path=DATA_PATH)
+        return add_mas(df), ic.instruments_dict[pair]
+    df = make_candles(pair, 'H1', years=1, seed=3)[['time', 'mid_c']]
+    return add_mas(df), make_instruments([pair]).instruments_dict[pair]
+
+@pytest.mark.parametrize('source,pair', [('stored', 'EUR_USD'), ('stored', 'GBP_JPY'), ('synthetic', 'EUR_USD'), ('synthetic', 'USD_JPY')])
+def test_crossover_rows_matches_is_trade(source, pair):
+    price_data, instrument = get_price_data(source, pair)
+    pip_location = instrument.pipLocation
+    for ma_l, ma_s in CROSSES:
+        expected = reference_trades(price_data, f'MA_{ma_l}', f'MA_{ma_s}', pip_location)
+        result = get_trades(crossover_rows(price_data, f'MA_{ma_l}', f'MA_{ma_s}'), pip_location)
+        assert expected.shape[0] > 0
+        pd.testing.assert_frame_equal(result[COMPARED], expected[COMPARED])
+
+@pytest.mark.parametrize('source,pair', [('stored', 'AUD_NZD'), ('synthetic', 'GBP_JPY')])
+def test_assess_grid_matches_is_trade(source, pair):
+    price_data, instrument = get_price_data(source, pair)
+    results = assess_grid(price_data, CROSSES, instrument, 'H4')
+    for (ma_l, ma_s), result in zip(CROSSES, results):
+        expected = reference_trades(price_data, f'MA_{ma_l}', f'MA_{ma_s}', instrument.pipLocation)
+        pd.testing.assert_frame_equal(result.df_trades[COMPARED], expected[COMPARED])
+        assert result.result['num_trades'] == expected.shape[0]
+        assert result.result['total_gain'] == int(expected['Gain'].sum())
+
+def test_detect_trades_edges():
+    delta = [float('nan'), -1.0, 0.0, 0.0, -0.5, float('nan'), 1.0, -1.0, 2.0]
+    df = pd.DataFrame(dict(Delta=delta))
+    df['Delta_Prev'] = df['Delta'].shift(1)
+    expected = df.apply(is_trade, axis=1).tolist()
+    assert detect_trades(delta).tolist() == expected
+    assert expected == [NONE, NONE, BUY, NONE, SELL, NONE, NONE, SELL, BUY]
@@ -0,0 +1,145 @@
+# the fills of the backtest engine (simulation/engine.py) on small hand built candles: entries on the ask (long) or the bid
+# (short), stop loss / take profit fills, the signal indexing, the margin check and the conversion to the account currency.
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from models.instruments import Instrument
+from simulation.crossover import BUY, SELL, NONE
+from simulation.engine import CandleArrays, run_backtest, get_home_rate
+
+SPREAD = 0.0002
+
+class FixedSignals:
+    def __init__(self, signals):
+        self.signals = signals
+
+    def get_signals(self, candles):
+        return np.array(self.signals)
+
+def make_arrays(bid_rows, spread=SPREAD):
+    '''CandleArrays from (o, h, l, c) bid rows, the ask is the bid plus spread and the mid half way'''
+    bid = np.array(bid_rows, dtype=np.float64)
+    df = pd.DataFrame(dict(time=pd.date_range('2023-01-02', periods=bid.shape[0], freq='h', tz='UTC')))
+    for j, c in enumerate('ohlc'):
+        df[f'bid_{c}'] = bid[:, j]
+        df[f'ask_{c}'] = bid[:, j] + spread
+    return CandleArrays(df)
+
+def make_instrument(name='EUR_USD', pip_location=-4, margin_rate='0.02'):
+    return Instrument(name, 'CURRENCY', name.replace('_', '/'), pip_location, 0, margin_rate)
+
+def backtest(bid_rows, signals, instrument=None, spread=SPREAD, **kwargs):
+    instrument = make_instrument() if instrument is None else instrument
+    return run_backtest(make_arrays(bid_rows, spread), instrument, FixedSignals(signals), **kwargs)
+
+def trade_rows(result, cols=('entry_i', 'exit_i', 'direction', 'reason')):
+    return [tuple(row) for row in result.df_trades[list(cols)].itertuples(index=False)]
+
+FLAT = (1.1000, 1.1005, 1.0995, 1.1000)
+
+def test_ask_entry_bid_exit():
+    rows = [
+        FLAT,
+        FLAT,
+        (1.1000, 1.1030, 1.0995, 1.1020),
+        (1.1020, 1.1040, 1.1010, 1.1030),
+        (1.1030, 1.1030, 1.1000, 1.1010),
+    ]
+    # the second buy is ignored while the long is open, the sell closes it and opens a short that is closed on the last candle
+    result = backtest(rows, [NONE, BUY, BUY, SELL, NONE])
+    assert trade_rows(result) == [(1, 3, BUY, 'signal'), (3, 4, SELL, 'end')]
+    t = result.df_trades
+    assert t['entry'].tolist() == pytest.approx([1.1002, 1.1030])
+    assert t['exit'].tolist() == pytest.approx([1.1030, 1.1012])
+    assert t['pips'].tolist() == pytest.approx([28.0, 18.0])
+    assert t['pl'].tolist() == pytest.approx([28.0, 18.0])
+    assert result.balance == pytest.approx(10046.0)
+    assert result.equity[-1] == pytest.approx(10046.0)
+
+@pytest.mark.parametrize('hit_row, exit_price', [
+    ((1.0998, 1.1000, 1.0990, 1.0995), 1.0992), # the low goes through the stop, filled at the stop
+    ((1.0980, 1.0985, 1.0975, 1.0980), 1.0980), # the open gapped below the stop, filled at the open
+])
+def test_stop_loss_fill(hit_row, exit_price):
+    rows = [FLAT, FLAT, hit_row, FLAT]
+    result = backtest(rows, [BUY, NONE, NONE, NONE], sl_pips=10)
+    assert trade_rows(result, ('entry_i', 'exit_i', 'reason', 'exit')) == [(0, 2, 'sl', pytest.approx(exit_price))]
+    assert result.df_trades['pl'].iloc[0] == pytest.approx((exit_price - 1.1002) * 10000)
+
+@pytest.mark.parametrize('hit_row, exit_price', [
+    ((1.0995, 1.0995, 1.0985, 1.0990), 1.0990), # the ask low goes through the take profit, filled at it
+    ((1.0983, 1.0985, 1.0980, 1.0983), 1.0985), # the ask opened below it, filled at the ask open
+])
+def test_take_profit_fill_short(hit_row, exit_price):
+    rows = [FLAT, FLAT, hit_row, FLAT]
+    result = backtest(rows, [SELL, NONE, NONE, NONE], tp_pips=10)
+    assert trade_rows(result, ('entry_i', 'exit_i', 'reason', 'exit')) == [(0, 2, 'tp', pytest.approx(exit_price))]
+    assert result.df_trades['pl'].iloc[0] == pytest.approx((1.1000 - exit_price) * 10000)
+
+def test_stop_first_in_one_candle():
+    rows = [FLAT, (1.1000, 1.1020, 1.0980, 1.1000), FLAT]
+    result = backtest(rows, [BUY, NONE, NONE], sl_pips=10, tp_pips=10)
+    assert trade_rows(result, ('exit_i', 'reason', 'exit')) == [(1, 'sl', pytest.approx(1.0992))]
+
+def test_reentry_after_stop():
+    rows = [
+        FLAT,
+        FLAT,
+        (1.1000, 1.1000, 1.0985, 1.0990), # stops the first long, the buy of the same candle opens a new one
+        (1.0990, 1.0995, 1.0985, 1.0990),
+        (1.0990, 1.0995, 1.0985, 1.0990),
+        (1.0990, 1.0995, 1.0985, 1.0990),
+    ]
+    result = backtest(rows, [BUY, NONE, BUY, NONE, SELL, NONE], sl_pips=10)
+    assert trade_rows(result) == [(0, 2, BUY, 'sl'), (2, 4, BUY, 'signal'), (4, 5, SELL, 'end')]
+    assert result.df_trades['entry'].tolist() == pytest.approx([1.1002, 1.0992, 1.0990])
+    assert result.df_trades['exit'].tolist() == pytest.approx([1.0992, 1.0990, 1.0992])
+
+def test_no_reentry_without_stop():
+    # the buy on candle 2 is inside the open long, the next opposite signal is the sell
+    result = backtest([FLAT] * 6, [BUY, NONE, BUY, NONE, SELL, NONE])
+    assert trade_rows(result) == [(0, 4, BUY, 'signal'), (4, 5, SELL, 'end')]
+
+@pytest.mark.parametrize('margin_rate, trades, skipped', [('0.02', 2, 0), ('0.05', 0, 2)])
+def test_margin_skip(margin_rate, trades, skipped):
+    # 10000 units at 1.1 need 220 at 2% and 550 at 5%, the balance is 300
+    result = backtest([FLAT] * 4, [BUY, NONE, SELL, NONE], make_instrument(margin_rate=margin_rate), balance=300.0)
+    assert result.df_trades.shape[0] == trades
+    assert result.skipped == skipped
+
+def test_usd_jpy_home_rate():
+    rows = [
+        (110.00, 110.05, 109.95, 110.00),
+        (110.00, 110.05, 109.95, 110.00),
+        (110.00, 110.55, 109.95, 110.50),
+    ]
+    instrument = make_instrument('USD_JPY', -2)
+    result = backtest(rows, [BUY, NONE, SELL], instrument, spread=0.02)
+    t = result.df_trades.iloc[0]
+    assert (t['entry_i'], t['exit_i'], t['entry'], t['exit']) == (0, 2, pytest.approx(110.02), pytest.approx(110.50))
+    assert t['pl_quote'] == pytest.approx(4800.0)
+    assert t['pl'] == pytest.approx(4800.0 / 110.51) # converted at the mid close of the exit candle
+
+def test_cross_home_rate():
+    instrument = make_instrument('EUR_GBP')
+    arrays = make_arrays([FLAT] * 4)
+    with pytest.raises(ValueError):
+        get_home_rate(arrays, instrument)
+
+    rows = [FLAT, FLAT, (1.1000, 1.1030, 1.0995, 1.1020), FLAT]
+    conversion = [1.2, 1.3, 1.4, 1.5]
+    result = backtest(rows, [BUY, NONE, SELL, NONE], instrument, home_rate=conversion)
+    t = result.df_trades
+    assert t['pl_quote'].tolist() == pytest.approx([18.0, 18.0])
+    assert t['pl'].tolist() == pytest.approx([18.0 * 1.4, 18.0 * 1.5]) # converted at the exit candles
+
+def test_risk_sizing_in_account_currency():
+    # 1% of 10000 at a 20 pip stop with a GBP worth 1.25 USD: 100 / (0.0020 * 1.25) units, losing 100 USD at the stop
+    rows = [FLAT, (1.1000, 1.1000, 1.0975, 1.0980), FLAT]
+    result = backtest(rows, [BUY, NONE, NONE], make_instrument('EUR_GBP'), sl_pips=20, risk=0.01, home_rate=[1.25] * 3)
+    t = result.df_trades.iloc[0]
+    assert t['units'] == 40000
+    assert (t['exit_i'], t['reason']) == (1, 'sl')
+    assert t['pl'] == pytest.approx(-100.0)
@@ -0,0 +1,89 @@
+# the feature cache (infrastructure/feature_cache.py): a hit gives the values a recompute would, and a change of the candle
+# files (their size or modification time) makes the entry stale.
+
+import os
+import numpy as np
+import pytest
+
+from benchmarks.synthetic import make_candles
+from infrastructure.candle_store import STORE_DIR, write_candles, append_candles, read_candles
+from infrastructure.feature_cache import FeatureCache, moving_average, cached_indicators
+from technicals.pipeline import compute_indicators
+
+PAIR = 'EUR_USD'
+GRANULARITY = 'H1'
+SPECS = ['BollingerBands', 'ATR', 'RSI']
+
+@pytest.fixture
+def data_path(tmp_path):
+    path = str(tmp_path / 'data')
+    write_candles(make_candles(PAIR, GRANULARITY, years=1, seed=5).iloc[:4000], PAIR, GRANULARITY, os.path.join(path, STORE_DIR))
+    return path
+
+def new_cache(tmp_path, data_path):
+    return FeatureCache(path=str(tmp_path / 'cache'), data_path=data_path)
+
+def load(data_path):
+    return read_candles(PAIR, GRANULARITY, path=os.path.join(data_path, STORE_DIR))
+
+class Counted:
+    '''a compute function counting its calls'''
+    def __init__(self, fn):
+        self.fn = fn
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.fn()
+
+def test_hit_matches_recompute(tmp_path, data_path):
+    df = load(data_path)
+    expected_ma = df['mid_c'].rolling(window=20).mean().to_numpy()
+    expected = compute_indicators(df, SPECS, as_frame=False)
+
+    cache = new_cache(tmp_path, data_path)
+    for _ in range(2): # a miss, then a hit in memory
+        np.testing.assert_array_equal(moving_average(df, PAIR, GRANULARITY, 20, cache), expected_ma)
+        values = cached_indicators(df, PAIR, GRANULARITY, SPECS, cache)
+        assert sorted(values.keys()) == sorted(expected.keys())
+        for col, v in expected.items():
+            np.testing.assert_array_equal(values[col], v)
+    assert (cache.misses, cache.hits, cache.disk_hits) == (2, 2, 0)
+
+    # a new process finds them on disk
+    cache = new_cache(tmp_path, data_path)
+    values = moving_average(df, PAIR, GRANULARITY, 20, cache)
+    np.testing.assert_array_equal(values, expected_ma)
+    assert (cache.misses, cache.disk_hits) == (0, 1)
+    assert values.flags.writeable == False
+
+def test_changed_size_invalidates(tmp_path, data_path):
+    cache = new_cache(tmp_path, data_path)
+    df = load(data_path)
+    compute = Counted(lambda: df['mid_c'].rolling(window=20).mean().to_numpy())
+    cache.get(PAIR, GRANULARITY, 'MA', dict(window=20), compute)
+    cache.get(PAIR, GRANULARITY, 'MA', dict(window=20), compute)
+    assert compute.calls == 1
+
+    append_candles(make_candles(PAIR, GRANULARITY, years=1, seed=5).iloc[4000:4100], PAIR, GRANULARITY, os.path.join(data_path, STORE_DIR))
+    df = load(data_path)
+    values = cache.get(PAIR, GRANULARITY, 'MA', dict(window=20), compute)
+    assert compute.calls == 2
+    np.testing.assert_array_equal(values, df['mid_c'].rolling(window=20).mean().to_numpy())
+    # the entry of the old candle files is deleted from disk
+    folder = tmp_path / 'cache' / PAIR / GRANULARITY
+    assert len([f for f in os.listdir(folder) if f.startswith('MA_')]) == 1
+
+def test_changed_mtime_invalidates(tmp_path, data_path):
+    cache = new_cache(tmp_path, data_path)
+    compute = Counted(lambda: np.arange(10.0))
+    cache.get(PAIR, GRANULARITY, 'test', {}, compute)
+
+    year_dir = os.path.join(data_path, STORE_DIR, PAIR, GRANULARITY, '2016')
+    filename = os.path.join(year_dir, 'mid_c.bin')
+    st = os.stat(filename)
+    os.utime(filename, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9)) # rewritten with the same size
+    cache.get(PAIR, GRANULARITY, 'test', {}, compute)
+    assert compute.calls == 2
+    cache.get(PAIR, GRANULARITY, 'test', {}, compute)
+    assert compute.calls == 2
@@ -0,0 +1,82 @@
+# the resampling of the base candles (infrastructure/resample.py) around the march daylight saving change of new york:
+# the bins start at 17:00 new york time, the candles aggregate the base ones, and updating in steps gives the same series
+# as resampling the whole history at once.
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_candles
+from infrastructure.candle_store import TIME_COL, write_candles, append_candles, read_candles, to_time_values
+from infrastructure.resample import (ALIGNMENT_TZ, DAILY_ALIGNMENT, MINUTES, bin_starts, bin_start, resample_candles,
+                                     update_resampled)
+
+PAIR = 'EUR_USD'
+DST_CHANGE = pd.Timestamp('2023-03-12 07:00', tz='UTC') # 02:00 in new york, the clocks go forward an hour
+
+@pytest.fixture(scope='module')
+def base():
+    # three weeks of M5 candles, from the sunday open a week before the change
+    df = make_candles(PAIR, 'M5', years=1, seed=4, start='2023-03-05 22:00')
+    df = df[df[TIME_COL] < pd.Timestamp('2023-03-25', tz='UTC')].reset_index(drop=True)
+    df[TIME_COL] = df[TIME_COL].dt.as_unit('ns') # the unit read_candles returns
+    return df
+
+def reference(df, granularity):
+    '''the candles of granularity with pandas: the bins are floored on the new york wall clock shifted to DAILY_ALIGNMENT'''
+    shift = pd.Timedelta(hours=DAILY_ALIGNMENT)
+    wall = df[TIME_COL].dt.tz_convert(ALIGNMENT_TZ).dt.tz_localize(None)
+    start = ((wall - shift).dt.floor(f'{MINUTES[granularity]}min') + shift).dt.tz_localize(ALIGNMENT_TZ).dt.tz_convert('UTC')
+    how = {col: {'o': 'first', 'h': 'max', 'l': 'min', 'c': 'last'}[col[-1]] for col in df.columns if col.startswith(('mid', 'bid', 'ask'))}
+    how['volume'] = 'sum'
+    df_ref = df.groupby(start.rename(TIME_COL)).agg(how).reset_index()
+    return df_ref[df.columns]
+
+def test_h4_bins_follow_new_york(base):
+    df = resample_candles(base, 'H4', complete_only=False)
+    before = df[df[TIME_COL] < DST_CHANGE][TIME_COL]
+    after = df[df[TIME_COL] > DST_CHANGE][TIME_COL]
+    # 17:00 new york is 22:00 utc in winter and 21:00 utc in summer
+    assert set(before.dt.hour) == {22, 2, 6, 10, 14, 18}
+    assert set(after.dt.hour) == {21, 1, 5, 9, 13, 17}
+    assert set(df[TIME_COL].dt.tz_convert(ALIGNMENT_TZ).dt.hour) == {17, 21, 1, 5, 9, 13}
+
+@pytest.mark.parametrize('granularity', ['M15', 'H1', 'H4'])
+def test_matches_reference(base, granularity):
+    df = resample_candles(base, granularity, complete_only=False)
+    pd.testing.assert_frame_equal(df, reference(base, granularity), check_dtype=False)
+
+def test_bin_start_matches_bin_starts(base):
+    values = to_time_values(base[TIME_COL])
+    for granularity in ['M15', 'H1', 'H4']:
+        starts = bin_starts(base[TIME_COL], granularity)
+        assert np.array_equal(starts, np.array([bin_start(v, granularity) for v in values.tolist()]))
+
+def test_complete_only(base):
+    # the last base candle of the H4 bin 13:00 -> 17:00 utc is missing, so the bin is not emitted
+    df_base = base[base[TIME_COL] < pd.Timestamp('2023-03-15 16:55', tz='UTC')]
+    df = resample_candles(df_base, 'H4')
+    assert df[TIME_COL].iloc[-1] == pd.Timestamp('2023-03-15 09:00', tz='UTC')
+    df = resample_candles(base[base[TIME_COL] < pd.Timestamp('2023-03-15 17:00', tz='UTC')], 'H4')
+    assert df[TIME_COL].iloc[-1] == pd.Timestamp('2023-03-15 13:00', tz='UTC')
+
+@pytest.mark.parametrize('granularity', ['M15', 'H1', 'H4'])
+def test_incremental_equals_full(tmp_path, base, granularity):
+    path = str(tmp_path)
+    # the updates are split inside bins, on both sides of the change and over the weekend
+    cuts = ['2023-03-08 13:35', '2023-03-10 21:00', '2023-03-13 02:10', '2023-03-20 10:55']
+    bounds = [base[TIME_COL].iloc[0]] + [pd.Timestamp(c, tz='UTC') for c in cuts] + [base[TIME_COL].iloc[-1] + pd.Timedelta(minutes=5)]
+    for i, (f, t) in enumerate(zip(bounds[:-1], bounds[1:])):
+        part = base[(base[TIME_COL] >= f) & (base[TIME_COL] < t)]
+        if i == 0:
+            write_candles(part, PAIR, 'M5', path)
+        else:
+            append_candles(part, PAIR, 'M5', path)
+        update_resampled(PAIR, granularity, path=path)
+
+    incremental = read_candles(PAIR, granularity, path=path)
+    full = resample_candles(base, granularity)
+    pd.testing.assert_frame_equal(incremental, full, check_dtype=False)
+    update_resampled(PAIR, granularity, path=path, rebuild=True)
+    pd.testing.assert_frame_equal(read_candles(PAIR, granularity, path=path), full, check_dtype=False)
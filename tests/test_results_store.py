@@ -0,0 +1,48 @@
+# the results store (simulation/results_store.py): the parts written by write_results and their manifest lines read back
+# with the filters of read_results.
+
+import os
+import pandas as pd
+
+from simulation.results_store import MANIFEST, get_store_dir, read_manifest, write_results, read_results, list_runs
+
+NAME = 'ma_res'
+
+def make_results(pairs, granularities, value):
+    rows = [dict(pair=p, granularity=g, cross='MA_10_MA_20', total_gain=value + i) for i, (p, g) in
+            enumerate([(p, g) for p in pairs for g in granularities])]
+    return pd.DataFrame(rows)
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path)
+    df_1 = make_results(['EUR_USD', 'GBP_JPY'], ['H1', 'H4'], 0.0)
+    df_2 = make_results(['EUR_USD', 'AUD_CAD'], ['H4'], 100.0)
+    write_results(df_1, NAME, path, 'run1', 'pair', 'granularity')
+    write_results(df_2, NAME, path, 'run2', 'pair', 'granularity')
+
+    store_dir = get_store_dir(path, NAME)
+    manifest = read_manifest(store_dir)
+    assert os.path.isfile(os.path.join(store_dir, MANIFEST))
+    assert [(e['run_id'], e['pair'], e['granularity'], e['rows']) for e in manifest] == [
+        ('run1', 'EUR_USD', 'H1', 1), ('run1', 'EUR_USD', 'H4', 1), ('run1', 'GBP_JPY', 'H1', 1), ('run1', 'GBP_JPY', 'H4', 1),
+        ('run2', 'EUR_USD', 'H4', 1), ('run2', 'AUD_CAD', 'H4', 1),
+    ]
+    assert all([os.path.isfile(os.path.join(store_dir, e['file'])) for e in manifest])
+    assert list_runs(NAME, path) == ['run1', 'run2']
+
+    pd.testing.assert_frame_equal(read_results(NAME, path), pd.concat([df_1, df_2]).reset_index(drop=True))
+    pd.testing.assert_frame_equal(read_results(NAME, path, run_id='run2'), df_2)
+    df = read_results(NAME, path, pairs=['EUR_USD'], granularity='H4')
+    assert df['total_gain'].tolist() == [1.0, 100.0]
+    df = read_results(NAME, path, run_id='run1', pairs=['GBP_JPY', 'AUD_CAD'])
+    assert list(zip(df['pair'], df['granularity'])) == [('GBP_JPY', 'H1'), ('GBP_JPY', 'H4')]
+    assert read_results(NAME, path, run_id='run3').shape == (0, 0)
+
+def test_legacy_pickle(tmp_path):
+    path = str(tmp_path)
+    df_old = make_results(['EUR_USD'], ['H1'], -1.0)
+    df_old.to_pickle(os.path.join(path, f'{NAME}.pkl'))
+    df_new = make_results(['EUR_USD'], ['H1'], 5.0)
+    write_results(df_new, NAME, path, 'run1', 'pair', 'granularity')
+    pd.testing.assert_frame_equal(read_results(NAME, path), df_new)
+    pd.testing.assert_frame_equal(read_results(NAME, path, include_legacy=True), pd.concat([df_old, df_new]).reset_index(drop=True))
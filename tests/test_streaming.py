@@ -0,0 +1,40 @@
+# the streaming indicators (technicals/streaming.py) against the batch ones of technicals/pipeline.py: fed one candle at a
+# time, every column matches compute_indicators to floating point tolerance, with the NaNs of the warm up in the same rows.
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import make_candles
+from infrastructure.candle_store import load_candles
+from technicals.pipeline import compute_indicators
+from technicals.streaming import IndicatorSet
+
+DATA_PATH = os.path.join(os.path.dirname(__file__), '..', 'data')
+SPECS = ['BollingerBands', 'ATR', 'KeltnerChannel', 'RSI', 'MACD']
+PARAM_SPECS = [('BollingerBands', dict(n=10, s=3)), ('ATR', dict(n=7)), ('RSI', dict(n=21)),
+               ('MACD', dict(n_slow=20, n_fast=8, n_signal=5))]
+
+def stream(df, specs):
+    indicators = IndicatorSet(specs)
+    rows = [indicators.update(candle) for candle in df[['mid_o', 'mid_h', 'mid_l', 'mid_c']].to_dict('records')]
+    return pd.DataFrame(rows, index=df.index)
+
+def assert_matches(df, specs):
+    batch = compute_indicators(df, specs)
+    streamed = stream(df, specs)
+    assert sorted(streamed.columns) == sorted(batch.columns)
+    for col in batch.columns:
+        np.testing.assert_allclose(streamed[col].to_numpy(dtype=np.float64), batch[col].to_numpy(dtype=np.float64),
+                                   rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=col)
+
+@pytest.mark.parametrize('pair', ['EUR_USD', 'GBP_JPY'])
+def test_stored_candles(pair):
+    df = load_candles(pair, 'H4', data_path=DATA_PATH)
+    assert_matches(df, SPECS)
+
+@pytest.mark.parametrize('specs', [SPECS, PARAM_SPECS])
+def test_synthetic_candles(specs):
+    df = make_candles('AUD_JPY', 'H1', years=1, seed=3)
+    assert_matches(df, specs)
@@ -0,0 +1,65 @@
+# the walk-forward of the ma cross (simulation/walk_forward.py): the windows of get_windows and run_walk_forward on the
+# stored H4 candles, which must give exactly folds windows per pair with the last one ending on the last candle.
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from infrastructure.candle_store import load_candles
+from infrastructure.feature_cache import feature_cache
+from simulation.results_store import read_results
+from simulation.walk_forward import get_windows, pick_best, run_walk_forward
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+def make_times(start='2016-01-04', periods=5000, freq='4h'):
+    return pd.Series(pd.date_range(start, periods=periods, freq=freq, tz='UTC'))
+
+def assert_contiguous(windows, n):
+    assert all([is_end == oos_start for _, is_end, oos_start, _ in windows])
+    assert all([windows[k][3] == windows[k + 1][2] for k in range(len(windows) - 1)])
+    assert windows[-1][3] == n
+
+@pytest.mark.parametrize('folds', [1, 3, 7, 20])
+@pytest.mark.parametrize('anchored', [False, True])
+def test_windows_folds(folds, anchored):
+    times = make_times()
+    windows = get_windows(times, '365D', folds=folds, anchored=anchored)
+    assert len(windows) == folds
+    assert_contiguous(windows, times.shape[0])
+    assert windows[0][:2] == (0, 365 * 6)
+    if anchored == True:
+        assert all([w[0] == 0 for w in windows])
+
+def test_windows_out_sample():
+    times = make_times()
+    windows = get_windows(times, '365D', out_sample='90D')
+    assert_contiguous(windows, times.shape[0])
+    # full 90 day windows, the last one holds what is left
+    assert [w[3] - w[2] for w in windows[:-1]] == [90 * 6] * (len(windows) - 1)
+    assert 0 < windows[-1][3] - windows[-1][2] <= 90 * 6
+
+def test_windows_in_sample_too_long():
+    assert get_windows(make_times(periods=100), '365D', folds=5) == []
+
+def test_pick_best():
+    assert pick_best(np.array([3, 5, 0]), np.array([10.0, 20.0, 50.0])) == 1
+    assert pick_best(np.array([3, 5, 1]), np.array([10.0, 20.0, 15.0]), metric='average_gain') == 2
+    assert pick_best(np.array([0, 0]), np.array([0.0, 0.0])) == -1
+    assert pick_best(np.array([], dtype=np.int64), np.array([])) == -1
+
+def test_run_walk_forward(tmp_path, monkeypatch):
+    monkeypatch.chdir(ROOT) # the stored candles in ./data
+    monkeypatch.setattr(feature_cache, 'path', str(tmp_path / 'cache'))
+    folds = 6
+    df_summary = run_walk_forward(curr_list=['EUR', 'USD', 'JPY'], granularity=['H4'], ma_long=[20, 40], ma_short=[10],
+                                  folds=folds, filepath=str(tmp_path))
+    assert df_summary['folds'].tolist() == [folds] * df_summary.shape[0]
+
+    df = read_results('ma_walk_forward', str(tmp_path))
+    assert sorted(df['pair'].unique()) == sorted(df_summary['pair'])
+    for pair, df_pair in df.groupby('pair'):
+        assert df_pair['fold'].tolist() == list(range(folds))
+        assert df_pair['oos_to'].iloc[-1] == load_candles(pair, 'H4', columns=['time'])['time'].iloc[-1]
+        assert (df_pair['oos_from'].iloc[1:].to_numpy() > df_pair['oos_to'].iloc[:-1].to_numpy()).all()